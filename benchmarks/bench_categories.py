@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+"""
+Category resolution of `-listings` listings spread over `-paths` distinct
+taxonomy paths, built from the levels of the category mappers of the
+shipped configs: scanning every path against the mapper, as
+`WooComm._generate_custom_structure` used to, against `CategoryIndex`.
+
+The categories found both ways have to be the same for every listing,
+exits with 1 otherwise. Reported: microseconds per listing both ways, the
+memo hit rate, and how many listings `longest_prefix` resolves.
+
+Usage:
+    python -m benchmarks.bench_categories -listings 100000 -paths 300
+"""
+import glob
+import json
+import os
+import random
+import sys
+import time
+from sys import argv
+
+from workflow.categories import LONGEST_PREFIX, PATH_SEPARATOR, CategoryIndex
+
+from .bench_handler import CONFIG_DIR, getopts
+
+
+def category_mappers():
+    mappers = []
+
+    def collect(steps):
+        for step in steps or []:
+            custom = step['data'].get('custom')
+
+            if custom and custom.get('category_mapper'):
+                mappers.append(custom['category_mapper'])
+
+            collect(step['data'].get('steps'))
+
+    for path in sorted(glob.glob(os.path.join(CONFIG_DIR, '*.json'))):
+        with open(path) as json_file:
+            collect(json.load(json_file)['steps'])
+
+    return mappers
+
+
+def scan(category_mapper, taxonomy_path):
+    """Categories the way they were resolved before CategoryIndex."""
+    categories = []
+
+    for tax_item in taxonomy_path:
+        if tax_item in category_mapper:
+            categories.append({'id': category_mapper[tax_item]})
+
+    category_string = ', '.join(taxonomy_path)
+
+    if category_string in category_mapper:
+        categories.append({'id': category_mapper[category_string]})
+
+    return list({v['id']: v for v in categories}.values())
+
+
+def taxonomy_paths(category_mapper, count, rand):
+    known = [key.split(PATH_SEPARATOR) for key in category_mapper]
+    levels = sorted({level for path in known for level in path}) + ['Other', 'Misc']
+    paths = set()
+
+    while len(paths) < count:
+        path = list(rand.choice(known)) if rand.random() < 0.7 else []
+
+        for _ in range(rand.randint(0 if path else 1, 2)):
+            path.append(rand.choice(levels))
+
+        paths.add(tuple(path))
+
+    return [list(path) for path in sorted(paths)]
+
+
+def timed(func, listings):
+    start = time.perf_counter()
+    found = [func(path) for path in listings]
+
+    return found, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    myargs = getopts(argv)
+    rand = random.Random(int(myargs.get('-seed', 1)))
+    listing_count = int(myargs.get('-listings', 100000))
+    category_mapper = max(category_mappers(), key=len)
+    paths = taxonomy_paths(category_mapper, int(myargs.get('-paths', 300)), rand)
+    listings = [rand.choice(paths) for _ in range(listing_count)]
+
+    expected, scan_time = timed(lambda path: scan(category_mapper, path), listings)
+    index = CategoryIndex(category_mapper)
+    found, index_time = timed(index.categories, listings)
+    differences = sum(1 for want, got in zip(expected, found) if want != got)
+    prefix_index = CategoryIndex(category_mapper, LONGEST_PREFIX)
+    by_prefix = sum(1 for path in listings if prefix_index.category_ids(path))
+
+    print(json.dumps({
+        'mapper_entries': len(category_mapper),
+        'listings': listing_count,
+        'distinct_paths': len(paths),
+        'differences': differences,
+        'scan_us_per_listing': round(scan_time / listing_count * 1e6, 3),
+        'index_us_per_listing': round(index_time / listing_count * 1e6, 3),
+        'hit_rate': round(1 - index.misses / float(listing_count), 4),
+        'resolved_by_longest_prefix': by_prefix,
+    }, indent=4))
+
+    sys.exit(1 if differences else 0)
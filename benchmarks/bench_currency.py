@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+"""
+Cost of currency conversions while shaping variations: a CurrencyConverter
+loaded for every conversion, as variations used to be priced, against the
+converter shared by the process.
+
+Reported: loading the ECB rate history, loading it from a snapshot, one
+conversion with a fresh CurrencyConverter and with the shared converter,
+and `WooComm._generate_variations` per variation on a listing with
+`-options` sizes by `-options` colours.
+
+Usage:
+    python -m benchmarks.bench_currency -options 14
+"""
+import decimal
+import json
+import os
+import tempfile
+import time
+import timeit
+from sys import argv
+
+from currency_converter import CurrencyConverter
+
+from workflow import currency
+from workflow.connectors.woocomm import WooComm
+
+from .bench_handler import getopts
+from .fake_transport import make_variable_listing
+
+
+def best_of(func, number, repeat=3):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+if __name__ == '__main__':
+    myargs = getopts(argv)
+    options = int(myargs.get('-options', 14))
+    amount = decimal.Decimal('24.50')
+
+    load = best_of(CurrencyConverter, 1)
+    fresh = best_of(lambda: CurrencyConverter().convert(amount, 'GBP', 'USD'), 1)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        snapshot_path = os.path.join(tmp_dir, 'rates.pickle')
+        currency.RateProvider(snapshot_path=snapshot_path)
+        snapshot_load = best_of(lambda: currency.RateProvider(snapshot_path=snapshot_path), 1)
+
+    converter = currency.get_converter()
+    shared = best_of(lambda: converter.convert(amount, 'GBP', 'USD'), 100000)
+
+    woocomm = WooComm({'data': {}}, url='http://woo.bench', consumer_key='ck', consumer_secret='cs')
+    listing = make_variable_listing(1, options=options)
+    variations = len(listing['products'])
+    start = time.perf_counter()
+    woocomm._generate_variations(listing)
+    generate = time.perf_counter() - start
+
+    print(json.dumps({
+        'load_rates_ms': round(load * 1e3, 2),
+        'load_snapshot_ms': round(snapshot_load * 1e3, 2),
+        'fresh_converter_convert_ms': round(fresh * 1e3, 2),
+        'shared_converter_convert_us': round(shared * 1e6, 3),
+        'variations': variations,
+        'generate_variations_us_per_variation': round(generate / variations * 1e6, 2),
+    }, indent=4))
@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+"""
+End-to-end throughput of the shipped workflow configs against local
+stand-ins of the data gate, Etsy and WooCommerce (see `stub_servers`).
+
+Every config runs in a fresh process against freshly seeded stubs holding
+`-entities` entities, listings and products. Reported per config: entities
+per second, requests and errors per service, request latency p50/p95/p99
+as seen by the workflow, and the peak RSS of the process running it.
+
+`-latency` and `-jitter` (seconds) and `-error_rate` (0 to 1) shape the
+stubs, `-seed` makes jitter and errors repeat between runs. `-configs`
+picks configs by name, comma separated, all by default. `-engine async`
+runs on AsyncWorkflowHandler, `-concurrency` sets the number of items
+every loop and entity unit runs at once.
+
+Usage:
+    python -m benchmarks.bench_e2e -entities 200 -latency 0.005 -jitter 0.002
+    python -m benchmarks.bench_e2e -configs woocomm_update_products -engine async -concurrency 8
+"""
+import concurrent.futures
+import contextlib
+import glob
+import io
+import json
+import multiprocessing
+import os
+import resource
+import threading
+import time
+from sys import argv
+from urllib.parse import urlsplit
+
+import httpx
+from requests.adapters import HTTPAdapter
+
+from .bench_handler import (
+    CONFIG_DIR,
+    ENGINES,
+    PLACEHOLDERS,
+    getopts,
+    load_workflow,
+    set_concurrency,
+    set_option,
+)
+from .stub_servers import DataGateStub, EtsyStub, WooCommerceStub
+
+
+# Configs reading a single entity.
+SINGLE_ENTITY_CONFIGS = ('woocomm_update_product',)
+
+# Configs exporting listings that aren't on WooCommerce yet, they only post
+# listings without a `woocomm_listing_id`.
+NEW_LISTING_CONFIGS = ('woocomm_create_products',)
+
+
+def percentile(values, q):
+    """Nearest rank percentile of sorted `values`."""
+    if not values:
+        return None
+
+    rank = max(0, min(len(values) - 1, int(round(q / 100.0 * len(values) + 0.5)) - 1))
+
+    return values[rank]
+
+
+class LatencyRecorder(object):
+    def __init__(self, services):
+        """
+        Time every request made through `requests`, or the async client,
+        while active, by the service, from `services` {host: name}, it went
+        to.
+        """
+        self.services = services
+        self.lock = threading.Lock()
+        self.latencies = {name: [] for name in services.values()}
+        self.errors = {name: 0 for name in services.values()}
+        self.original = None
+        self.original_async = None
+
+    def _observe(self, url, elapsed, status_code):
+        service = self.services.get(urlsplit(url).netloc, 'other')
+
+        with self.lock:
+            self.latencies.setdefault(service, []).append(elapsed)
+
+            if status_code >= 400:
+                self.errors[service] = self.errors.get(service, 0) + 1
+
+    def __enter__(self):
+        recorder = self
+        send = self.original = HTTPAdapter.send
+        handle = self.original_async = httpx.AsyncHTTPTransport.handle_async_request
+
+        def timed_send(adapter, request, **kwargs):
+            start = time.perf_counter()
+            response = send(adapter, request, **kwargs)
+            recorder._observe(request.url, time.perf_counter() - start, response.status_code)
+
+            return response
+
+        async def timed_handle(transport, request):
+            start = time.perf_counter()
+            response = await handle(transport, request)
+            recorder._observe(str(request.url), time.perf_counter() - start, response.status_code)
+
+            return response
+
+        HTTPAdapter.send = timed_send
+        httpx.AsyncHTTPTransport.handle_async_request = timed_handle
+
+        return self
+
+    def __exit__(self, *exc):
+        HTTPAdapter.send = self.original
+        httpx.AsyncHTTPTransport.handle_async_request = self.original_async
+
+    def summary(self):
+        services = {}
+        every = []
+
+        for name, latencies in sorted(self.latencies.items()):
+            every.extend(latencies)
+            services[name] = _latency_summary(sorted(latencies), self.errors.get(name, 0))
+
+        services['all'] = _latency_summary(sorted(every), sum(self.errors.values()))
+
+        return services
+
+
+def _latency_summary(latencies, errors):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': _ms(percentile(latencies, 50)),
+        'p95_ms': _ms(percentile(latencies, 95)),
+        'p99_ms': _ms(percentile(latencies, 99)),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def run_config(workflow_name, urls, engine='sync', concurrency=None, unit_options=(),
+               **handler_kwargs):
+    """
+    Run a workflow config against the stubs at `urls`, in the process
+    calling it. Meant to be run in a process of its own, so the peak RSS
+    is the one of this run. `unit_options` are (unit type, key, value)
+    triples set on every unit of the type, `handler_kwargs` go to the
+    handler.
+    """
+    placeholders = dict(
+        PLACEHOLDERS,
+        __WOOCOMM_URL__=urls['woocommerce'],
+        __WP_URL__=urls['woocommerce'],
+        __ENTITY_ID__='0',
+    )
+    workflow_doc = load_workflow(workflow_name, placeholders)
+
+    if concurrency is not None:
+        set_concurrency(workflow_doc['steps'], concurrency)
+
+    for unit_type, key, value in unit_options:
+        set_option(workflow_doc['steps'], unit_type, key, value)
+
+    handler = ENGINES[engine](
+        workflow_doc,
+        data_gate_url=urls['datagate'],
+        etsy_url='{}/v2'.format(urls['etsy']),
+        **handler_kwargs
+    )
+    recorder = LatencyRecorder({urlsplit(url).netloc: name for name, url in urls.items()})
+    error = None
+
+    with recorder, contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+
+        try:
+            handler.run()
+        except (Exception, SystemExit) as err:
+            error = repr(err)
+
+        elapsed = time.perf_counter() - start
+
+    return {
+        'seconds': elapsed,
+        'services': recorder.summary(),
+        # Kilobytes on Linux.
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'error': error,
+    }
+
+
+def start_stubs(workflow_name, entity_count, **stub_kwargs):
+    """Stubs seeded for a workflow config, started."""
+    stubs = {
+        'datagate': DataGateStub(
+            entity_count,
+            new_listings=workflow_name in NEW_LISTING_CONFIGS,
+            **stub_kwargs
+        ),
+        'etsy': EtsyStub(entity_count, **stub_kwargs),
+        'woocommerce': WooCommerceStub(entity_count, **stub_kwargs),
+    }
+
+    for stub in stubs.values():
+        stub.start()
+
+    return stubs
+
+
+def run_benchmark(workflow_name, entity_count, engine='sync', concurrency=None, **stub_kwargs):
+    stubs = start_stubs(workflow_name, entity_count, **stub_kwargs)
+
+    context = multiprocessing.get_context('spawn')
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as executor:
+            result = executor.submit(
+                run_config,
+                workflow_name,
+                {name: stub.url for name, stub in stubs.items()},
+                engine,
+                concurrency
+            ).result()
+    finally:
+        for stub in stubs.values():
+            stub.stop()
+
+    entities = 1 if workflow_name in SINGLE_ENTITY_CONFIGS else entity_count
+
+    return {
+        'config': workflow_name,
+        'engine': engine,
+        'entities': entities,
+        'seconds': round(result['seconds'], 4),
+        'entities_per_second': round(entities / result['seconds'], 2),
+        'peak_rss_kb': result['peak_rss_kb'],
+        'services': result['services'],
+        'error': result['error'],
+    }
+
+
+def shipped_configs():
+    return sorted(
+        os.path.splitext(os.path.basename(path))[0]
+        for path in glob.glob(os.path.join(CONFIG_DIR, '*.json'))
+    )
+
+
+if __name__ == '__main__':
+    myargs = getopts(argv)
+    entity_count = int(myargs.get('-entities', 100))
+    engine = myargs.get('-engine', 'sync')
+    concurrency = myargs.get('-concurrency')
+    seed = myargs.get('-seed', 0)
+    configs = shipped_configs()
+
+    if myargs.get('-configs'):
+        configs = myargs['-configs'].split(',')
+
+    results = [
+        run_benchmark(
+            workflow_name,
+            entity_count,
+            engine=engine,
+            concurrency=None if concurrency is None else int(concurrency),
+            latency=float(myargs.get('-latency', 0)),
+            jitter=float(myargs.get('-jitter', 0)),
+            error_rate=float(myargs.get('-error_rate', 0)),
+            seed=int(seed),
+        )
+        for workflow_name in configs
+    ]
+
+    print(json.dumps(results, indent=4))
@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+"""
+Per-entity overhead of WorkflowHandler on a shipped workflow config.
+
+All HTTP is answered in-process by `FakeTransport` and the currency
+converter is replaced by a constant rate, so the numbers are the cost of
+walking the workflow, mapping and building requests for one entity.
+
+`-page_latency` and `-request_latency` (seconds) make the fake data gate
+pages and every other request slow, `-prefetch` overrides the number of
+entity pages read ahead by the top level entity unit and `-concurrency`
+sets the number of items every loop and entity unit runs at once. `-engine async`
+runs the workflow on AsyncWorkflowHandler instead of WorkflowHandler.
+
+`-record cassette.jsonl.gz` keeps every HTTP exchange of the last run in a
+cassette, `-replay cassette.jsonl.gz` answers the requests from one instead
+of the fake transport, taking the recorded latency times `-latency_scale`
+(default 0, answer right away).
+
+`-ref REF` runs the benchmark a second time on the `workflow` package and
+configs of git ref REF, e.g. the commit before a change, and reports both
+runs. The ref runs in a process of its own; options its workflow package
+doesn't support make that run fail.
+
+Usage:
+    python -m benchmarks.bench_handler -config woocomm_update_products -entities 500 -repeat 5
+    python -m benchmarks.bench_handler -entities 500 -page_latency 0.2 -request_latency 0.002 -prefetch 0
+    python -m benchmarks.bench_handler -entities 500 -replay run.jsonl.gz -latency_scale 1
+    python -m benchmarks.bench_handler -entities 500 -ref HEAD~1
+"""
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from sys import argv
+
+from workflow import handler as handler_module
+from workflow.handler import WorkflowHandler
+
+# Workflow packages of older refs, see -ref, may not have these yet.
+try:
+    from workflow import currency
+except ImportError:
+    currency = None
+
+try:
+    from workflow.async_handler import AsyncWorkflowHandler
+except ImportError:
+    AsyncWorkflowHandler = None
+
+try:
+    from workflow.cassette import CassettePlayer, CassetteRecorder
+except ImportError:
+    CassettePlayer = CassetteRecorder = None
+
+from .fake_transport import FakeTransport, patched_transport
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+CONFIG_DIR = os.path.join(ROOT_DIR, 'workflow', 'workflow_configs')
+
+ENGINES = {
+    'sync': WorkflowHandler,
+    'async': AsyncWorkflowHandler,
+}
+
+PLACEHOLDERS = {
+    '__JWT_TOKEN__': 'JWT bench',
+    '__ORG_ID__': 'bench-org',
+    '__IMPORT_MAPPER_ID__': 'bench-mapper',
+    '__WOOCOMM_VENDOR_ID__': '1',
+    '__WOOCOMM_URL__': 'http://woo.bench',
+    '__WOOCOMM_CONSUMER_KEY__': 'ck_bench',
+    '__WOOCOMM_CONSUMER_SECRET__': 'cs_bench',
+    '__WP_URL__': 'http://woo.bench',
+    '__WP_USER__': 'bench',
+    '__WP_PASS__': 'bench',
+    '__ETSY_SHOP_URL__': '/shops/bench/listings/active',
+    '__ETSY_OAUTH_TOKEN__': 'bench',
+    '__ETSY_OAUTH_TOKEN_SECRET__': 'bench',
+    '__ETSY_CONSUMER_KEY__': 'bench',
+    '__ETSY_CONSUMER_SECRET__': 'bench',
+}
+
+
+class ConstantRateConverter(object):
+    def convert(self, amount, currency, new_currency='EUR', date=None):
+        return float(amount) * 1.25
+
+
+def use_constant_rate():
+    """Replace the currency converter everywhere products are shaped."""
+    if currency is not None:
+        currency.set_converter(ConstantRateConverter())
+        return
+
+    # Older workflow packages make a CurrencyConverter per conversion.
+    from workflow.connectors import woocomm
+
+    for module in (handler_module, woocomm):
+        if hasattr(module, 'CurrencyConverter'):
+            module.CurrencyConverter = ConstantRateConverter
+
+
+def getopts(argv):
+    opts = {}
+
+    while argv:
+        if argv[0][0] == '-':
+            opts[argv[0]] = argv[1]
+
+        argv = argv[1:]
+
+    return opts
+
+
+def load_workflow(name, placeholders=PLACEHOLDERS):
+    with open(os.path.join(CONFIG_DIR, '{}.json'.format(name))) as json_file:
+        workflow_data_json = json_file.read()
+
+    for placeholder, value in placeholders.items():
+        workflow_data_json = workflow_data_json.replace(placeholder, value)
+
+    return json.loads(workflow_data_json)
+
+
+def set_option(steps, unit_type, key, value):
+    for step in steps or []:
+        if step['type'] == unit_type:
+            step['data'][key] = value
+
+        set_option(step['data'].get('steps'), unit_type, key, value)
+
+
+def set_concurrency(steps, concurrency):
+    """Run loop items, and the entities of entity units, `concurrency` at once."""
+    set_option(steps, 'loop', 'concurrency', concurrency)
+    set_option(steps, 'entity', 'concurrency', concurrency)
+
+
+def run_once(workflow_name, entity_count, prefetch=None, concurrency=None,
+             engine='sync', record=None, replay=None, latency_scale=0,
+             **transport_kwargs):
+    workflow_doc = load_workflow(workflow_name)
+
+    if prefetch is not None:
+        set_option(workflow_doc['steps'], 'entity', 'prefetch', prefetch)
+
+    if concurrency is not None:
+        set_concurrency(workflow_doc['steps'], concurrency)
+
+    handler = ENGINES[engine](
+        workflow_doc,
+        data_gate_url='http://datagate.bench',
+    )
+
+    with contextlib.ExitStack() as stack:
+        if replay:
+            transport = stack.enter_context(CassettePlayer(replay, latency_scale))
+        else:
+            transport = FakeTransport(entity_count, **transport_kwargs)
+            stack.enter_context(patched_transport(transport))
+
+        if record:
+            stack.enter_context(CassetteRecorder(record))
+
+        stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+
+        start = time.perf_counter()
+        handler.run()
+        elapsed = time.perf_counter() - start
+
+    if replay:
+        return elapsed, transport.served
+
+    return elapsed, transport.calls
+
+
+def run_ref(ref, args):
+    """
+    Run this benchmark with `args` on the workflow package of git `ref`,
+    exported next to a copy of the benchmarks, and return its report.
+    """
+    archive = subprocess.run(
+        ['git', 'archive', ref, 'workflow'],
+        cwd=ROOT_DIR,
+        stdout=subprocess.PIPE,
+        check=True
+    ).stdout
+
+    with tempfile.TemporaryDirectory() as tree:
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            tar.extractall(tree)
+
+        shutil.copytree(
+            os.path.join(ROOT_DIR, 'benchmarks'),
+            os.path.join(tree, 'benchmarks'),
+            ignore=shutil.ignore_patterns('__pycache__')
+        )
+        run = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_handler'] + args,
+            cwd=tree,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True
+        )
+
+    if run.returncode != 0:
+        return {'ref': ref, 'error': run.stderr.strip().splitlines()[-1:]}
+
+    return dict(json.loads(run.stdout), ref=ref)
+
+
+if __name__ == '__main__':
+    myargs = getopts(argv)
+    workflow_name = myargs.get('-config', 'woocomm_update_products')
+    entity_count = int(myargs.get('-entities', 500))
+    repeat = int(myargs.get('-repeat', 5))
+    prefetch = myargs.get('-prefetch')
+    concurrency = myargs.get('-concurrency')
+    engine = myargs.get('-engine', 'sync')
+    page_latency = float(myargs.get('-page_latency', 0))
+    request_latency = float(myargs.get('-request_latency', 0))
+    record = myargs.get('-record')
+    replay = myargs.get('-replay')
+    latency_scale = float(myargs.get('-latency_scale', 0))
+    ref = myargs.get('-ref')
+
+    if ENGINES.get(engine) is None:
+        sys.exit('The {} engine is not available in this tree'.format(engine))
+
+    use_constant_rate()
+
+    timings = []
+
+    for _ in range(repeat):
+        elapsed, calls = run_once(
+            workflow_name,
+            entity_count,
+            prefetch=None if prefetch is None else int(prefetch),
+            concurrency=None if concurrency is None else int(concurrency),
+            engine=engine,
+            record=record,
+            replay=replay,
+            latency_scale=latency_scale,
+            page_latency=page_latency,
+            request_latency=request_latency,
+        )
+        timings.append(elapsed)
+
+    best = min(timings)
+
+    report = {
+        'config': workflow_name,
+        'engine': engine,
+        'entities': entity_count,
+        'http_calls': calls,
+        'best_seconds': round(best, 4),
+        'us_per_entity': round(best / entity_count * 1e6, 1),
+    }
+
+    if ref:
+        args = argv[1:]
+        del args[args.index('-ref'):args.index('-ref') + 2]
+        ref_report = run_ref(ref, args)
+        report = {'current': report, 'ref': ref_report}
+
+        if 'us_per_entity' in ref_report:
+            report['speedup'] = round(ref_report['us_per_entity'] / report['current']['us_per_entity'], 2)
+
+    print(json.dumps(report, indent=4))
@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+"""
+Micro-benchmarks of DataMapper and the helpers that run once or more per
+entity: the mapper building blocks (`get_nested`, `set_nested`,
+`list_of_objects`), `utils.form_doc` with the export maps of the shipped
+configs, `RegexRemover` on listing descriptions and `grouper`.
+
+Docs come in three sizes: a plain product, a product with hundreds of
+images and variations, and `[{}]` rules over thousands of items.
+
+Every case is timed over enough calls to take at least 0.2 seconds, the
+best of `-repeat` rounds counts, so the numbers are stable between runs.
+Allocations are the peak memory traced by tracemalloc over one call.
+
+`-save results.json` keeps the results, `-compare results.json` reports
+the change against saved results, to spot regressions between versions.
+`-cases` runs only the cases whose name contains one of the given,
+comma separated, strings.
+
+Usage:
+    python -m benchmarks.bench_mapper -repeat 5 -save before.json
+    python -m benchmarks.bench_mapper -repeat 5 -compare before.json
+"""
+import copy
+import glob
+import json
+import os
+import timeit
+import tracemalloc
+from sys import argv
+
+from workflow import mapper
+from workflow.connectors.woocomm import DESCRIPTION_CLEANERS
+from workflow.utils import RegexRemover, form_doc, grouper
+
+from .bench_handler import CONFIG_DIR, getopts
+
+
+# The description cleaners WooComm._generate_custom_structure runs.
+DESCRIPTION_REGEXES = list(DESCRIPTION_CLEANERS)
+
+# Every kind of rule DataMapper knows.
+RULES_MAP = {
+    'title': 'name&meta:title',
+    'sku': 'sku[]',
+    'quantity': 'stock_quantity<int>',
+    'listing_id': 'meta:listing_id<str>',
+    'price': '{}',
+    'status': 'state:{}.value',
+    'images': 'gallery[{}]',
+    'dimensions:width': 'size:width',
+    'ignored_parts': {'vendor_id': '1'},
+}
+
+
+def export_maps():
+    """Export maps of the shipped configs, by config name."""
+    maps = {}
+
+    def collect(name, steps):
+        for step in steps or []:
+            export_mapper = step['data'].get('export_mapper')
+
+            if export_mapper:
+                maps[name] = export_mapper['map']
+
+            collect(name, step['data'].get('steps'))
+
+    for path in sorted(glob.glob(os.path.join(CONFIG_DIR, '*.json'))):
+        with open(path) as json_file:
+            collect(os.path.splitext(os.path.basename(path))[0], json.load(json_file)['steps'])
+
+    return maps
+
+
+def product_doc(images=5, variations=4):
+    """A listing shaped into a product, as export maps get it."""
+    return {
+        'url': 'https://www.etsy.com/listing/1/item',
+        'sku': ['SKU-1'],
+        'price': '24.01',
+        'currency_code': 'GBP',
+        'title': '  Listing 1  ',
+        'status': 'publish',
+        'listing_id': 100001,
+        'woocomm_listing_id': 5001,
+        'quantity': '3',
+        'type': 'variable' if variations else 'simple',
+        'categories': [{'id': 17}],
+        'category_path': ['Jewelery', 'Necklaces'],
+        'description': 'Handmade with care. Each piece is unique.\n' * 4,
+        'dimensions': {'width': 10, 'height': 4},
+        'images': [
+            {'src': 'https://i.etsystatic.com/1/il_fullxfull.{}.jpg'.format(n), 'position': n}
+            for n in range(images)
+        ],
+        'attributes': [
+            {'name': 'Size', 'options': ['Size {}'.format(n) for n in range(variations)], 'variation': True}
+        ],
+        'create': [
+            {
+                'regular_price': '{}.50'.format(20 + n),
+                'stock_quantity': n,
+                'attributes': [{'name': 'Size', 'option': 'Size {}'.format(n)}],
+            } for n in range(variations)
+        ],
+    }
+
+
+def clean_description(repeat=1):
+    return (
+        'Handmade with care. Each piece is unique.\n'
+        '<p>Made from 100% cotton, ships in 3.5 days.</p>\n'
+    ) * repeat
+
+
+def description(repeat=1):
+    return (
+        'Handmade with care. Visit our Etsy shop for more. '
+        'Each piece is unique.\nCHECK OUT THE MATCHING earrings!\n'
+        'See https://www.etsy.com/shop_home/spapla for more.\n'
+    ) * repeat
+
+
+def mapper_cases(name, _map, doc):
+    # DataMapper drops ignored_parts from the map it's given, every case
+    # gets a copy of its own.
+    data_mapper = mapper.DataMapper(copy.deepcopy(_map))
+    form_doc_map = copy.deepcopy(_map)
+
+    return [
+        ('form_doc_dict/{}'.format(name), lambda: data_mapper.form_doc_dict(doc)),
+        ('utils.form_doc/{}'.format(name), lambda: form_doc(doc, form_doc_map)),
+    ]
+
+
+def cases():
+    small = product_doc()
+    large = product_doc(images=300, variations=300)
+    found = []
+
+    for config, _map in sorted(export_maps().items()):
+        found += mapper_cases('{}/small'.format(config), _map, small)
+        found += mapper_cases('{}/large'.format(config), _map, large)
+
+    found += mapper_cases('rules/small', RULES_MAP, small)
+    found += mapper_cases('rules/large', RULES_MAP, large)
+
+    for count in (1000, 4000):
+        items = {'images': [{'id': n} for n in range(count)], 'sku': 'SKU-1'}
+        found += mapper_cases('list_of_objects_rule/{}'.format(count),
+                              {'images': 'gallery[{}]', 'sku': 'sku'}, items)
+
+    nested = {'a': {'b': {'c': {'d': 1}}}}
+    listed = {'images': [{'images': n} for n in range(100)]}
+    remover = RegexRemover(DESCRIPTION_REGEXES)
+    single_pass_remover = RegexRemover(DESCRIPTION_REGEXES, single_pass=True)
+    short_description = description()
+    long_description = description(50)
+    clean_long_description = clean_description(50)
+    page = [description(10), clean_description(10)] * 50
+    attributes = list(range(1000))
+
+    found += [
+        ('get_nested/depth_4', lambda: mapper.get_nested(nested, ['a', 'b', 'c', 'd'])),
+        ('get_nested/missing', lambda: mapper.get_nested(nested, ['a', 'x', 'c', 'd'])),
+        ('set_nested/depth_3', lambda: mapper.set_nested({}, ['a', 'b', 'c'])),
+        ('list_of_objects/100', lambda: mapper.list_of_objects(listed, ['images'], 'images')),
+        ('RegexRemover/construct', lambda: RegexRemover(DESCRIPTION_REGEXES)),
+        ('RegexRemover/short', lambda: remover.handle(short_description)),
+        ('RegexRemover/long', lambda: remover.handle(long_description)),
+        ('RegexRemover/long_nothing_to_remove', lambda: remover.handle(clean_long_description)),
+        ('RegexRemover/long_single_pass', lambda: single_pass_remover.handle(long_description)),
+        ('RegexRemover/page_of_100', lambda: remover.handle_many(page)),
+        ('grouper/1000_by_20', lambda: list(grouper(attributes, 20))),
+    ]
+
+    return found
+
+
+def measure(func, repeat):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    func()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    return {
+        'ops_per_sec': round(1 / best, 1),
+        'us_per_op': round(best * 1e6, 3),
+        'alloc_peak_bytes': peak,
+    }
+
+
+if __name__ == '__main__':
+    myargs = getopts(argv)
+    repeat = int(myargs.get('-repeat', 5))
+    selected = myargs.get('-cases')
+    baseline = {}
+
+    if myargs.get('-compare'):
+        with open(myargs['-compare']) as json_file:
+            baseline = {result['case']: result for result in json.load(json_file)}
+
+    report = []
+
+    for name, func in cases():
+        if selected and not any(part in name for part in selected.split(',')):
+            continue
+
+        result = dict(case=name, **measure(func, repeat))
+
+        if name in baseline:
+            result['change'] = round(
+                result['ops_per_sec'] / baseline[name]['ops_per_sec'] - 1, 3)
+
+        report.append(result)
+
+    if myargs.get('-save'):
+        with open(myargs['-save'], 'w') as json_file:
+            json.dump(report, json_file, indent=4)
+
+    print(json.dumps(report, indent=4))
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+"""
+Evaluation cost of the jsonpath expressions used by the shipped workflow
+configs, full jsonpath-ng versus the compiled paths from workflow.paths.
+
+Usage:
+    python -m benchmarks.bench_paths -number 20000
+"""
+import glob
+import json
+import os
+import timeit
+from sys import argv
+
+from jsonpath_ng import parse
+
+from workflow.paths import compile_path
+
+from .bench_handler import CONFIG_DIR, getopts
+from .fake_transport import make_listing
+
+
+def collect_expressions(steps, found):
+    for step in steps or []:
+        data = step.get('data', {})
+
+        for key in ('path', 'loop_path'):
+            if key in data:
+                found.add(data[key])
+
+        found.update((data.get('vars') or {}).values())
+        collect_expressions(data.get('steps'), found)
+
+    return found
+
+
+def sample_data(expression):
+    listing = make_listing(1)
+    listing.update({'id': 7, 'product_id': 5001})
+
+    if expression.startswith('$[*]'):
+        return [listing]
+
+    if expression == '$.doc_data':
+        return {'id': 1, 'doc_data': listing}
+
+    return listing
+
+
+if __name__ == '__main__':
+    myargs = getopts(argv)
+    number = int(myargs.get('-number', 20000))
+    expressions = set()
+
+    for path in sorted(glob.glob(os.path.join(CONFIG_DIR, '*.json'))):
+        with open(path) as json_file:
+            collect_expressions(json.load(json_file).get('steps'), expressions)
+
+    report = []
+
+    for expression in sorted(expressions):
+        data = sample_data(expression)
+        jsonpath_expr = parse(expression)
+        compiled = compile_path(expression)
+
+        full = timeit.timeit(
+            lambda: [match.value for match in jsonpath_expr.find(data)][0],
+            number=number)
+        fast = timeit.timeit(lambda: compiled.first(data), number=number)
+
+        report.append({
+            'expression': expression,
+            'evaluator': compiled.__class__.__name__,
+            'jsonpath_ng_us': round(full / number * 1e6, 3),
+            'compiled_us': round(fast / number * 1e6, 3),
+        })
+
+    print(json.dumps(report, indent=4))
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+"""
+Variation pricing through `pricing.usd_prices` against pricing one offering
+at a time through Decimal, as `WooComm._generate_variations` used to.
+
+Reported per listing size (`-offerings`, comma separated): microseconds per
+offering both ways. Before timing, `-check` random prices, given as Etsy
+`amount`/`divisor` and as `currency_formatted_raw` only, in every currency
+the rates know, are priced both ways and have to match to the cent. Exits
+with 1 on any difference.
+
+Usage:
+    python -m benchmarks.bench_pricing -offerings 10,100,1000 -check 20000
+"""
+import decimal
+import json
+import random
+import sys
+import timeit
+from sys import argv
+
+from workflow import currency, pricing
+
+from .bench_handler import getopts
+
+
+def offering_price(rand, currencies, with_amount=True):
+    divisor = rand.choice((1, 100, 100, 100, 1000))
+    amount = rand.choice((
+        rand.randint(1, 100),
+        rand.randint(1, 100000),
+        rand.randint(1, 10 ** 9),
+    ))
+    price = {
+        'currency_formatted_raw': str(decimal.Decimal(amount) / decimal.Decimal(divisor)),
+        'currency_code': rand.choice(currencies),
+    }
+
+    if with_amount:
+        price['amount'] = amount
+        price['divisor'] = divisor
+
+    return price
+
+
+def one_at_a_time(prices, converter):
+    return [
+        pricing.round_up(converter.convert(
+            decimal.Decimal(pricing.NOT_AMOUNT.sub('', price['currency_formatted_raw'])),
+            price['currency_code'],
+            'USD'
+        ))
+        for price in prices
+    ]
+
+
+def check(prices, converter):
+    """Prices `usd_prices` gets different from one at a time."""
+    found = pricing.usd_prices(prices, converter)
+    expected = one_at_a_time(prices, converter)
+
+    return [
+        {'price': price, 'expected': want, 'found': got}
+        for price, want, got in zip(prices, expected, found)
+        if want != got
+    ]
+
+
+def best_of(func, number, repeat=3):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+if __name__ == '__main__':
+    myargs = getopts(argv)
+    rand = random.Random(int(myargs.get('-seed', 1)))
+    converter = currency.get_converter()
+    currencies = sorted(c for c in converter.converter.currencies if c != 'EUR') + ['EUR']
+    check_count = int(myargs.get('-check', 20000))
+
+    checked = [offering_price(rand, currencies, with_amount=n % 2 == 0) for n in range(check_count)]
+    failures = check(checked, converter)
+    report = {
+        'checked': len(checked),
+        'failed': len(failures),
+        'failures': failures[:20],
+        'sizes': [],
+    }
+
+    for size in (int(count) for count in myargs.get('-offerings', '10,100,1000').split(',')):
+        prices = [offering_price(rand, ['GBP', 'EUR', 'CAD']) for _ in range(size)]
+        number = max(1, 20000 // size)
+        decimal_time = best_of(lambda: one_at_a_time(prices, converter), number)
+        usd_prices_time = best_of(lambda: pricing.usd_prices(prices, converter), number)
+
+        report['sizes'].append({
+            'offerings': size,
+            'decimal_us_per_offering': round(decimal_time / size * 1e6, 3),
+            'usd_prices_us_per_offering': round(usd_prices_time / size * 1e6, 3),
+            'speedup': round(decimal_time / usd_prices_time, 2),
+        })
+
+    print(json.dumps(report, indent=4))
+
+    sys.exit(1 if failures else 0)
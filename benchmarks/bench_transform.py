@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+"""
+Throughput of the WooCommerce product transform, in process versus spread
+over worker processes by workflow.transform.TransformPool.
+
+Listings are synthetic, with an inventory of `-options` sizes by
+`-options` colours, and go through the POST unit of
+woocomm_create_products with variations turned on. They are generated and
+sent to the workers `-batch` at a time, `-chunksize` per message. The
+currency converter is replaced by a constant rate in every process.
+
+Usage:
+    python -m benchmarks.bench_transform -listings 100000 -processes 1,2,4,8,16
+    python -m benchmarks.bench_transform -listings 2000 -options 8 -processes 4
+"""
+import json
+import time
+from sys import argv
+
+from workflow.connectors.woocomm import WooComm
+from workflow.transform import TransformPool, transform_product
+
+from .bench_handler import getopts, load_workflow, use_constant_rate
+from .fake_transport import make_variable_listing
+
+
+def product_unit():
+    workflow_doc = load_workflow('woocomm_create_products')
+    entity_read = workflow_doc['steps'][0]
+    loop = entity_read['data']['steps'][0]
+    doc = loop['data']['steps'][0]
+    doc['data']['generate_variations'] = True
+
+    return doc
+
+
+def batches(listing_count, batch_size, options):
+    for start in range(0, listing_count, batch_size):
+        stop = min(start + batch_size, listing_count)
+
+        yield [make_variable_listing(idx, options) for idx in range(start, stop)]
+
+
+def run_in_process(doc, listing_count, batch_size, options):
+    doc_data = doc['data']
+    woocomm = WooComm(
+        doc,
+        url=doc_data['url'],
+        consumer_key=doc_data['consumer_key'],
+        consumer_secret=doc_data['consumer_secret'],
+    )
+    elapsed = 0
+
+    for batch in batches(listing_count, batch_size, options):
+        start = time.perf_counter()
+
+        for listing in batch:
+            transform_product(woocomm, doc_data, listing)
+
+        elapsed += time.perf_counter() - start
+
+    return elapsed
+
+
+def run_in_pool(doc, processes, listing_count, batch_size, options, chunksize):
+    pool = TransformPool(doc, processes, setup=use_constant_rate)
+
+    try:
+        # Start the workers before timing.
+        list(pool.map([make_variable_listing(0, options)] * processes, chunksize=1))
+        elapsed = 0
+
+        for batch in batches(listing_count, batch_size, options):
+            start = time.perf_counter()
+
+            for _ in pool.map(batch, chunksize=chunksize):
+                pass
+
+            elapsed += time.perf_counter() - start
+    finally:
+        pool.shutdown()
+
+    return elapsed
+
+
+if __name__ == '__main__':
+    myargs = getopts(argv)
+    listing_count = int(myargs.get('-listings', 10000))
+    options = int(myargs.get('-options', 4))
+    batch_size = int(myargs.get('-batch', 1000))
+    chunksize = int(myargs.get('-chunksize', 16))
+    process_counts = [int(n) for n in myargs.get('-processes', '1,2,4').split(',')]
+
+    use_constant_rate()
+    doc = product_unit()
+    results = []
+
+    elapsed = run_in_process(doc, listing_count, batch_size, options)
+    results.append({
+        'processes': 0,
+        'seconds': round(elapsed, 3),
+        'listings_per_second': round(listing_count / elapsed, 1),
+    })
+
+    for processes in process_counts:
+        elapsed = run_in_pool(doc, processes, listing_count, batch_size, options, chunksize)
+        results.append({
+            'processes': processes,
+            'seconds': round(elapsed, 3),
+            'listings_per_second': round(listing_count / elapsed, 1),
+        })
+
+    print(json.dumps({
+        'listings': listing_count,
+        'variations_per_listing': options * options,
+        'chunksize': chunksize,
+        'results': results,
+    }, indent=4))
@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+"""
+Memory held by the variations of a page of `-listings` variable products
+with `-offerings` offerings each, shaped by `_generate_attributes` and
+`_generate_variations` into records, against the dict builders they
+replaced (see `bench_variations`).
+
+Every way runs in a fresh process. Reported: the memory the page itself
+takes, the peak memory traced by tracemalloc while shaping all of its
+listings and holding the results, as a page does until it's posted, and
+the two together. Records only shrink the shaping, the page is the
+listings as read from Etsy either way.
+
+Usage:
+    python -m benchmarks.bench_variation_memory -listings 10000 -offerings 16
+"""
+import concurrent.futures
+import json
+import multiprocessing
+import tracemalloc
+from sys import argv
+
+from workflow import currency
+from workflow.connectors.woocomm import WooComm
+
+from .bench_handler import getopts
+from .bench_variations import inventory_listing, reference
+
+
+def shape_page(builders, listing_count, offerings):
+    # Rates are loaded before tracing, they're held either way.
+    currency.get_converter().rate_pair('GBP', 'USD')
+    woocomm = WooComm({'data': {}}, url='http://woo.bench', consumer_key='ck', consumer_secret='cs')
+    shape = {
+        'records': lambda data: woocomm._generate_variations(woocomm._generate_attributes(data)),
+        'dicts': reference,
+    }[builders]
+
+    tracemalloc.start()
+    page = [inventory_listing(offerings) for _ in range(listing_count)]
+    page_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+
+    for listing in page:
+        shape(listing)
+
+    peak = tracemalloc.get_traced_memory()[1] - page_bytes
+    tracemalloc.stop()
+
+    return {
+        'builders': builders,
+        'page_mb': round(page_bytes / 2 ** 20, 2),
+        'shaping_peak_mb': round(peak / 2 ** 20, 2),
+        'total_peak_mb': round((page_bytes + peak) / 2 ** 20, 2),
+    }
+
+
+if __name__ == '__main__':
+    myargs = getopts(argv)
+    listing_count = int(myargs.get('-listings', 10000))
+    offerings = int(myargs.get('-offerings', 16))
+    context = multiprocessing.get_context('spawn')
+    results = []
+
+    for builders in ('dicts', 'records'):
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as executor:
+            results.append(executor.submit(shape_page, builders, listing_count, offerings).result())
+
+    print(json.dumps({
+        'listings': listing_count,
+        'offerings': offerings,
+        'results': results,
+        'shaping_peak_ratio': round(results[1]['shaping_peak_mb'] / results[0]['shaping_peak_mb'], 3),
+        'total_peak_ratio': round(results[1]['total_peak_mb'] / results[0]['total_peak_mb'], 3),
+    }, indent=4))
@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+"""
+`WooComm._generate_attributes` and `_generate_variations` on listings with
+`-offerings` offerings (comma separated counts), against the list based
+builders they replaced, which are kept here as the reference.
+
+Listings have one product per offering and three properties: a size with
+as many values as there are offerings, a colour with a few dozen and a
+material with a handful. Both builders have to give the same attributes
+and variations, exits with 1 otherwise. Reported: milliseconds per
+listing both ways, and per offering for the current builders.
+
+Usage:
+    python -m benchmarks.bench_variations -offerings 10,100,1000
+"""
+import copy
+import decimal
+import gc
+import json
+import sys
+import time
+from sys import argv
+
+from workflow import currency
+from workflow.connectors.woocomm import WooComm
+
+from .bench_handler import getopts
+
+
+def inventory_listing(offerings):
+    colours = max(1, int(offerings ** 0.5))
+
+    return {
+        'products': [
+            {
+                'property_values': [
+                    {'property_name': 'Size', 'values': ['Size {}'.format(n)]},
+                    {'property_name': 'Colour', 'values': ['Colour {}'.format(n % colours)]},
+                    {'property_name': 'Material', 'values': ['Material {}'.format(n % 5)]},
+                ],
+                'offerings': [{
+                    'price': {
+                        'amount': 2000 + n,
+                        'divisor': 100,
+                        'currency_formatted_raw': str(decimal.Decimal(2000 + n) / 100),
+                        'currency_code': 'GBP',
+                    },
+                    'quantity': n % 7,
+                }],
+            } for n in range(offerings)
+        ],
+    }
+
+
+def reference_attributes(data):
+    data['attributes'] = []
+    attributes_map = {}
+
+    if len(data['products']) == 1:
+        data['type'] = 'simple'
+    else:
+        data['type'] = 'variable'
+
+        for product in data['products']:
+            if type(product) is dict:
+                for product_value in product['property_values']:
+                    attribute_name = product_value['property_name']
+
+                    if attribute_name not in attributes_map:
+                        attributes_map[attribute_name] = []
+
+                    for attribute_value in product_value['values']:
+                        if attribute_value not in attributes_map[attribute_name]:
+                            attributes_map[attribute_name].append(attribute_value)
+
+    for attributes_map_key in attributes_map:
+        data['attributes'].append({
+            'name': attributes_map_key,
+            'visible': True,
+            'variation': True,
+            'options': attributes_map[attributes_map_key]
+        })
+
+    return data
+
+
+def reference_variations(data):
+    create_obj = []
+    cconverter = currency.get_converter()
+
+    for product in data['products']:
+        if type(product) is dict and product['property_values']:
+            attributes_map = {}
+
+            for product_value in product['property_values']:
+                attribute_name = product_value['property_name']
+
+                if attribute_name not in attributes_map:
+                    attributes_map[attribute_name] = []
+
+                for attribute_value in product_value['values']:
+                    if attribute_value not in attributes_map[attribute_name]:
+                        attributes_map[attribute_name].append(attribute_value)
+
+            for product_offering in product['offerings']:
+                amount = decimal.Decimal(product_offering['price']['currency_formatted_raw'])
+                amount_in_usd = cconverter.convert(amount, product_offering['price']['currency_code'], 'USD')
+                variation = {
+                    'regular_price': str(decimal.Decimal(amount_in_usd).quantize(
+                        decimal.Decimal('0.01'), rounding=decimal.ROUND_UP)),
+                    'purchasable': True,
+                    'stock_quantity': product_offering['quantity'],
+                    'attributes': [],
+                }
+
+                for attribute in attributes_map:
+                    for attribute_value in attributes_map[attribute]:
+                        variation['attributes'].append({'name': attribute, 'option': attribute_value})
+
+            create_obj.append(variation)
+
+    data['create'] = create_obj
+
+    return data
+
+
+def reference(data):
+    return reference_variations(reference_attributes(data))
+
+
+def best_of(func, listing, number, repeat=5):
+    """
+    Best time of `func` over `number` copies of `listing`, copied
+    beforehand. The garbage collector is off while timing, as with timeit.
+    """
+    times = []
+
+    for _ in range(repeat):
+        copies = [copy.deepcopy(listing) for _ in range(number)]
+        gc.disable()
+        start = time.perf_counter()
+
+        for data in copies:
+            func(data)
+
+        times.append((time.perf_counter() - start) / number)
+        gc.enable()
+
+    return min(times)
+
+
+if __name__ == '__main__':
+    myargs = getopts(argv)
+    woocomm = WooComm({'data': {}}, url='http://woo.bench', consumer_key='ck', consumer_secret='cs')
+    current = lambda data: woocomm._generate_variations(woocomm._generate_attributes(data))
+    report = []
+    failed = False
+
+    for size in (int(count) for count in myargs.get('-offerings', '10,100,1000').split(',')):
+        listing = inventory_listing(size)
+        same = current(copy.deepcopy(listing)) == reference(copy.deepcopy(listing))
+        failed = failed or not same
+        number = max(5, 20000 // size)
+        reference_time = best_of(reference, listing, number)
+        current_time = best_of(current, listing, number)
+
+        report.append({
+            'offerings': size,
+            'same_payloads': same,
+            'reference_ms': round(reference_time * 1e3, 3),
+            'current_ms': round(current_time * 1e3, 3),
+            'current_us_per_offering': round(current_time / size * 1e6, 3),
+            'speedup': round(reference_time / current_time, 2),
+        })
+
+    print(json.dumps(report, indent=4))
+
+    sys.exit(1 if failed else 0)
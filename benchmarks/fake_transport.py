@@ -0,0 +1,231 @@
+"""
+In-process stand-ins for the data gate and WooCommerce used by the
+benchmarks. Every request made through `requests`, or the async client of
+AsyncWorkflowHandler, is answered by `FakeTransport` without touching the
+network, so what gets measured is the workflow engine itself.
+"""
+import asyncio
+import gzip
+import json
+import re
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Workflow packages of older refs, see bench_handler -ref, may not have it.
+try:
+    import httpx
+    from workflow.aio import httpx_response, prepared_request
+except ImportError:
+    httpx = None
+
+
+def make_listing(idx):
+    """A synthetic Etsy listing shaped like the docs the data gate returns."""
+    return {
+        'listing_id': 100000 + idx,
+        'woocomm_listing_id': 5000 + idx,
+        'state': 'active',
+        'title': 'Listing {}'.format(idx),
+        'sku': ['SKU-{}'.format(idx)],
+        'url': 'https://www.etsy.com/listing/{}/item?utm_source=devsandboxapp&utm_medium=api&utm_campaign=api'.format(idx),
+        'price': '24.00',
+        'currency_code': 'GBP',
+        'quantity': 3,
+        'description': (
+            'Handmade with care. Visit our Etsy shop for more. '
+            'Each piece is unique.\nCHECK OUT THE MATCHING earrings!\n'
+        ) * 4,
+        'taxonomy_path': ['Jewelery', 'Necklaces'],
+        'main_image': {'listing_image_id': 1},
+        'images': [
+            {
+                'listing_image_id': n,
+                'url_fullxfull': 'https://i.etsystatic.com/{}/il_fullxfull.{}.jpg'.format(idx, n),
+            } for n in range(1, 6)
+        ],
+    }
+
+
+def make_variable_listing(idx, options=4):
+    """
+    A synthetic listing with an inventory of `options` sizes by `options`
+    colours, one product and offering per combination.
+    """
+    listing = make_listing(idx)
+    sizes = ['Size {}'.format(n) for n in range(options)]
+    colours = ['Colour {}'.format(n) for n in range(options)]
+    listing['products'] = [
+        {
+            'property_values': [
+                {'property_name': 'Size', 'values': [size]},
+                {'property_name': 'Colour', 'values': [colour]},
+            ],
+            'offerings': [{
+                'price': {
+                    'amount': (20 + n) * 100 + 50,
+                    'divisor': 100,
+                    'currency_formatted_raw': '{}.50'.format(20 + n),
+                    'currency_code': 'GBP',
+                },
+                'quantity': n,
+            }],
+        } for n, (size, colour) in enumerate(
+            (size, colour) for size in sizes for colour in colours)
+    ]
+
+    return listing
+
+
+class FakeTransport(HTTPAdapter):
+    """
+    Transport adapter answering data gate and WooCommerce calls from memory.
+    """
+
+    def __init__(self, entity_count, page_latency=0, request_latency=0,
+                 listing_count=0, **kwargs):
+        super(FakeTransport, self).__init__(**kwargs)
+        self.entity_count = entity_count
+        self.listing_count = listing_count
+        # Modification times of the Etsy shop listings, by index.
+        self.modified_at = {}
+        self.page_latency = page_latency
+        self.request_latency = request_latency
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def _entities_page(self, request):
+        url = urlparse(request.url)
+        query = parse_qs(url.query)
+        page = int(query.get('page', ['1'])[0])
+        page_size = int(query.get('page_size', ['1'])[0])
+        start = (page - 1) * page_size
+        stop = min(start + page_size, self.entity_count)
+        next_url = None
+
+        if stop < self.entity_count:
+            next_url = '{}://{}{}?page={}&page_size={}'.format(
+                url.scheme, url.netloc, url.path, page + 1, page_size)
+
+        return {
+            'count': self.entity_count,
+            'links': {'next': next_url, 'previous': None},
+            'results': [
+                {'id': idx, 'doc_data': make_listing(idx)}
+                for idx in range(start, stop)
+            ],
+        }
+
+    def _listings_page(self, request):
+        """A page of Etsy shop listings, newest first."""
+        query = parse_qs(urlparse(request.url).query)
+        page = int(query.get('page', ['1'])[0])
+        limit = int(query.get('limit', ['25'])[0])
+        listings = []
+
+        for idx in range(self.listing_count):
+            listing = make_listing(idx)
+            listing['last_modified_tsz'] = self.modified_at.get(idx, 1500000000 + idx)
+            listings.append(listing)
+
+        sort_key = 'listing_id'
+
+        if query.get('sort_on') == ['updated']:
+            sort_key = 'last_modified_tsz'
+
+        listings.sort(key=lambda listing: listing[sort_key],
+                      reverse=query.get('sort_order', ['down']) == ['down'])
+        start = (page - 1) * limit
+
+        return {
+            'count': self.listing_count,
+            'type': 'Listing',
+            'results': listings[start:start + limit],
+            'pagination': {
+                'next_page': page + 1 if start + limit < self.listing_count else None
+            },
+        }
+
+    def _bulk_save(self, request):
+        body = request.body
+
+        if request.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+
+        items = json.loads(body)['items']
+
+        return {'results': [{'status_code': 201} for _ in items]}
+
+    def _answer(self, request):
+        """How long to take answering a request, and the body of the answer."""
+        with self.lock:
+            self.calls += 1
+
+        path = urlparse(request.url).path
+
+        if re.search(r'/entities/[^/]+/$', path):
+            return self.page_latency, self._entities_page(request)
+        elif re.search(r'/shops/[^/]+/listings/active$', path):
+            return self.request_latency, self._listings_page(request)
+        elif re.search(r'/data_gate/in/[^/]+/bulk/$', path):
+            return self.request_latency, self._bulk_save(request)
+
+        return self.request_latency, {'id': 1}
+
+    def send(self, request, **kwargs):
+        latency, body = self._answer(request)
+        time.sleep(latency)
+
+        return self._response(request, body)
+
+    async def asend(self, request):
+        """Answer a request of the async client, the latency awaited."""
+        prepared = prepared_request(request)
+        latency, body = self._answer(prepared)
+        await asyncio.sleep(latency)
+
+        return httpx_response(self._response(prepared, body), request)
+
+    def _response(self, request, body):
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.url = request.url
+        response.request = request
+        response.headers['Content-Type'] = 'application/json'
+        response._content = json.dumps(body).encode('utf-8')
+
+        return response
+
+
+class patched_transport(object):
+    """
+    Route every `requests` call, and every request of the async client,
+    through the given adapter.
+    """
+
+    def __init__(self, adapter):
+        self.adapter = adapter
+        self.original = None
+        self.original_async = None
+
+    def __enter__(self):
+        adapter = self.adapter
+        self.original = HTTPAdapter.send
+        HTTPAdapter.send = lambda _self, request, **kwargs: adapter.send(request, **kwargs)
+
+        if httpx is not None:
+            self.original_async = httpx.AsyncHTTPTransport.handle_async_request
+            httpx.AsyncHTTPTransport.handle_async_request = \
+                lambda _transport, request: adapter.asend(request)
+
+        return adapter
+
+    def __exit__(self, *exc):
+        HTTPAdapter.send = self.original
+
+        if httpx is not None:
+            httpx.AsyncHTTPTransport.handle_async_request = self.original_async
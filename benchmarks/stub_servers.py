@@ -0,0 +1,397 @@
+"""
+Local stand-ins for the services the workflows talk to: the data gate, the
+Etsy v2 API and the WooCommerce wc/v2 REST API (with the WordPress media
+endpoint it shares a host with). Every stub is a real HTTP server on
+127.0.0.1, so requests go through sockets, keep-alive and JSON encoding
+like they would in production, without any network.
+
+Every stub answers after `latency` seconds, give or take up to `jitter`,
+and fails one in 1 / `error_rate` requests with a 503. Every answered
+request is counted on `calls` by method and path, and on `statuses` by
+status.
+"""
+import collections
+import gzip
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .fake_transport import make_variable_listing
+
+
+LEADING_DIGITS = re.compile(r'\d+')
+
+
+def query_int(query, key, default):
+    """
+    Integer query parameter. Only its leading digits count: the woocommerce
+    client appends its OAuth parameters with a second `?` to endpoints that
+    already have a query string.
+    """
+    match = LEADING_DIGITS.match(query.get(key, ''))
+
+    return int(match.group()) if match else default
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive, the connectors reuse their connections.
+    protocol_version = 'HTTP/1.1'
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+
+        status, payload = self.server.stub.dispatch(self.command, self.path, body)
+        content = json.dumps(payload).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_OPTIONS = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(object):
+    # (method, path pattern, name of the method answering it)
+    routes = ()
+
+    def __init__(self, latency=0, jitter=0, error_rate=0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.calls = collections.Counter()
+        self.statuses = collections.Counter()
+        # Requests being answered, and the most there were at once.
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.compiled_routes = [
+            (method, re.compile(pattern), getattr(self, name))
+            for method, pattern, name in self.routes
+        ]
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), StubRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever,
+            name='stub-{}'.format(type(self).__name__),
+            daemon=True
+        )
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _delay(self):
+        with self.lock:
+            delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+            failed = self.random.random() < self.error_rate
+            self.requests += 1
+
+            if failed:
+                self.errors += 1
+
+        if delay > 0:
+            time.sleep(delay)
+
+        return failed
+
+    def dispatch(self, method, url, body):
+        with self.lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+        try:
+            status, payload = self._dispatch(method, url, body)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+        with self.lock:
+            self.calls[method, urlsplit(url).path] += 1
+            self.statuses[status] += 1
+
+        return status, payload
+
+    def _dispatch(self, method, url, body):
+        parts = urlsplit(url)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+
+        if self._delay():
+            return 503, {'code': 'unavailable', 'message': 'Service unavailable'}
+
+        for route_method, pattern, answer in self.compiled_routes:
+            match = pattern.fullmatch(parts.path)
+
+            if route_method == method and match:
+                payload = json.loads(body) if body else None
+
+                try:
+                    with self.lock:
+                        return answer(query, payload, *match.groups())
+                except Exception as err:
+                    return 500, {'code': 'internal_error', 'message': repr(err)}
+
+        return 404, {'code': 'not_found', 'message': 'No route for {} {}'.format(method, parts.path)}
+
+
+class DataGateStub(StubServer):
+    routes = (
+        ('GET', r'/entities/[^/]+/', 'entities_page'),
+        ('GET', r'/entities/[^/]+/(\d+)/?', 'entity'),
+        ('POST', r'/data_gate/in/[^/]+/', 'save_entity'),
+        ('POST', r'/data_gate/in/[^/]+/bulk/', 'save_entities'),
+    )
+
+    def __init__(self, entity_count, new_listings=False, **kwargs):
+        """
+        Data gate with `entity_count` entities of Etsy listings. With
+        `new_listings` the listings have no `woocomm_listing_id` yet, as
+        before they're first exported.
+        """
+        super(DataGateStub, self).__init__(**kwargs)
+        self.entity_count = entity_count
+        self.new_listings = new_listings
+        self.saved = 0
+
+    def _listing(self, idx):
+        listing = make_variable_listing(idx)
+
+        if self.new_listings:
+            del listing['woocomm_listing_id']
+
+        return listing
+
+    def entities_page(self, query, payload):
+        page = query_int(query, 'page', 1)
+        page_size = query_int(query, 'page_size', 100)
+        start = (page - 1) * page_size
+        stop = min(start + page_size, self.entity_count)
+        next_url = None
+
+        if stop < self.entity_count:
+            next_url = '?page={}&page_size={}'.format(page + 1, page_size)
+
+        return 200, {
+            'count': self.entity_count,
+            'links': {'next': next_url, 'previous': None},
+            'results': [
+                {'id': idx, 'doc_data': self._listing(idx)}
+                for idx in range(start, stop)
+            ],
+        }
+
+    def entity(self, query, payload, entity_id):
+        idx = int(entity_id)
+
+        if idx >= self.entity_count:
+            return 404, {'detail': 'Not found.'}
+
+        return 200, {'id': idx, 'doc_data': self._listing(idx)}
+
+    def save_entity(self, query, payload):
+        self.saved += 1
+
+        return 201, {'id': self.saved}
+
+    def save_entities(self, query, payload):
+        self.saved += len(payload['items'])
+
+        return 200, {'results': [{'status_code': 201} for _ in payload['items']]}
+
+
+class EtsyStub(StubServer):
+    routes = (
+        ('GET', r'/v2/shops/[^/]+/listings/active', 'listings_page'),
+        ('GET', r'/v2/listings/(\d+)/inventory', 'inventory'),
+    )
+
+    def __init__(self, listing_count, **kwargs):
+        """Etsy v2 API of a shop with `listing_count` active listings."""
+        super(EtsyStub, self).__init__(**kwargs)
+        self.listing_count = listing_count
+
+    def listings_page(self, query, payload):
+        page = query_int(query, 'page', 1)
+        limit = query_int(query, 'limit', 25)
+        start = (page - 1) * limit
+        stop = min(start + limit, self.listing_count)
+        listings = []
+
+        for idx in range(start, stop):
+            listing = make_variable_listing(idx)
+            listing['last_modified_tsz'] = 1500000000 + idx
+            listings.append(listing)
+
+        return 200, {
+            'count': self.listing_count,
+            'type': 'Listing',
+            'results': listings,
+            'pagination': {
+                'next_page': page + 1 if stop < self.listing_count else None
+            },
+        }
+
+    def inventory(self, query, payload, listing_id):
+        listing = make_variable_listing(int(listing_id) - 100000)
+
+        return 200, {
+            'count': 1,
+            'type': 'ListingInventory',
+            'results': {'products': listing['products']},
+            'pagination': {},
+        }
+
+
+class WooCommerceStub(StubServer):
+    routes = (
+        ('GET', r'/wp-json/wc/v2/products', 'list_products'),
+        ('POST', r'/wp-json/wc/v2/products', 'create_product'),
+        ('GET', r'/wp-json/wc/v2/products/(\d+)', 'get_product'),
+        ('PUT', r'/wp-json/wc/v2/products/(\d+)', 'update_product'),
+        ('DELETE', r'/wp-json/wc/v2/products/(\d+)', 'delete_product'),
+        ('GET', r'/wp-json/wc/v2/products/(\d+)/variations', 'list_variations'),
+        ('POST', r'/wp-json/wc/v2/products/(\d+)/variations/batch', 'batch_variations'),
+        ('DELETE', r'/wp-json/wc/v2/products/(\d+)/variations/(\d+)', 'delete_variation'),
+        ('DELETE', r'/wp-json/wp/v2/media/(\d+)', 'delete_media'),
+    )
+
+    def __init__(self, product_count, variation_count=4, image_count=2, **kwargs):
+        """
+        WooCommerce shop holding `product_count` products, with ids 5000
+        and up like the `woocomm_listing_id` of the data gate listings.
+        Products are kept in memory, so creates, updates and deletes show
+        in later reads.
+        """
+        super(WooCommerceStub, self).__init__(**kwargs)
+        self.product_ids = itertools.count(5000)
+        # Images and variations are numbered apart from the products.
+        self.child_ids = itertools.count(900000)
+        self.products = {}
+
+        for _ in range(product_count):
+            product = self._new_product({})
+            product['name'] = 'Product {}'.format(product['id'])
+            product['images'] = [{'id': next(self.child_ids)} for _ in range(image_count)]
+
+            for _ in range(variation_count):
+                self._new_variation(product, {})
+
+    def _new_product(self, data):
+        product = dict(data, id=next(self.product_ids), images=[], variations={})
+        self.products[product['id']] = product
+
+        return product
+
+    def _new_variation(self, product, data):
+        variation = dict(data, id=next(self.child_ids))
+        # Deleting variations finds the product through this link.
+        variation['_links'] = {
+            'up': [{'href': '{}/wp-json/wc/v2/products/{}'.format(self.url, product['id'])}]
+        }
+        product['variations'][variation['id']] = variation
+
+        return variation
+
+    def _public(self, product):
+        return dict(product, variations=list(product['variations']))
+
+    def _missing(self, product_id):
+        return 404, {
+            'code': 'woocommerce_rest_product_invalid_id',
+            'message': 'Invalid ID {}.'.format(product_id),
+            'data': {'status': 404},
+        }
+
+    def list_products(self, query, payload):
+        per_page = query_int(query, 'per_page', 10)
+        offset = query_int(query, 'offset', 0)
+        products = [self.products[key] for key in sorted(self.products)]
+
+        return 200, [self._public(product) for product in products[offset:offset + per_page]]
+
+    def create_product(self, query, payload):
+        return 201, self._public(self._new_product(payload))
+
+    def get_product(self, query, payload, product_id):
+        product = self.products.get(int(product_id))
+
+        if product is None:
+            return self._missing(product_id)
+
+        return 200, self._public(product)
+
+    def update_product(self, query, payload, product_id):
+        product = self.products.get(int(product_id))
+
+        if product is None:
+            return self._missing(product_id)
+
+        product.update((key, value) for key, value in payload.items()
+                       if key not in ('id', 'images', 'variations'))
+
+        return 200, self._public(product)
+
+    def delete_product(self, query, payload, product_id):
+        product = self.products.pop(int(product_id), None)
+
+        if product is None:
+            return self._missing(product_id)
+
+        return 200, self._public(product)
+
+    def list_variations(self, query, payload, product_id):
+        product = self.products.get(int(product_id))
+
+        if product is None:
+            return self._missing(product_id)
+
+        return 200, list(product['variations'].values())
+
+    def batch_variations(self, query, payload, product_id):
+        product = self.products.get(int(product_id))
+
+        if product is None:
+            return self._missing(product_id)
+
+        return 200, {
+            'create': [self._new_variation(product, variation)
+                       for variation in payload.get('create', [])]
+        }
+
+    def delete_variation(self, query, payload, product_id, variation_id):
+        product = self.products.get(int(product_id))
+
+        if product is None or int(variation_id) not in product['variations']:
+            return self._missing(variation_id)
+
+        return 200, product['variations'].pop(int(variation_id))
+
+    def delete_media(self, query, payload, media_id):
+        return 200, {'deleted': True, 'previous': {'id': int(media_id)}}
@@ -1,19 +1,29 @@
 #!/usr/bin/python3
+import contextlib
 import os
 import json
+import logging
 import re
 
 from sys import argv
 
 from workflow.handler import WorkflowHandler
+from workflow.async_handler import AsyncWorkflowHandler
+from workflow import currency
+from workflow.cassette import CassettePlayer, CassetteRecorder
+from workflow.logs import parse_sample_rates, setup_logging
 
 
 def getopts(argv):
     opts = {}
 
     while argv:
-        if argv[0][0] == '-':
-            opts[argv[0]] = argv[1]
+        if argv[0].startswith('-'):
+            # Flags like --resume come without a value.
+            if len(argv) > 1 and not argv[1].startswith('-'):
+                opts[argv[0]] = argv[1]
+            else:
+                opts[argv[0]] = True
 
         argv = argv[1:]
 
@@ -69,9 +79,58 @@ if __name__ == '__main__':
     workflow_data_json = re.sub(r'__WP_USER__', wp_user, workflow_data_json)
     workflow_data_json = re.sub(r'__WP_PASS__', wp_pass, workflow_data_json)
 
-    handler = WorkflowHandler(json.loads(workflow_data_json))
-
-    handler.run()
+    # -rates_snapshot rates.pickle keeps the parsed ECB rates, so later
+    # runs skip parsing the rate history.
+    if myargs.get('-rates_snapshot'):
+        currency.configure(snapshot_path=myargs['-rates_snapshot'])
+
+    handler_class = WorkflowHandler
+
+    if myargs.get('-engine') == 'async':
+        handler_class = AsyncWorkflowHandler
+
+    # -state run.sqlite keeps the progress of the run in a local SQLite
+    # file, --resume continues a run that didn't finish instead of starting
+    # over. Without either no progress is kept.
+    state_path = myargs.get('-state')
+
+    if state_path is True or ('--resume' in myargs and not state_path):
+        state_path = os.path.join(dir_path, 'workflow_state.sqlite')
+
+    handler = handler_class(
+        json.loads(workflow_data_json),
+        state_path=state_path,
+        resume='--resume' in myargs,
+        # Run metrics as JSON at the end, and as a Prometheus textfile
+        # rewritten while the run goes on.
+        metrics_path=myargs.get('-metrics'),
+        metrics_textfile=myargs.get('-metrics_textfile')
+    )
+
+    # -log_level DEBUG shows every step, -log_sample step=100 keeps one in
+    # a hundred step lines.
+    log_listener = setup_logging(
+        level=getattr(logging, myargs.get('-log_level', 'INFO').upper()),
+        sample_rates=parse_sample_rates(myargs.get('-log_sample'))
+    )
+
+    # -record run.jsonl.gz keeps every HTTP exchange of the run in a cassette,
+    # -replay run.jsonl.gz runs offline on one, taking the recorded latency
+    # times -latency_scale.
+    with contextlib.ExitStack() as stack:
+        if '-replay' in myargs:
+            stack.enter_context(CassettePlayer(
+                myargs['-replay'],
+                latency_scale=float(myargs.get('-latency_scale', 1))
+            ))
+
+        if '-record' in myargs:
+            stack.enter_context(CassetteRecorder(myargs['-record']))
+
+        try:
+            handler.run()
+        finally:
+            log_listener.stop()
 
     if '-s' in myargs:
         print(myargs['-s'])
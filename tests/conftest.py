@@ -0,0 +1,77 @@
+import collections
+
+import pytest
+
+from benchmarks.bench_e2e import run_config, shipped_configs, start_stubs
+from benchmarks.bench_handler import ENGINES, use_constant_rate
+
+
+ENTITY_COUNT = 20
+
+CONFIGS = shipped_configs()
+
+
+@pytest.fixture(autouse=True)
+def constant_rate():
+    use_constant_rate()
+
+
+@pytest.fixture(params=sorted(ENGINES))
+def engine(request):
+    """Every test taking `engine` runs on both engines."""
+    return request.param
+
+
+@pytest.fixture
+def make_stubs():
+    """
+    Start data gate, Etsy and WooCommerce stubs freshly seeded for a
+    workflow config.
+    """
+    started = []
+
+    def make(workflow_name=None, entity_count=ENTITY_COUNT, **stub_kwargs):
+        stubs = start_stubs(workflow_name, entity_count, **stub_kwargs)
+        started.extend(stubs.values())
+
+        return stubs
+
+    yield make
+
+    for stub in started:
+        stub.stop()
+
+
+@pytest.fixture
+def stubs(make_stubs):
+    return make_stubs()
+
+
+def run_workflow(workflow_name, stubs, engine='sync', concurrency=None, fails=False, **handler_kwargs):
+    """Run a shipped workflow config against `stubs`, it has to succeed unless `fails`."""
+    result = run_config(
+        workflow_name,
+        {name: stub.url for name, stub in stubs.items()},
+        engine,
+        concurrency,
+        **handler_kwargs
+    )
+
+    assert (result['error'] is not None) == fails
+
+    return result
+
+
+def requests_made(stubs):
+    """Requests every stub answered, by method and status."""
+    made = {}
+
+    for name, stub in stubs.items():
+        methods = collections.Counter()
+
+        for (method, path), count in stub.calls.items():
+            methods[method] += count
+
+        made[name] = {'methods': dict(methods), 'statuses': dict(stub.statuses)}
+
+    return made
@@ -0,0 +1,54 @@
+import gzip
+import hashlib
+import json
+
+import requests
+
+from workflow.cassette import CassettePlayer, CassetteRecorder
+
+from .conftest import requests_made, run_workflow
+
+
+def write_cassette(path, exchanges):
+    with gzip.open(path, 'wt', encoding='utf-8') as cassette:
+        for body, content in exchanges:
+            cassette.write(json.dumps({
+                'method': 'POST',
+                'url': 'http://datagate.test/save',
+                'body': hashlib.sha1(body).hexdigest(),
+                'status': 201,
+                'reason': 'Created',
+                'headers': {},
+                'elapsed': 0,
+                'content': content,
+            }) + '\n')
+
+
+def test_responses_are_served_once_however_they_are_matched(tmp_path):
+    path = str(tmp_path / 'run.jsonl.gz')
+    write_cassette(path, [(b'a', 'first a'), (b'a', 'second a'), (b'b', 'b')])
+
+    with CassettePlayer(path, latency_scale=0):
+        answers = [
+            requests.post('http://datagate.test/save', data=body).text
+            for body in (b'unknown', b'a', b'b', b'a')
+        ]
+
+    assert answers == ['first a', 'second a', 'b', 'b']
+
+
+def test_replayed_run_makes_no_requests(make_stubs, engine, tmp_path):
+    path = str(tmp_path / 'run.jsonl.gz')
+    recorded = make_stubs('woocomm_delete_products')
+
+    with CassetteRecorder(path) as recorder:
+        run_workflow('woocomm_delete_products', recorded, engine)
+
+    made = requests_made(recorded)
+
+    with CassettePlayer(path, latency_scale=0) as player:
+        run_workflow('woocomm_delete_products', recorded, engine)
+
+    assert player.served == recorder.count
+    assert player.missed == 0
+    assert requests_made(recorded) == made
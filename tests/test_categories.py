@@ -0,0 +1,37 @@
+from benchmarks.bench_categories import category_mappers, scan
+from workflow.categories import LONGEST_PREFIX, CategoryIndex
+
+
+MAPPER = {
+    'Jewelry': 1,
+    'Rings': 2,
+    'Clothing': 3,
+    "Clothing, Men's Clothing": 4,
+    "Clothing, Men's Clothing, Shirts": 5,
+}
+
+
+def test_categories_match_scanning_the_mapper():
+    category_mapper = max(category_mappers(), key=len)
+    index = CategoryIndex(category_mapper)
+    paths = [key.split(', ') for key in category_mapper] + [['Jewelry', 'Rings', 'Other'], []]
+
+    for path in paths:
+        assert index.categories(path) == scan(category_mapper, path)
+
+
+def test_paths_are_resolved_once():
+    index = CategoryIndex(MAPPER)
+
+    for _ in range(3):
+        assert index.categories(['Jewelry', 'Rings']) == [{'id': 1}, {'id': 2}]
+
+    assert index.misses == 1
+
+
+def test_longest_prefix():
+    index = CategoryIndex(MAPPER, LONGEST_PREFIX)
+
+    assert index.category_ids(['Clothing', "Men's Clothing", 'Shirts', 'T-shirts']) == (5,)
+    assert index.category_ids(['Clothing', "Women's Clothing"]) == (3,)
+    assert index.category_ids(['Toys']) == ()
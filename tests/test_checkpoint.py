@@ -0,0 +1,122 @@
+import pytest
+
+from benchmarks import bench_e2e
+from benchmarks.stub_servers import DataGateStub
+from workflow.checkpoint import Checkpoint
+from workflow.handler import WorkflowHandler
+from workflow.state import StateStore
+
+from .conftest import ENTITY_COUNT, run_workflow
+
+
+FAIL_AFTER = 7
+
+
+def puts(stubs):
+    return sum(count for (method, path), count in stubs['woocommerce'].calls.items() if method == 'PUT')
+
+
+@pytest.fixture
+def failing_woocommerce(monkeypatch):
+    """
+    The WooCommerce unit fails the run once it ran FAIL_AFTER times, on
+    either engine: both build their requests with `_woocomm_request`.
+    """
+    request = WorkflowHandler._woocomm_request
+    calls = []
+
+    def failing(handler, step, data, tmp_data):
+        if len(calls) >= FAIL_AFTER:
+            raise RuntimeError('WooCommerce went away')
+
+        calls.append(step)
+
+        return request(handler, step, data, tmp_data)
+
+    monkeypatch.setattr(WorkflowHandler, '_woocomm_request', failing)
+
+    return monkeypatch
+
+
+def test_resumed_run_skips_the_entities_done(make_stubs, engine, tmp_path, failing_woocommerce):
+    """
+    The stubs of both runs listen on other ports, which changes the
+    workflow doc the run id is made from, so the runs share one.
+    """
+    state_path = str(tmp_path / 'state.sqlite')
+    first = make_stubs()
+
+    run_workflow('woocomm_update_products', first, engine, fails=True,
+                 state_path=state_path, run_id='resume', checkpoint_interval=1)
+
+    assert puts(first) == FAIL_AFTER
+
+    failing_woocommerce.undo()
+    second = make_stubs()
+
+    run_workflow('woocomm_update_products', second, engine, state_path=state_path, run_id='resume', resume=True)
+
+    assert puts(second) == ENTITY_COUNT - FAIL_AFTER
+
+
+def test_runs_without_state_keep_no_progress(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    handler = WorkflowHandler({'steps': []})
+
+    assert handler.checkpoint is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_loop_items_are_keyed_by_their_id():
+    handler = WorkflowHandler({'steps': []})
+
+    assert handler._loop_item_key({'id': 5000}, {'name': 'Ring'}, 3) == 'id:5000'
+    assert handler._loop_item_key({'doc_data': {}}, {'id': 'abc'}, 3) == 'id:abc'
+    assert handler._loop_item_key({'id': None}, 'item', 3) == 3
+
+
+def test_marks_survive_a_resume(tmp_path):
+    store = StateStore(str(tmp_path / 'state.sqlite'))
+    checkpoint = Checkpoint(store, 'run')
+
+    for index in (0, 1, 3, 'id:5000'):
+        checkpoint.done('loop', index)
+
+    checkpoint.save(checkpoint.take())
+    resumed = Checkpoint(store, 'run', resume=True)
+
+    assert [resumed.is_done('loop', index) for index in (0, 1, 2, 3, 'id:5000', 'id:5001')] == \
+        [True, True, False, True, True, False]
+    assert store.items('checkpoint:run', 'done:loop#') == [('done:loop#3', 3), ('done:loop#id:5000', 'id:5000')]
+
+
+class RejectingDataGateStub(DataGateStub):
+    """Rejects the saves of every fifth listing."""
+
+    def save_entity(self, query, payload):
+        if payload['doc_data']['listing_id'] % 5 == 0:
+            return 400, {'detail': 'Rejected.'}
+
+        return super(RejectingDataGateStub, self).save_entity(query, payload)
+
+
+@pytest.mark.parametrize('concurrency', [None, 4])
+def test_items_with_lost_saves_are_redone_on_resume(make_stubs, engine, concurrency, tmp_path, monkeypatch):
+    state_path = str(tmp_path / 'state.sqlite')
+    monkeypatch.setattr(bench_e2e, 'DataGateStub', RejectingDataGateStub)
+    first = make_stubs('pim_clean_products')
+
+    result = run_workflow('pim_clean_products', first, engine, concurrency,
+                          state_path=state_path, run_id='resume')
+
+    assert first['datagate'].saved == ENTITY_COUNT - ENTITY_COUNT // 5
+    assert result['error'] is None
+
+    monkeypatch.undo()
+    second = make_stubs('pim_clean_products')
+
+    run_workflow('pim_clean_products', second, engine, concurrency,
+                 state_path=state_path, run_id='resume', resume=True)
+
+    assert second['datagate'].saved == ENTITY_COUNT // 5
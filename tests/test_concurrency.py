@@ -0,0 +1,38 @@
+import pytest
+
+from .conftest import CONFIGS, requests_made, run_workflow
+
+
+def test_loop_items_are_done_before_the_next_page_is_listed(stubs, engine):
+    """
+    woocomm_delete_products lists products from offset 0 again after every
+    page of deletes, so the page has to be deleted by then.
+    """
+    run_workflow('woocomm_delete_products', stubs, engine, concurrency=4)
+    woocommerce = stubs['woocommerce']
+    deletes = [count for (method, path), count in woocommerce.calls.items() if method == 'DELETE']
+
+    assert woocommerce.products == {}
+    assert deletes and max(deletes) == 1
+    assert all(status < 400 for status in woocommerce.statuses)
+
+
+@pytest.mark.parametrize('workflow_name', CONFIGS)
+def test_concurrent_loops_make_the_serial_requests(make_stubs, engine, workflow_name):
+    serial = make_stubs(workflow_name)
+    concurrent = make_stubs(workflow_name)
+
+    run_workflow(workflow_name, serial, engine)
+    run_workflow(workflow_name, concurrent, engine, concurrency=4)
+
+    assert requests_made(concurrent) == requests_made(serial)
+
+
+@pytest.mark.parametrize('concurrency, overlap', [(None, False), (4, True)])
+def test_entities_of_a_page_overlap(make_stubs, engine, concurrency, overlap):
+    stubs = make_stubs('woocomm_update_products', latency=0.02)
+
+    run_workflow('woocomm_update_products', stubs, engine, concurrency=concurrency)
+
+    assert stubs['woocommerce'].calls['PUT', '/wp-json/wc/v2/products/5000'] == 1
+    assert (stubs['woocommerce'].peak_in_flight > 1) == overlap
@@ -0,0 +1,43 @@
+import datetime
+
+from currency_converter import CurrencyConverter
+
+from workflow import currency
+
+
+CONVERSIONS = [
+    (100, 'GBP', 'USD', None),
+    ('19.99', 'EUR', 'CAD', None),
+    (5, 'JPY', 'USD', datetime.date(2015, 6, 1)),
+]
+
+
+def test_conversions_match_currency_converter(tmp_path):
+    expected = CurrencyConverter()
+    snapshot_path = str(tmp_path / 'rates.pickle')
+
+    # The first provider parses the rates and writes the snapshot, the
+    # second one loads it.
+    for provider in (currency.RateProvider(snapshot_path=snapshot_path),
+                     currency.RateProvider(snapshot_path=snapshot_path)):
+        for amount, code, new_code, date in CONVERSIONS:
+            assert provider.convert(amount, code, new_code, date) == \
+                expected.convert(amount, code, new_code, date)
+
+
+def test_snapshots_of_other_releases_are_not_loaded(tmp_path, monkeypatch):
+    snapshot_path = str(tmp_path / 'rates.pickle')
+    currency.RateProvider(snapshot_path=snapshot_path)
+    monkeypatch.setattr(currency.importlib.metadata, 'version', lambda name: '0.0.1')
+    loaded = []
+
+    def parsed(**kwargs):
+        loaded.append(kwargs)
+
+        return CurrencyConverter(**kwargs)
+
+    monkeypatch.setattr(currency, 'CurrencyConverter', parsed)
+
+    currency.RateProvider(snapshot_path=snapshot_path)
+
+    assert loaded == [{'currency_file': currency.CURRENCY_FILE}]
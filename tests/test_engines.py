@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from benchmarks.stub_servers import DataGateStub
+from workflow.aio import make_client
+from workflow.connectors.datagate import DataGate
+
+from .conftest import CONFIGS, ENTITY_COUNT, requests_made, run_workflow
+
+
+class UncountedDataGateStub(DataGateStub):
+    """Leaves the total count out, pages are found by their links only."""
+
+    def entities_page(self, query, payload):
+        status, page = super(UncountedDataGateStub, self).entities_page(query, payload)
+
+        return status, dict(page, count=None)
+
+
+@pytest.mark.parametrize('workflow_name', CONFIGS)
+def test_engines_make_the_same_requests(make_stubs, workflow_name):
+    by_sync = make_stubs(workflow_name)
+    by_async = make_stubs(workflow_name)
+
+    run_workflow(workflow_name, by_sync, 'sync')
+    run_workflow(workflow_name, by_async, 'async')
+
+    assert requests_made(by_async) == requests_made(by_sync)
+
+
+def test_new_listings_are_posted(make_stubs, engine):
+    stubs = make_stubs('woocomm_create_products')
+
+    run_workflow('woocomm_create_products', stubs, engine)
+
+    assert stubs['woocommerce'].calls['POST', '/wp-json/wc/v2/products'] == ENTITY_COUNT
+
+
+@pytest.mark.parametrize('stub_class', [DataGateStub, UncountedDataGateStub])
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_async_client_reads_the_same_pages(stub_class, prefetch):
+    stub = stub_class(ENTITY_COUNT).start()
+    data_gate = DataGate(stub.url, 'org', 'JWT test')
+
+    def ids(page):
+        return [entity['id'] for entity in page['results']]
+
+    async def read():
+        async with make_client(4) as client:
+            data_gate.client = client
+
+            return [ids(page) async for page in data_gate.aiter_pages(3, prefetch=prefetch, start_page=2)]
+
+    try:
+        pages = [ids(page) for page in data_gate.iter_pages(3, prefetch=prefetch, start_page=2)]
+
+        assert asyncio.run(read()) == pages
+    finally:
+        stub.stop()
+
+    assert pages[0] == [3, 4, 5]
+    assert pages[-1] == [ENTITY_COUNT - 2, ENTITY_COUNT - 1]
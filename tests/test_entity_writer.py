@@ -0,0 +1,245 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from benchmarks.stub_servers import DataGateStub
+from workflow.aio import make_client
+from workflow.connectors.datagate import AsyncEntityWriter, DataGate, EntityWriter
+
+from .conftest import ENTITY_COUNT, run_workflow
+
+
+class FailingBulkStub(DataGateStub):
+    def save_entities(self, query, payload):
+        return 500, {'detail': 'Bulk save failed.'}
+
+
+class RejectingStub(DataGateStub):
+    def save_entity(self, query, payload):
+        if payload['doc_data']['sku'] % 2:
+            return 400, {'detail': 'Rejected.'}
+
+        return super(RejectingStub, self).save_entity(query, payload)
+
+
+@pytest.fixture
+def data_gate_stub():
+    stub = DataGateStub(0).start()
+
+    yield stub
+
+    stub.stop()
+
+
+def writer_for(stub, **kwargs):
+    return EntityWriter(DataGate(stub.url, 'org', 'JWT test'), 'mapper', unique_fields=['sku'], **kwargs)
+
+
+def save_calls(stub):
+    return {
+        'single': stub.calls['POST', '/data_gate/in/org/'],
+        'bulk': stub.calls['POST', '/data_gate/in/org/bulk/'],
+    }
+
+
+def test_docs_are_posted_one_by_one_by_default(data_gate_stub):
+    writer = writer_for(data_gate_stub, batch_size=2)
+
+    for sku in range(5):
+        writer.add({'sku': sku})
+
+    assert writer.close() == (5, 0)
+    assert save_calls(data_gate_stub) == {'single': 5, 'bulk': 0}
+
+
+def test_bulk_sends_batches(data_gate_stub):
+    writer = writer_for(data_gate_stub, batch_size=2, bulk=True)
+
+    for sku in range(5):
+        writer.add({'sku': sku})
+
+    assert writer.close() == (5, 0)
+    assert save_calls(data_gate_stub) == {'single': 0, 'bulk': 3}
+
+
+def test_failed_bulk_batches_are_posted_one_by_one():
+    stub = FailingBulkStub(0).start()
+
+    try:
+        writer = writer_for(stub, batch_size=2, bulk=True)
+
+        for sku in range(4):
+            writer.add({'sku': sku})
+
+        assert writer.close() == (4, 0)
+        assert stub.saved == 4
+        # A failed batch doesn't turn bulk saves off, a missing endpoint does.
+        assert writer.bulk
+    finally:
+        stub.stop()
+
+
+def test_waiting_docs_are_sent_after_the_flush_interval(data_gate_stub):
+    writer = writer_for(data_gate_stub, batch_size=100, flush_interval=0.05)
+    writer.add({'sku': 1})
+    deadline = time.monotonic() + 5
+
+    while data_gate_stub.saved < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert data_gate_stub.saved == 1
+    assert writer.buffer == []
+    assert writer.close() == (1, 0)
+
+
+def wait_until_sent(writer):
+    deadline = time.monotonic() + 5
+
+    while (writer.buffer or writer.sending) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_docs_whose_request_raised_are_counted_failed():
+    # Nothing listens on the discard port, every save is refused.
+    writer = EntityWriter(DataGate('http://127.0.0.1:9', 'org', 'JWT test'), 'mapper',
+                          unique_fields=['sku'], batch_size=100, flush_interval=0.05, bulk=True)
+
+    for sku in range(3):
+        writer.add({'sku': sku})
+
+    wait_until_sent(writer)
+
+    assert writer.close() == (0, 3)
+    assert writer.failed_keys == [(0,), (1,), (2,)]
+
+
+def test_errors_on_the_timer_thread_are_raised_by_close(data_gate_stub, monkeypatch):
+    writer = writer_for(data_gate_stub, batch_size=100, flush_interval=0.05)
+
+    def broken(payload, mapper_id, compress=False):
+        raise RuntimeError('broken')
+
+    monkeypatch.setattr(writer.data_gate, 'save_entity', broken)
+    writer.add({'sku': 1})
+    writer.add({'sku': 2})
+    wait_until_sent(writer)
+
+    with pytest.raises(RuntimeError):
+        writer.close()
+
+    assert (writer.saved, writer.failed) == (0, 2)
+
+
+def test_add_does_not_wait_on_the_data_gate(data_gate_stub, monkeypatch):
+    writer = writer_for(data_gate_stub, batch_size=2)
+    answer = threading.Event()
+    save_entity = writer.data_gate.save_entity
+
+    def slow(*args, **kwargs):
+        answer.wait(5)
+
+        return save_entity(*args, **kwargs)
+
+    monkeypatch.setattr(writer.data_gate, 'save_entity', slow)
+
+    for sku in range(4):
+        writer.add({'sku': sku})
+
+    assert data_gate_stub.saved == 0
+
+    answer.set()
+
+    assert writer.close() == (4, 0)
+
+
+def test_batches_are_sent_one_at_a_time(data_gate_stub, monkeypatch):
+    writer = writer_for(data_gate_stub, batch_size=2, flush_interval=0.001)
+    save_entity = writer.data_gate.save_entity
+    lock = threading.Lock()
+    sending = []
+    overlapped = []
+
+    def tracked(*args, **kwargs):
+        with lock:
+            sending.append(1)
+            overlapped.append(len(sending) > 1)
+
+        try:
+            time.sleep(0.02)
+
+            return save_entity(*args, **kwargs)
+        finally:
+            with lock:
+                sending.pop()
+
+    monkeypatch.setattr(writer.data_gate, 'save_entity', tracked)
+
+    for sku in range(20):
+        writer.add({'sku': sku})
+        time.sleep(0.005)
+
+    assert writer.close() == (20, 0)
+    assert not any(overlapped)
+
+
+def test_every_outcome_is_handed_out():
+    stub = RejectingStub(0).start()
+    outcomes = []
+
+    try:
+        writer = writer_for(stub, batch_size=2, on_result=lambda *outcome: outcomes.append(outcome))
+
+        for sku in range(5):
+            writer.add({'sku': sku}, tag='item {}'.format(sku))
+
+        assert writer.close() == (3, 2)
+    finally:
+        stub.stop()
+
+    assert sorted(outcomes) == [
+        ((0,), 'item 0', 201),
+        ((1,), 'item 1', 400),
+        ((2,), 'item 2', 201),
+        ((3,), 'item 3', 400),
+        ((4,), 'item 4', 201),
+    ]
+
+
+def test_async_writer_hands_out_every_outcome():
+    stub = RejectingStub(0).start()
+    outcomes = []
+
+    async def write():
+        async with make_client(4) as client:
+            writer = AsyncEntityWriter(
+                DataGate(stub.url, 'org', 'JWT test', client=client), 'mapper',
+                unique_fields=['sku'], batch_size=2, on_result=lambda *outcome: outcomes.append(outcome))
+
+            for sku in range(5):
+                writer.add({'sku': sku}, tag='item {}'.format(sku))
+
+            return await writer.aclose()
+
+    try:
+        assert asyncio.run(write()) == (3, 2)
+    finally:
+        stub.stop()
+
+    assert sorted(outcomes) == [
+        ((0,), 'item 0', 201),
+        ((1,), 'item 1', 400),
+        ((2,), 'item 2', 201),
+        ((3,), 'item 3', 400),
+        ((4,), 'item 4', 201),
+    ]
+
+
+def test_handler_reports_every_entity_saved(stubs, engine):
+    outcomes = []
+
+    run_workflow('import_etsy_listing', stubs, engine, on_entity_save=lambda *outcome: outcomes.append(outcome))
+
+    assert len(outcomes) == ENTITY_COUNT
+    assert all(status_code == 201 for key, status_code in outcomes)
@@ -0,0 +1,122 @@
+"""
+Differential tests of the compiled mappers against DataMapper.
+
+Every export map of the shipped configs, a map using every rule kind and
+RANDOM_MAPPINGS generated maps are applied to synthetic listings and
+products by both DataMapper and `mapper.compile_mapping`. The mapped
+documents, or the exceptions raised, have to be the same, and the compiled
+mapper must leave the mapping as it was.
+"""
+import copy
+import json
+import random
+
+import pytest
+
+from benchmarks.bench_mapper import RULES_MAP, export_maps, product_doc
+from benchmarks.fake_transport import make_variable_listing
+from workflow import mapper
+
+
+RANDOM_MAPPINGS = 300
+
+SOURCE_PATHS = [
+    'title', 'sku', 'images', 'create', 'quantity', 'listing_id', 'price',
+    'categories', 'dimensions', 'dimensions:width', 'dimensions:missing',
+    'attributes', 'missing', 'title:nested', '',
+]
+TARGET_PREFIXES = [[], [], ['meta'], ['gallery'], ['meta', 'inner'], ['ignored_parts']]
+TARGET_NAMES = [
+    'name', 'gallery', 'items', 'gallery[{}]', 'items[{}]', 'meta[{}]',
+    '{}', '{}.value', 'tags[]', 'gallery[]', 'count<int>', 'label<str>',
+    'ignored_parts', 'meta',
+]
+
+
+def docs():
+    return [
+        product_doc(),
+        product_doc(images=0, variations=0),
+        product_doc(images=300, variations=300),
+        make_variable_listing(1),
+        {'images': [{'id': n} for n in range(500)], 'sku': 'SKU-1', 'title': 'x'},
+        {'images': {'id': 1}, 'create': [], 'quantity': 'not a number'},
+        {},
+    ]
+
+
+def random_mapping(rand):
+    mapping = {}
+
+    for _ in range(rand.randint(1, 6)):
+        parts = []
+
+        for _ in range(rand.randint(1, 3)):
+            prefix = rand.choice(TARGET_PREFIXES)
+            parts.append(':'.join(prefix + [rand.choice(TARGET_NAMES)]))
+
+        mapping[rand.choice(SOURCE_PATHS)] = '&'.join(parts)
+
+    if rand.random() < 0.3:
+        mapping['ignored_parts'] = {'vendor_id': '1'}
+
+    return mapping
+
+
+def mappings():
+    rand = random.Random(1)
+    found = [('config/{}'.format(name), _map) for name, _map in sorted(export_maps().items())]
+    found += [
+        ('rules', RULES_MAP),
+        ('zipped_lists', {'images': 'gallery[{}]', 'create': 'gallery[{}]', 'sku': 'gallery[{}]'}),
+        ('nested_list_source', {'dimensions:width': 'sizes[{}]', 'images': 'sizes[{}]'}),
+    ]
+    found += [('random/{}'.format(n), random_mapping(rand)) for n in range(RANDOM_MAPPINGS)]
+
+    return found
+
+
+def outcome(form, mapping, doc):
+    try:
+        return 'ok', form(mapping, doc)
+    except Exception as err:
+        return 'error', type(err).__name__
+
+
+def reference(mapping, doc):
+    return mapper.DataMapper(mapping).form_doc_dict(doc)
+
+
+def compiled(mapping, doc):
+    return mapper.compile_mapping(mapping).form_doc_dict(doc)
+
+
+def same(found, expected):
+    try:
+        return found == expected
+    except RecursionError:
+        # Some maps build documents holding themselves.
+        return repr(found) == repr(expected)
+
+
+@pytest.mark.parametrize('mapping', [
+    pytest.param(mapping, id=name) for name, mapping in mappings()
+])
+def test_compiled_mapper_maps_like_data_mapper(mapping):
+    given_mapping = copy.deepcopy(mapping)
+
+    for doc in docs():
+        expected = outcome(reference, copy.deepcopy(mapping), copy.deepcopy(doc))
+        # Twice, the second time from the cache.
+        outcome(compiled, given_mapping, copy.deepcopy(doc))
+        found = outcome(compiled, given_mapping, copy.deepcopy(doc))
+
+        assert same(found, expected)
+        assert given_mapping == mapping
+
+
+def test_mappings_are_compiled_once():
+    mapping = {'title': 'name', 'sku': 'sku'}
+
+    assert mapper.compile_mapping(mapping) is mapper.compile_mapping(mapping)
+    assert mapper.compile_mapping(json.dumps(mapping)) is mapper.compile_mapping(json.dumps(mapping))
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+
+import pytest
+
+from workflow.concurrency import CONTINUE, AsyncItemPool, ItemPool
+
+
+def test_item_pool_waits_for_a_batch_only():
+    pool = ItemPool(4)
+    release = threading.Event()
+    done = []
+    batch = pool.batch()
+
+    pool.submit(release.wait)
+    pool.submit(done.append, 'item', batch=batch)
+    pool.wait(batch)
+
+    assert done == ['item']
+    assert pool.in_flight == 1
+
+    release.set()
+    pool.wait()
+    pool.shutdown()
+
+
+def test_item_pool_fails_fast():
+    pool = ItemPool(2)
+
+    pool.submit(int, 'not a number')
+
+    with pytest.raises(ValueError):
+        pool.wait()
+
+    pool.shutdown()
+
+
+def test_item_pool_continues_past_errors():
+    pool = ItemPool(2, on_error=CONTINUE)
+
+    pool.submit(int, 'not a number')
+    pool.submit(int, '1')
+    pool.wait()
+    pool.shutdown()
+
+    assert len(pool.errors) == 1
+
+
+def test_async_item_pool_waits_for_a_batch_only():
+    async def run():
+        pool = AsyncItemPool(4)
+        release = asyncio.Event()
+        done = []
+        batch = pool.batch()
+
+        async def item():
+            await asyncio.sleep(0)
+            done.append('item')
+
+        await pool.submit(release.wait)
+        await pool.submit(item, batch=batch)
+        await pool.wait(batch)
+
+        assert done == ['item']
+        assert len(pool.tasks) == 1
+
+        release.set()
+        await pool.wait()
+
+    asyncio.run(run())
@@ -0,0 +1,44 @@
+import random
+
+import pytest
+
+from benchmarks.bench_pricing import check, offering_price
+from workflow import currency, pricing
+
+
+@pytest.fixture(scope='module')
+def rates():
+    return currency.RateProvider()
+
+
+def test_prices_match_one_at_a_time(rates):
+    rand = random.Random(1)
+    currencies = sorted(rates.converter.currencies)
+    prices = [offering_price(rand, currencies, with_amount=n % 2 == 0) for n in range(5000)]
+
+    assert check(prices, rates) == []
+
+
+@pytest.mark.parametrize('price, expected', [
+    ({'amount': 1000, 'divisor': 100, 'currency_formatted_raw': '10.00', 'currency_code': 'USD'}, '10.00'),
+    ({'currency_formatted_raw': '1,000.00', 'currency_code': 'USD'}, '1000.00'),
+    ({'amount': 1, 'divisor': 1000, 'currency_formatted_raw': '0.001', 'currency_code': 'USD'}, '0.01'),
+])
+def test_prices_round_up_to_the_cent(rates, price, expected):
+    assert pricing.usd_prices([price], rates) == [expected]
+
+
+def test_page_prices_match_listing_at_a_time(rates):
+    rand = random.Random(2)
+    currencies = sorted(rates.converter.currencies)
+    listings = [
+        {'products': [
+            {'property_values': [{}], 'offerings': [{'price': offering_price(rand, currencies)}]}
+            for _ in range(rand.randint(0, 12))
+        ] + [{'property_values': [], 'offerings': []}]}
+        for _ in range(200)
+    ]
+
+    assert pricing.page_variation_prices(listings, rates) == [
+        pricing.usd_prices(pricing.variation_offering_prices(listing), rates) for listing in listings
+    ]
@@ -0,0 +1,52 @@
+import pytest
+
+from workflow.connectors import woocomm
+from workflow.transform import TransformPool
+
+from .conftest import requests_made, run_workflow
+
+
+def products(stubs):
+    """
+    Products as the run left them, without the variations linking back to
+    the stub. Prices are left out too: the workers convert them at the ECB
+    rates, the tests at a constant rate.
+    """
+    return {
+        product_id: dict(product, variations=sorted(product['variations']), regular_price=None)
+        for product_id, product in stubs['woocommerce'].products.items()
+    }
+
+
+@pytest.fixture
+def no_single_transforms(monkeypatch):
+    def transform(pool, data):
+        raise AssertionError('Listing shaped on its own')
+
+    monkeypatch.setattr(TransformPool, 'transform', transform)
+
+
+def test_pages_are_shaped_in_worker_processes(make_stubs, engine, no_single_transforms):
+    in_process = make_stubs()
+    in_workers = make_stubs()
+
+    run_workflow('woocomm_update_products', in_process, engine)
+    run_workflow('woocomm_update_products', in_workers, engine, unit_options=[
+        ('action_connector_woocommerce', 'transform_processes', 2),
+        ('action_connector_woocommerce', 'transform_chunksize', 4),
+    ])
+
+    assert requests_made(in_workers) == requests_made(in_process)
+    assert products(in_workers) == products(in_process)
+
+
+def test_variations_of_a_page_are_priced_together(make_stubs, engine, monkeypatch):
+    def usd_prices(prices, converter):
+        raise AssertionError('Listing priced on its own')
+
+    monkeypatch.setattr(woocomm, 'usd_prices', usd_prices)
+    stubs = make_stubs('woocomm_create_products_variations')
+
+    run_workflow('woocomm_create_products_variations', stubs, engine)
+
+    assert all(product['variations'] for product in stubs['woocommerce'].products.values())
@@ -0,0 +1,152 @@
+import pytest
+
+from benchmarks import bench_e2e
+from benchmarks.stub_servers import DataGateStub, EtsyStub
+from workflow.handler import WorkflowHandler
+
+from .conftest import ENTITY_COUNT, run_workflow
+
+
+PAGE_LIMIT = 5
+
+INCREMENTAL = (
+    ('connector_etsy', 'params', {'limit': PAGE_LIMIT}),
+    ('connector_etsy', 'incremental', {'sort_on': 'last_modified'}),
+)
+
+
+class SortedEtsyStub(EtsyStub):
+    """
+    Serves the shop listings newest first when asked to sort them, with
+    the modification times of `modified` {index: time} changed.
+    """
+    modified = {}
+
+    def listings_page(self, query, payload):
+        status, shop = super(SortedEtsyStub, self).listings_page({'limit': str(self.listing_count)}, payload)
+        listings = shop['results']
+
+        for idx, listing in enumerate(listings):
+            listing['last_modified_tsz'] = self.modified.get(idx, listing['last_modified_tsz'])
+
+        if 'sort_on' in query:
+            listings.sort(key=lambda listing: -listing['last_modified_tsz'])
+
+        page = int(query.get('page', 1))
+        limit = int(query.get('limit', 25))
+        start = (page - 1) * limit
+
+        return status, dict(
+            shop,
+            results=listings[start:start + limit],
+            pagination={'next_page': page + 1 if start + limit < len(listings) else None}
+        )
+
+
+class RejectingDataGateStub(DataGateStub):
+    def save_entity(self, query, payload):
+        if payload['doc_data']['listing_id'] % 5 == 0:
+            return 400, {'detail': 'Rejected.'}
+
+        return super(RejectingDataGateStub, self).save_entity(query, payload)
+
+
+@pytest.fixture
+def sorted_etsy(monkeypatch):
+    monkeypatch.setattr(bench_e2e, 'EtsyStub', SortedEtsyStub)
+    monkeypatch.setattr(SortedEtsyStub, 'modified', {})
+
+    return SortedEtsyStub
+
+
+def import_listings(make_stubs, engine, state_path, **handler_kwargs):
+    stubs = make_stubs('import_etsy_listing')
+
+    run_workflow('import_etsy_listing', stubs, engine, unit_options=INCREMENTAL,
+                 state_path=state_path, **handler_kwargs)
+
+    return stubs
+
+
+def pages_read(stubs):
+    return sum(count for (method, path), count in stubs['etsy'].calls.items() if path.endswith('/listings/active'))
+
+
+def test_listings_older_than_the_watermark_are_left_out():
+    handler = WorkflowHandler({'steps': []})
+    result = {'results': [{'tsz': 5}, {'tsz': 10}, {'tsz': None}, {'tsz': 3}]}
+
+    modified, reached = handler._modified_listings(result, 'shop', 'tsz', 5)
+
+    assert modified['results'] == [{'tsz': 5}, {'tsz': 10}, {'tsz': None}]
+    assert reached
+    assert handler.watermarks == {'shop': 10}
+
+    modified, reached = handler._modified_listings(result, 'shop', 'tsz', None)
+
+    assert modified == result
+    assert not reached
+
+
+def test_unchanged_rerun_stops_at_the_watermark(make_stubs, engine, tmp_path, sorted_etsy):
+    state_path = str(tmp_path / 'state.sqlite')
+    first = import_listings(make_stubs, engine, state_path)
+
+    assert first['datagate'].saved == ENTITY_COUNT
+    assert pages_read(first) == ENTITY_COUNT // PAGE_LIMIT
+
+    sorted_etsy.modified = {3: 1600000000, 7: 1600000001}
+    second = import_listings(make_stubs, engine, state_path)
+
+    # The two edited listings, and the newest one of the first run again.
+    assert second['datagate'].saved == 3
+    assert pages_read(second) == 1
+
+
+def test_watermark_is_kept_when_saves_fail(make_stubs, engine, tmp_path, sorted_etsy, monkeypatch):
+    state_path = str(tmp_path / 'state.sqlite')
+    monkeypatch.setattr(bench_e2e, 'DataGateStub', RejectingDataGateStub)
+    first = import_listings(make_stubs, engine, state_path)
+
+    assert first['datagate'].saved == ENTITY_COUNT - ENTITY_COUNT // 5
+
+    monkeypatch.setattr(bench_e2e, 'DataGateStub', DataGateStub)
+    second = import_listings(make_stubs, engine, state_path)
+
+    assert second['datagate'].saved == ENTITY_COUNT
+
+
+def test_watermark_is_kept_when_saves_are_lost(make_stubs, engine, tmp_path, sorted_etsy):
+    """Saves whose requests raised are counted, not dropped."""
+    state_path = str(tmp_path / 'state.sqlite')
+    first = make_stubs('import_etsy_listing')
+    first['datagate'].stop()
+
+    run_workflow('import_etsy_listing', first, engine, unit_options=INCREMENTAL, state_path=state_path)
+
+    second = import_listings(make_stubs, engine, state_path)
+
+    assert second['datagate'].saved == ENTITY_COUNT
+
+
+def test_watermark_is_kept_when_the_run_fails(make_stubs, engine, tmp_path, sorted_etsy, monkeypatch):
+    state_path = str(tmp_path / 'state.sqlite')
+    save = WorkflowHandler._handle_entity_save
+    calls = []
+
+    def failing(handler, step, data):
+        if len(calls) >= 7:
+            raise RuntimeError('Data gate went away')
+
+        calls.append(data)
+        save(handler, step, data)
+
+    monkeypatch.setattr(WorkflowHandler, '_handle_entity_save', failing)
+    first = make_stubs('import_etsy_listing')
+
+    run_workflow('import_etsy_listing', first, engine, fails=True, unit_options=INCREMENTAL, state_path=state_path)
+
+    monkeypatch.setattr(WorkflowHandler, '_handle_entity_save', save)
+    second = import_listings(make_stubs, engine, state_path)
+
+    assert second['datagate'].saved == ENTITY_COUNT
@@ -0,0 +1,6 @@
+import logging
+
+
+# Nothing is logged unless the application sets up logging, see
+# workflow.logs.setup_logging.
+logging.getLogger(__name__).addHandler(logging.NullHandler())
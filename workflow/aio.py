@@ -0,0 +1,83 @@
+"""
+HTTP on the event loop. AsyncWorkflowHandler runs share one httpx client,
+the connectors make their async requests on it.
+
+Tests and benchmarks answer `requests` calls by patching HTTPAdapter.send,
+and the requests of the async client by patching
+`httpx.AsyncHTTPTransport.handle_async_request` the same way. The helpers
+below turn an httpx exchange into its `requests` counterpart and back, so
+one stand-in answers both.
+"""
+import httpx
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+def make_client(max_connections):
+    """
+    Async client for a run, at most `max_connections` requests in flight,
+    the others wait for a connection. No timeout, as with `requests`.
+    """
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections
+        ),
+        timeout=None
+    )
+
+
+def call_hooks(hooks, response):
+    """Hand an async client response to `requests` response hooks."""
+    for hook in hooks:
+        hook(response)
+
+
+def prepared_request(request):
+    """The `requests` counterpart of an httpx request, read in full."""
+    return requests.Request(
+        request.method,
+        str(request.url),
+        headers=dict(request.headers),
+        data=request.content or None
+    ).prepare()
+
+
+def requests_response(response, prepared):
+    """The `requests` counterpart of a read httpx response to `prepared`."""
+    converted = requests.Response()
+    converted.status_code = response.status_code
+    converted.reason = response.reason_phrase
+    converted.headers = CaseInsensitiveDict(response.headers.items())
+    converted.url = prepared.url
+    converted.request = prepared
+    converted._content = response.content
+
+    return converted
+
+
+def httpx_response(response, request):
+    """An httpx response to `request` holding a `requests` one."""
+    # Streamed rather than given as content, so the client reads it as it
+    # reads a response off the wire, timing it too.
+    return httpx.Response(
+        response.status_code,
+        headers=list(response.headers.items()),
+        stream=httpx.ByteStream(response.content),
+        request=request,
+        extensions={'reason_phrase': (response.reason or '').encode('ascii')}
+    )
+
+
+def unread_response(response, raw, request):
+    """
+    A copy of an httpx response to `request` holding its `raw` body, not
+    read yet.
+    """
+    return httpx.Response(
+        response.status_code,
+        headers=response.headers,
+        stream=httpx.ByteStream(raw),
+        request=request,
+        extensions=response.extensions
+    )
@@ -0,0 +1,373 @@
+import asyncio
+import logging
+
+from .aio import make_client
+from .concurrency import AsyncItemPool, FAIL_FAST
+from .connectors.datagate import AsyncEntityWriter, DEFAULT_PREFETCH
+from .handler import STEP_EVENT, WorkflowHandler
+
+
+DEFAULT_MAX_IN_FLIGHT = 64
+
+log = logging.getLogger(__name__)
+
+
+class AsyncWorkflowHandler(WorkflowHandler):
+    entity_writer_class = AsyncEntityWriter
+
+    def __init__(self, workflow_doc, **kwargs):
+        """
+        Runs the same workflow docs as WorkflowHandler on an asyncio event
+        loop.
+
+        The engine and its HTTP live on the event loop: the data gate,
+        Etsy, WooCommerce and WordPress requests are made on one httpx
+        client shared by the run, with at most `max_in_flight` requests in
+        flight however many tasks the units allow. Loop and entity units
+        with `concurrency` run their items as tasks. Only local blocking
+        work, state and checkpoint writes and shaping ahead on a transform
+        pool, goes to threads.
+        """
+        super(AsyncWorkflowHandler, self).__init__(workflow_doc, **kwargs)
+
+        self.max_in_flight = kwargs.get('max_in_flight', DEFAULT_MAX_IN_FLIGHT)
+        self.async_unit_handlers = self._get_async_unit_handlers()
+        self.item_tasks = {}
+
+    def _get_async_unit_handlers(self):
+        """Collects references for the unit handlers run on the event loop."""
+        handlers = {func[7:]: getattr(self, func) for
+                    func in dir(self) if func.startswith('_aunit')}
+
+        return handlers
+
+    async def _arun_units(self, step):
+        """Run a single compiled workflow unit."""
+        handler = self.async_unit_handlers.get(step.type)
+
+        # Units without an async handler make no requests.
+        if handler:
+            with self._measure(step):
+                await handler(step)
+        else:
+            self._run_units(step)
+
+    async def _arun_steps(self, steps):
+        if steps:
+            await self._arun_plan(steps)
+
+    async def _arun_plan(self, steps):
+        for idx, step in enumerate(steps):
+            log.debug('Running step %s, type %s', idx, step.type, extra=STEP_EVENT)
+
+            await self._arun_units(step)
+
+    def _get_item_tasks(self, step):
+        """Task pool of a loop or entity unit with concurrency, shared per run."""
+        if id(step) not in self.item_tasks:
+            self.item_tasks[id(step)] = AsyncItemPool(
+                step.data['concurrency'],
+                on_error=step.data.get('on_error', FAIL_FAST),
+            )
+
+        return self.item_tasks[id(step)]
+
+    def _close_item_tasks(self):
+        pools, self.item_tasks = self.item_tasks, {}
+
+        for pool in pools.values():
+            pool.shutdown()
+
+            for error in pool.errors:
+                self.events.append({
+                    'type': 'loop_error',
+                    'error': repr(error)
+                })
+
+    async def _arun_item(self, step, scope, item, sequence_key=None, index=None):
+        """Run the nested steps of a loop or entity unit for one item."""
+        item_key = None
+
+        if sequence_key is not None:
+            item_key = self._item_key(sequence_key, index)
+
+        self.metrics.inc('items_total', unit=step.type)
+
+        with self._child_scope(scope, item_key):
+            self._put_data(item, step.store_data_on)
+            await self._arun_steps(step.steps)
+
+        if sequence_key is not None and self._mark_done(sequence_key, index):
+            await self._asave_progress()
+
+    async def _aflush_entity_writers(self):
+        for writer in list(self.entity_writers.values()):
+            await writer.aflush()
+
+    async def _asave_progress(self):
+        """See WorkflowHandler._save_progress."""
+        await self._aflush_entity_writers()
+        await asyncio.to_thread(self._write_progress)
+
+    async def _apage_done(self, step, sequence_key, next_page, page_size, entities):
+        await self._aflush_entity_writers()
+        self._move_cursor(sequence_key, next_page, page_size, entities)
+        await self._asave_progress()
+
+    async def _aclose_entity_writers(self):
+        """See WorkflowHandler._close_entity_writers."""
+        writers, self.entity_writers = self.entity_writers, {}
+        error = None
+
+        for writer in writers.values():
+            try:
+                await writer.aclose()
+            except Exception as err:
+                log.error('Entity saves failed: %r', err)
+                error = error or err
+
+            self._report_entity_saves(writer)
+
+        return error
+
+    async def _ahandle_entity_fetch(self, step):
+        """See WorkflowHandler._handle_entity_fetch."""
+        data_gate, sequence_key, page_size, start_page = self._entity_paging(step)
+        pool = None
+
+        if step.data.get('concurrency', 1) > 1:
+            pool = self._get_item_tasks(step)
+
+        pages = data_gate.aiter_pages(
+            page_size,
+            prefetch=step.data.get('prefetch', DEFAULT_PREFETCH),
+            start_page=start_page
+        )
+        page_number = start_page
+
+        async for page in pages:
+            shaping_units = []
+
+            if any(self._shaping_units(step)):
+                # Waits on the transform workers.
+                shaping_units = await asyncio.to_thread(
+                    self._shape_page, step, page['results'], sequence_key)
+
+            entities = self._page_entities(page, sequence_key)
+            batch = pool.batch() if pool else None
+
+            for entity_id, entity in entities:
+                if pool:
+                    await pool.submit(
+                        self._arun_item, step, self.data, [entity], sequence_key, entity_id, batch=batch)
+                else:
+                    await self._arun_item(step, None, [entity], sequence_key, entity_id)
+
+            if pool:
+                await pool.wait(batch)
+
+            self._drop_shaped(shaping_units)
+
+            if self.checkpoint is not None:
+                await self._apage_done(step, sequence_key, page_number + 1, page_size, entities)
+
+            page_number += 1
+
+    async def _aunit_entity(self, step):
+        """See WorkflowHandler._unit_entity."""
+        doc_data = step.data
+
+        if doc_data['operation'] == 'read':
+            if doc_data.get('entity_id'):
+                log.debug('Fetching entity %s', doc_data['entity_id'])
+
+                response = await self._get_data_gate(step).aget_entity(doc_data['entity_id'])
+
+                if response is not None:
+                    self._put_data(response['doc_data'], step.store_data_on)
+                    await self._arun_steps(step.steps)
+            elif 'entity_id' not in doc_data:
+                await self._ahandle_entity_fetch(step)
+
+        if doc_data['operation'] == 'create':
+            self._save_entities(step)
+
+    async def _aunit_loop(self, step):
+        """Run the nested steps for every item, see WorkflowHandler._unit_loop."""
+        pool = None
+        batch = None
+
+        if step.data.get('concurrency', 1) > 1:
+            pool = self._get_item_tasks(step)
+            batch = pool.batch()
+
+        sequence_key = self._sequence_key(step)
+
+        for index, (entry, item) in enumerate(self._loop_items(step)):
+            index = self._loop_item_key(entry, item, index)
+
+            if self._is_done(sequence_key, index):
+                continue
+
+            if pool:
+                await pool.submit(
+                    self._arun_item, step, self.data, item, sequence_key, index, batch=batch)
+            else:
+                await self._arun_item(step, None, item, sequence_key, index)
+
+        if pool:
+            await pool.wait(batch)
+
+    async def _aunit_action_connector_wordpress(self, step):
+        """See WorkflowHandler._unit_action_connector_wordpress."""
+        method = step.data.get('method', 'get').lower()
+        wpapi = self._get_wordpress(step)
+        endpoint = self._wordpress_endpoint(step)
+
+        if method == 'delete':
+            try:
+                await wpapi.adelete(endpoint)
+            except UserWarning as err:
+                pass
+
+        await self._arun_steps(step.steps)
+
+    async def _ashape_product(self, step, woocomm, data):
+        """See WorkflowHandler._shape_product."""
+        transform_pool = self._get_transform_pool(step)
+
+        if not transform_pool:
+            return self._shape_product(step, woocomm, data)
+
+        shaped, tmp_data = self._take_shaped(step, data) or \
+            await asyncio.wrap_future(transform_pool.submit(data))
+        self._update_listing(data, shaped)
+
+        return tmp_data
+
+    async def _awoocomm_put(self, step, woocomm, endpoint, payload):
+        """See WorkflowHandler._woocomm_put."""
+        digest, skipped = self._check_put(step, endpoint, payload)
+
+        if skipped:
+            return skipped
+
+        response = await woocomm.ahttp_put(endpoint, payload)
+        self._put_sent(step, payload, digest, response)
+
+        return response
+
+    async def _aunit_action_connector_woocommerce(self, step):
+        """See WorkflowHandler._unit_action_connector_woocommerce."""
+        doc_data = step.data
+        method = doc_data.get('method', 'get').lower()
+        tmp_data = False
+        data = self._get_data(step.get_data_on)
+        response = {}
+        woocomm = self._get_woocomm(step)
+
+        if method in ['post', 'put']:
+            tmp_data = await self._ashape_product(step, woocomm, data)
+
+        endpoint, tmp_data = self._woocomm_request(step, data, tmp_data)
+
+        # Making a POST only if woocomm_listing_id is not set.
+        if method == 'post':
+            try:
+                if not tmp_data['woocomm_listing_id']:
+                    raise KeyError()
+            except KeyError as err:
+                log.debug('%s KeyError, woocomm_listing_id is not set for a create request, proceeding...', err)
+                response = await woocomm.ahttp_post(endpoint, tmp_data)
+
+        if method == 'put':
+            try:
+                if not tmp_data['id']:
+                    raise KeyError()
+
+                response = await self._awoocomm_put(step, woocomm, endpoint, tmp_data)
+            except KeyError as err:
+                log.warning("%s KeyError, woocommerce listing 'id' is not set for an update request, ignoring...", err)
+
+        if method == 'get':
+            per_page = doc_data.get('per_page', None)
+
+            if doc_data.get('paginated', None):
+                while True:
+                    response = await woocomm.ahttp_get(endpoint, 0, per_page)
+
+                    if not response:
+                        break
+
+                    self._put_data(response, step.store_data_on)
+                    await self._arun_steps(step.steps)
+            else:
+                response = await woocomm.ahttp_get(endpoint, doc_data.get('offset', None), per_page)
+
+        if method == 'delete':
+            response = await woocomm.ahttp_delete(endpoint)
+
+        if method == 'options':
+            response = await woocomm.ahttp_options(endpoint)
+
+        self.http_response_data = response
+        self._put_data(response, step.store_data_on)
+        await self._arun_steps(step.steps)
+
+    async def _aunit_connector_etsy(self, step):
+        """See WorkflowHandler.process_etsy_request."""
+        conn_etsy = self._get_etsy(step)
+        method = step.data.get('method', 'get').lower()
+        url = self._etsy_url(step, step.data.get('url'))
+
+        if method == 'get':
+            params, incremental, watermark = self._etsy_paging(step, url)
+            kwargs = {'params': params} if params else {}
+
+            async for result in conn_etsy.aiterate_pages('aexecute_authed', url, **kwargs):
+                result, last_page = self._etsy_page(step, url, result, incremental, watermark)
+
+                with self._child_scope():
+                    self._put_etsy_page(step, result)
+                    await self._arun_steps(step.steps)
+
+                if last_page:
+                    break
+
+        if method == 'post':
+            for payload in self._etsy_listings(step):
+                await conn_etsy.acreate_listings(payload=payload)
+
+    async def run_async(self, passed_steps=False):
+        """Run workflow process working step by step on the running event loop."""
+        run_steps = self.steps
+
+        if passed_steps:
+            run_steps = passed_steps
+
+        self.http_client = make_client(self.max_in_flight)
+        completed = False
+        save_error = None
+
+        try:
+            await self._arun_plan(run_steps)
+            completed = True
+        finally:
+            self._close_item_tasks()
+            await asyncio.to_thread(self._close_transform_pools)
+            save_error = await self._aclose_entity_writers()
+            completed = completed and save_error is None
+            await asyncio.to_thread(self._close_checkpoint, completed)
+            self._close_put_counts()
+            await asyncio.to_thread(self._close_watermarks, completed)
+            await asyncio.to_thread(self._close_state)
+            await asyncio.to_thread(self._close_metrics)
+            await self.http_client.aclose()
+            self.http_client = None
+
+        if save_error is not None:
+            raise save_error
+
+    def run(self, passed_steps=False):
+        """Run workflow process working step by step."""
+        return asyncio.run(self.run_async(passed_steps))
@@ -0,0 +1,245 @@
+import asyncio
+import base64
+import collections
+import gzip
+import hashlib
+import json
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from .aio import httpx_response, prepared_request, requests_response, unread_response
+from .logs import SECRET_PARAMS
+
+
+# Headers describing the body as it came over the wire, the cassette keeps
+# the decoded body.
+WIRE_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+
+
+def request_url(url):
+    """
+    Url of a request as kept in a cassette: OAuth parameters change on every
+    request and credentials have no business on disk, both are dropped.
+    The remaining parameters are sorted.
+    """
+    parts = urlsplit(url)
+    params = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.startswith('oauth_') and key not in SECRET_PARAMS
+    )
+
+    return urlunsplit(parts._replace(query=urlencode(params)))
+
+
+def body_digest(request):
+    body = request.body or b''
+
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+
+    # Compressed bodies carry a timestamp, compare what they hold.
+    if request.headers.get('Content-Encoding') == 'gzip':
+        body = gzip.decompress(body)
+
+    return hashlib.sha1(body).hexdigest()
+
+
+class CassetteRecorder(object):
+    def __init__(self, path):
+        """
+        Record every HTTP exchange made through `requests`, or the async
+        client, while active, to a gzipped JSON lines cassette at `path`. Every line holds the
+        request method, url and body digest, the response and how long it
+        took. Use it as a context manager around a workflow run.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.cassette = None
+        self.original = None
+        self.original_async = None
+        self.count = 0
+
+    def _record(self, request, response, elapsed):
+        content = response.content
+        entry = {
+            'method': request.method,
+            'url': request_url(request.url),
+            'body': body_digest(request),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': {key: value for key, value in response.headers.items()
+                        if key.lower() not in WIRE_HEADERS},
+            'elapsed': round(elapsed, 6),
+        }
+
+        try:
+            entry['content'] = content.decode('utf-8')
+        except UnicodeDecodeError:
+            entry['content_b64'] = base64.b64encode(content).decode('ascii')
+
+        line = json.dumps(entry, separators=(',', ':'))
+
+        with self.lock:
+            self.cassette.write(line + '\n')
+            self.count += 1
+
+    def __enter__(self):
+        recorder = self
+        send = self.original = HTTPAdapter.send
+        self.cassette = gzip.open(self.path, 'wt', encoding='utf-8')
+
+        def recording_send(adapter, request, **kwargs):
+            start = time.perf_counter()
+            response = send(adapter, request, **kwargs)
+            recorder._record(request, response, time.perf_counter() - start)
+
+            return response
+
+        handle = self.original_async = httpx.AsyncHTTPTransport.handle_async_request
+
+        async def recording_handle(transport, request):
+            start = time.perf_counter()
+            response = await handle(transport, request)
+            raw = b''.join([chunk async for chunk in response.aiter_raw()])
+            await response.aclose()
+            elapsed = time.perf_counter() - start
+
+            # The client gets the body unread, and reads and times it itself.
+            recorded = unread_response(response, raw, request)
+            recorded.read()
+            response = unread_response(response, raw, request)
+            prepared = prepared_request(request)
+            recorder._record(prepared, requests_response(recorded, prepared), elapsed)
+
+            return response
+
+        HTTPAdapter.send = recording_send
+        httpx.AsyncHTTPTransport.handle_async_request = recording_handle
+
+        return self
+
+    def __exit__(self, *exc):
+        HTTPAdapter.send = self.original
+        httpx.AsyncHTTPTransport.handle_async_request = self.original_async
+
+        with self.lock:
+            self.cassette.close()
+
+
+class CassettePlayer(object):
+    def __init__(self, path, latency_scale=1.0):
+        """
+        Answer every HTTP request made through `requests`, or the async
+        client, from a cassette instead of the network. Requests are
+        matched on method, url and body, falling back to method and url. Every recorded response is
+        served once, in the order it was recorded, from one queue per
+        method and url whichever way it's matched; the last one is served
+        again once they run out.
+
+        Every response takes as long as it took when recorded, times
+        `latency_scale`; 0 answers right away.
+        """
+        self.path = path
+        self.latency_scale = latency_scale
+        self.lock = threading.Lock()
+        self.original = None
+        self.original_async = None
+        self.recorded = collections.defaultdict(list)
+        self.served = 0
+        self.missed = 0
+
+        with gzip.open(path, 'rt', encoding='utf-8') as cassette:
+            for line in cassette:
+                entry = json.loads(line)
+                self.recorded[(entry['method'], entry['url'])].append(entry)
+
+    def _take(self, entries, digest):
+        """
+        The first entry recorded with the request body, or the first entry
+        if none was. It's taken off the queue unless it's the last one.
+        """
+        position = next(
+            (index for index, entry in enumerate(entries) if entry['body'] == digest), 0)
+
+        if len(entries) > 1:
+            return entries.pop(position)
+
+        return entries[0]
+
+    def _find(self, request):
+        url = request_url(request.url)
+        digest = body_digest(request)
+
+        with self.lock:
+            entries = self.recorded.get((request.method, url))
+
+            if not entries:
+                self.missed += 1
+
+                return None
+
+            self.served += 1
+
+            return self._take(entries, digest)
+
+    def _response(self, request, entry):
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.reason = entry['reason']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.url = request.url
+        response.request = request
+
+        if 'content' in entry:
+            response._content = entry['content'].encode('utf-8')
+        else:
+            response._content = base64.b64decode(entry['content_b64'])
+
+        return response
+
+    def _missed(self, request):
+        return 'No recorded response for {} {}'.format(request.method, request_url(request.url))
+
+    def send(self, request, **kwargs):
+        entry = self._find(request)
+
+        if entry is None:
+            raise requests.ConnectionError(self._missed(request), request=request)
+
+        if self.latency_scale:
+            time.sleep(entry['elapsed'] * self.latency_scale)
+
+        return self._response(request, entry)
+
+    async def asend(self, request):
+        """Answer a request of the async client, the latency awaited."""
+        prepared = prepared_request(request)
+        entry = self._find(prepared)
+
+        if entry is None:
+            raise httpx.ConnectError(self._missed(prepared), request=request)
+
+        if self.latency_scale:
+            await asyncio.sleep(entry['elapsed'] * self.latency_scale)
+
+        return httpx_response(self._response(prepared, entry), request)
+
+    def __enter__(self):
+        player = self
+        self.original = HTTPAdapter.send
+        self.original_async = httpx.AsyncHTTPTransport.handle_async_request
+        HTTPAdapter.send = lambda _adapter, request, **kwargs: player.send(request, **kwargs)
+        httpx.AsyncHTTPTransport.handle_async_request = \
+            lambda _transport, request: player.asend(request)
+
+        return self
+
+    def __exit__(self, *exc):
+        HTTPAdapter.send = self.original
+        httpx.AsyncHTTPTransport.handle_async_request = self.original_async
@@ -0,0 +1,120 @@
+"""
+WooCommerce categories of Etsy listings, resolved from their
+`taxonomy_path` through the `category_mapper` of a unit's `custom` config.
+
+Mapper keys are either a single taxonomy level ("Rings") or a path joined
+with ', ' ("Clothing, Men's Clothing, Shirts, T-shirts"), so the mapper
+itself is the prefix index: the prefixes of a path are looked up joined
+the same way. A catalog holds few distinct taxonomy paths compared to its
+listings, the categories of every path are resolved once and memoized.
+"""
+ANY_LEVEL = 'any_level'
+LONGEST_PREFIX = 'longest_prefix'
+MATCH_MODES = (ANY_LEVEL, LONGEST_PREFIX)
+
+PATH_SEPARATOR = ', '
+
+INDEX_CACHE_SIZE = 64
+RESOLVED_CACHE_SIZE = 4096
+
+_indexes = {}
+
+
+class CategoryIndex(object):
+    def __init__(self, category_mapper, mode=ANY_LEVEL):
+        """
+        Category ids of taxonomy paths, by `mode`:
+
+        - `any_level`: every level of the path found in the mapper, then
+          the whole path, without repeating ids. This is how categories
+          have always been resolved.
+        - `longest_prefix`: only the id of the longest prefix of the path
+          found in the mapper, e.g. "Clothing, Men's Clothing" for a
+          "Clothing, Men's Clothing, Shirts" listing.
+
+        The index works off a copy of `category_mapper` taken here.
+        """
+        if mode not in MATCH_MODES:
+            raise ValueError('Unknown category match {}, expected one of {}'.format(
+                mode, ', '.join(MATCH_MODES)))
+
+        self.mode = mode
+        self.ids = dict(category_mapper)
+        self.resolved = {}
+        # Lookups of paths not memoized yet.
+        self.misses = 0
+
+    def _any_level(self, path):
+        ids = self.ids
+        found = [ids[level] for level in path if level in ids]
+        whole_path = PATH_SEPARATOR.join(path)
+
+        if whole_path in ids:
+            found.append(ids[whole_path])
+
+        return tuple(dict.fromkeys(found))
+
+    def _longest_prefix(self, path):
+        ids = self.ids
+
+        for end in range(len(path), 0, -1):
+            prefix = PATH_SEPARATOR.join(path[:end])
+
+            if prefix in ids:
+                return (ids[prefix],)
+
+        return ()
+
+    def _resolve(self, key):
+        self.misses += 1
+
+        if self.mode == LONGEST_PREFIX:
+            found = self._longest_prefix(key)
+        else:
+            found = self._any_level(key)
+
+        if len(self.resolved) >= RESOLVED_CACHE_SIZE:
+            self.resolved.clear()
+
+        self.resolved[key] = found
+
+        return found
+
+    def category_ids(self, taxonomy_path):
+        """Category ids of a taxonomy path, a list of levels."""
+        key = tuple(taxonomy_path)
+        found = self.resolved.get(key)
+
+        if found is None:
+            found = self._resolve(key)
+
+        return found
+
+    def categories(self, taxonomy_path):
+        """The `categories` of a WooCommerce product in a taxonomy path."""
+        return [{'id': category_id} for category_id in self.category_ids(taxonomy_path)]
+
+
+def category_index(category_mapper, mode=ANY_LEVEL):
+    """
+    The CategoryIndex of a mapper, built once per mapper and mode. Mappers
+    are cached by identity, as `mapper.compile_mapping` caches mappings:
+    they're part of the workflow config, which isn't changed while a
+    workflow runs.
+    """
+    key = (id(category_mapper), mode)
+    cached = _indexes.get(key)
+
+    if cached is not None:
+        return cached[1]
+
+    index = CategoryIndex(category_mapper, mode)
+
+    if len(_indexes) >= INDEX_CACHE_SIZE:
+        _indexes.clear()
+
+    # The mapper itself is held on to, so its id can't be reused while
+    # it's cached.
+    _indexes[key] = (category_mapper, index)
+
+    return index
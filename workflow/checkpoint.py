@@ -0,0 +1,119 @@
+import threading
+
+
+DEFAULT_CHECKPOINT_INTERVAL = 100
+
+
+class Checkpoint(object):
+    def __init__(self, store, run_id, resume=False):
+        """
+        Progress of a workflow run, kept in a StateStore so that a run that
+        died can be resumed without redoing finished work.
+
+        Work is tracked per sequence: the entities read by an entity unit,
+        or the items of one loop run. Finished items are marked by the
+        entity id, the item id, or the index of items without an id. For
+        every sequence the highest integer up to which all items are done
+        is kept, plus the items finished out of order beyond it, so a
+        serial loop over items without ids only ever stores a single row.
+        Entity units also keep the page to continue from.
+
+        Marks are collected in memory and written by `save`, the caller
+        decides when that is safe. A run that isn't resumed starts by
+        dropping the progress of the previous one.
+        """
+        self.store = store
+        self.namespace = 'checkpoint:{}'.format(run_id)
+        self.lock = threading.Lock()
+        self.sequences = {}
+        self.changes = {}
+
+        if not resume:
+            self.store.delete(self.namespace)
+
+    def _sequence(self, key):
+        sequence = self.sequences.get(key)
+
+        if sequence is None:
+            watermark = self.store.get(self.namespace, 'watermark:{}'.format(key), -1)
+            prefix = 'done:{}#'.format(key)
+            # The prefix also matches the items of sequences nested in this
+            # one, only keep the rows of its own items.
+            done = set(
+                value for row_key, value in self.store.items(self.namespace, prefix)
+                if row_key == '{}{}'.format(prefix, value)
+            )
+            sequence = self.sequences[key] = [watermark, done]
+
+        return sequence
+
+    def is_done(self, key, index):
+        """Whether item `index` of sequence `key` has been finished."""
+        with self.lock:
+            watermark, done = self._sequence(key)
+
+        if isinstance(index, int) and index <= watermark:
+            return True
+
+        return index in done
+
+    def done(self, key, index):
+        """Mark item `index` of sequence `key` as finished."""
+        with self.lock:
+            sequence = self._sequence(key)
+            watermark, done = sequence
+
+            if index in done or (isinstance(index, int) and index <= watermark):
+                return
+
+            done.add(index)
+
+            while watermark + 1 in done:
+                watermark += 1
+                done.discard(watermark)
+
+            if watermark != sequence[0]:
+                sequence[0] = watermark
+                self.changes['watermark:{}'.format(key)] = watermark
+
+            if index in done:
+                self.changes['done:{}#{}'.format(key, index)] = index
+
+    def start_page(self, key, page_size):
+        """Page an entity unit continues from, 1 unless resumed."""
+        cursor = self.store.get(self.namespace, 'cursor:{}'.format(key))
+
+        if cursor is None or cursor['page_size'] != page_size:
+            return 1
+
+        return cursor['page']
+
+    def set_page(self, key, page, page_size):
+        """Record that every entity before `page` is done."""
+        with self.lock:
+            self.changes['cursor:{}'.format(key)] = {
+                'page': page,
+                'page_size': page_size
+            }
+
+    @property
+    def pending(self):
+        return len(self.changes)
+
+    def take(self):
+        """Hand out the marks collected since the last call."""
+        with self.lock:
+            changes, self.changes = self.changes, {}
+
+        return changes
+
+    def save(self, changes):
+        self.store.put_many(self.namespace, changes)
+
+    def clear(self):
+        """Drop all progress, the run is complete."""
+        with self.lock:
+            self.sequences = {}
+            self.changes = {}
+
+        self.store.delete(self.namespace)
@@ -0,0 +1,187 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+FAIL_FAST = 'fail'
+CONTINUE = 'continue'
+
+log = logging.getLogger(__name__)
+
+
+class ItemBatch(object):
+    def __init__(self):
+        """
+        The items one loop run submitted to a pool, so the run can wait for
+        its own items while other runs of the same loop keep theirs going.
+        """
+        self.in_flight = 0
+
+
+class ItemPool(object):
+    def __init__(self, max_workers, on_error=FAIL_FAST, name='loop'):
+        """
+        Bounded worker pool running loop items. At most `max_workers` items
+        are in flight; submitting more blocks until a worker is free, so
+        items are never queued up in memory.
+
+        With the fail-fast policy the first error is raised by the next
+        `submit` or `wait` call and no further items are started. With the
+        continue policy errors are collected on `errors` and the remaining
+        items keep running. A SystemExit raised by an item always stops the
+        run.
+
+        Items can be submitted as part of an ItemBatch, see `batch`, and
+        waited for batch by batch.
+        """
+        self.max_workers = max_workers
+        self.on_error = on_error
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix=name
+        )
+        self.slots = threading.Semaphore(max_workers)
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.in_flight = 0
+        self.error = None
+        self.errors = []
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+
+            raise error
+
+    def _done(self, batch, future):
+        error = future.exception()
+
+        with self.lock:
+            if error is not None:
+                if self.on_error == CONTINUE and isinstance(error, Exception):
+                    log.warning('Loop item failed, continuing: %r', error)
+                    self.errors.append(error)
+                elif self.error is None:
+                    self.error = error
+
+            self.in_flight -= 1
+
+            if batch is not None:
+                batch.in_flight -= 1
+
+            self.idle.notify_all()
+
+        self.slots.release()
+
+    def batch(self):
+        return ItemBatch()
+
+    def submit(self, fn, *args, batch=None):
+        """
+        Run `fn(*args)` on a free worker, waiting for one if needed. The
+        item runs in a copy of the submitter's context, workers don't
+        inherit it otherwise.
+        """
+        self.slots.acquire()
+
+        with self.lock:
+            if self.error is not None:
+                self.slots.release()
+                self._raise_error()
+
+            self.in_flight += 1
+
+            if batch is not None:
+                batch.in_flight += 1
+
+        self.executor.submit(contextvars.copy_context().run, fn, *args).add_done_callback(
+            functools.partial(self._done, batch))
+
+    def wait(self, batch=None):
+        """Wait for every item in flight, or every item of `batch`, to finish."""
+        pending = batch or self
+
+        with self.lock:
+            while pending.in_flight:
+                self.idle.wait()
+
+            self._raise_error()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class AsyncItemPool(object):
+    def __init__(self, max_tasks, on_error=FAIL_FAST):
+        """
+        Event loop counterpart of ItemPool: runs loop items as tasks, at
+        most `max_tasks` at a time, with the same error policies.
+        """
+        self.max_tasks = max_tasks
+        self.on_error = on_error
+        self.slots = asyncio.Semaphore(max_tasks)
+        self.tasks = set()
+        self.error = None
+        self.errors = []
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+
+            raise error
+
+    def _done(self, batch, task):
+        self.tasks.discard(task)
+
+        if batch is not None:
+            batch.discard(task)
+
+        self.slots.release()
+
+        if task.cancelled():
+            return
+
+        error = task.exception()
+
+        if error is not None:
+            if self.on_error == CONTINUE and isinstance(error, Exception):
+                log.warning('Loop item failed, continuing: %r', error)
+                self.errors.append(error)
+            elif self.error is None:
+                self.error = error
+
+    def batch(self):
+        """The tasks of one loop run, see ItemBatch."""
+        return set()
+
+    async def submit(self, coro_fn, *args, batch=None):
+        """Start `coro_fn(*args)` as a task, waiting for a free slot if needed."""
+        await self.slots.acquire()
+
+        if self.error is not None:
+            self.slots.release()
+            self._raise_error()
+
+        task = asyncio.ensure_future(coro_fn(*args))
+        self.tasks.add(task)
+
+        if batch is not None:
+            batch.add(task)
+
+        task.add_done_callback(functools.partial(self._done, batch))
+
+    async def wait(self, batch=None):
+        """Wait for every item task, or every task of `batch`, to finish."""
+        pending = self.tasks if batch is None else batch
+
+        while pending:
+            await asyncio.wait(set(pending))
+
+        self._raise_error()
+
+    def shutdown(self):
+        for task in self.tasks:
+            task.cancel()
@@ -0,0 +1,737 @@
+import asyncio
+import gzip
+import json
+import logging
+import math
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from ..aio import call_hooks
+from ..records import json_default
+
+
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_PREFETCH = 1
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 5.0
+# Batches an EntityWriter has waiting for its sender before `add` waits.
+DEFAULT_MAX_PENDING = 2
+
+# Status codes telling that the data gate has no bulk ingestion endpoint.
+BULK_UNAVAILABLE_CODES = [404, 405, 501]
+
+# Failed entity saves whose unique field values are kept for the report.
+FAILED_KEYS_KEPT = 100
+
+log = logging.getLogger(__name__)
+
+
+class DataGate(object):
+    def __init__(self, url, org_id, jwt_token, session=None, metrics=None, client=None):
+        """
+        Data gate connector reading entities of a single org. All requests
+        go over one keep-alive session, recorded on `metrics` if given.
+
+        The `a` prefixed methods make the same requests on `client`, the
+        httpx.AsyncClient of the run, see `workflow.aio`.
+        """
+        self.url = url
+        self.org_id = org_id
+        self.client = client
+        self.headers = {
+            'Content-Type': 'application/json',
+            'Authorization': jwt_token
+        }
+        self.session = session or requests.Session()
+        self.session.headers.update(self.headers)
+
+        if metrics is not None:
+            self.session.hooks['response'].append(metrics.response_hook('datagate'))
+
+    def _read(self, response, reason):
+        if response.status_code in [401, 404]:
+            log.warning(
+                'Got a response error %s, reason: %s',
+                response.status_code,
+                reason)
+            return
+
+        return response.json()
+
+    def _get(self, endpoint_url):
+        response = self.session.get(endpoint_url)
+
+        return self._read(response, response.reason)
+
+    async def _aget(self, endpoint_url):
+        response = await self.client.get(endpoint_url, headers=self.headers)
+        call_hooks(self.session.hooks['response'], response)
+
+        return self._read(response, response.reason_phrase)
+
+    def _body(self, payload, compress):
+        body = json.dumps(payload, default=json_default).encode('utf-8')
+        headers = {}
+
+        if compress:
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+
+        return body, headers
+
+    def _post(self, endpoint_url, payload, compress=False):
+        body, headers = self._body(payload, compress)
+
+        return self.session.post(endpoint_url, data=body, headers=headers)
+
+    async def _apost(self, endpoint_url, payload, compress=False):
+        body, headers = self._body(payload, compress)
+        response = await self.client.post(
+            endpoint_url, content=body, headers=dict(self.headers, **headers))
+        call_hooks(self.session.hooks['response'], response)
+
+        return response
+
+    def save_url(self, mapper_id, bulk=False):
+        return "{}/data_gate/in/{}/{}?mapper_id={}".format(
+            self.url,
+            self.org_id,
+            'bulk/' if bulk else '',
+            mapper_id
+        )
+
+    def save_entity(self, payload, mapper_id, compress=False):
+        """Save a single entity."""
+        return self._post(self.save_url(mapper_id), payload, compress=compress)
+
+    async def asave_entity(self, payload, mapper_id, compress=False):
+        return await self._apost(self.save_url(mapper_id), payload, compress=compress)
+
+    def save_entities(self, payload, mapper_id, compress=False):
+        """
+        Save a batch of entities in one request. The payload carries the
+        shared classifiers, attachments and configs once, and the docs
+        under `items`.
+        """
+        return self._post(self.save_url(mapper_id, bulk=True), payload, compress=compress)
+
+    async def asave_entities(self, payload, mapper_id, compress=False):
+        return await self._apost(self.save_url(mapper_id, bulk=True), payload, compress=compress)
+
+    def entities_url(self, page=1, page_size=DEFAULT_PAGE_SIZE):
+        return "{}/entities/{}/?page={}&page_size={}".format(
+            self.url,
+            self.org_id,
+            page,
+            page_size
+        )
+
+    def entity_url(self, entity_id):
+        return "{}/entities/{}/{}".format(
+            self.url,
+            self.org_id,
+            entity_id
+        )
+
+    def get_entity(self, entity_id):
+        return self._get(self.entity_url(entity_id))
+
+    async def aget_entity(self, entity_id):
+        return await self._aget(self.entity_url(entity_id))
+
+    def _fetch_page(self, endpoint_url):
+        log.debug('Fetching entities %s', endpoint_url, extra={'event': 'page'})
+
+        return self._get(endpoint_url)
+
+    async def _afetch_page(self, endpoint_url):
+        log.debug('Fetching entities %s', endpoint_url, extra={'event': 'page'})
+
+        return await self._aget(endpoint_url)
+
+    def _next_url(self, endpoint_url, page):
+        next_set = page['links']['next']
+
+        return urljoin(endpoint_url, next_set) if next_set else None
+
+    def _follow_links(self, endpoint_url):
+        while endpoint_url:
+            page = self._fetch_page(endpoint_url)
+
+            if page is None:
+                return
+
+            yield page
+
+            endpoint_url = self._next_url(endpoint_url, page)
+
+    def iter_pages(self, page_size=DEFAULT_PAGE_SIZE, prefetch=0, start_page=1):
+        """
+        Iterate over the entity pages of the org, starting at `start_page`
+        and following `links.next` until the last page. Stops early on an
+        auth or not found error.
+
+        With `prefetch` set, up to that many pages are fetched in the
+        background while the caller works on the current one. When the
+        first page reports a total `count` the remaining pages are fetched
+        in parallel within the same window, otherwise the next page is
+        requested as soon as its link is known.
+        """
+        endpoint_url = self.entities_url(page=start_page, page_size=page_size)
+
+        if not prefetch:
+            yield from self._follow_links(endpoint_url)
+
+            return
+
+        # One connection per page in flight, plus the caller's own requests.
+        self.session.mount(self.url, HTTPAdapter(pool_maxsize=prefetch + 1))
+
+        page = self._fetch_page(endpoint_url)
+
+        if page is None:
+            return
+
+        executor = ThreadPoolExecutor(max_workers=prefetch)
+
+        try:
+            if page.get('count') is not None:
+                pages = self._iter_counted_pages(
+                    executor, page, start_page, page_size, prefetch)
+            else:
+                pages = self._iter_linked_pages(executor, endpoint_url, page)
+
+            for page in pages:
+                yield page
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _iter_counted_pages(self, executor, first_page, start_page, page_size, prefetch):
+        """Fetch the pages after the first in parallel, at most `prefetch` at once."""
+        last_page = int(math.ceil(first_page['count'] / float(page_size)))
+        page_numbers = iter(range(start_page + 1, last_page + 1))
+        window = deque()
+
+        def fill_window():
+            while len(window) < prefetch:
+                page_number = next(page_numbers, None)
+
+                if page_number is None:
+                    return
+
+                endpoint_url = self.entities_url(page=page_number, page_size=page_size)
+                window.append(executor.submit(self._fetch_page, endpoint_url))
+
+        fill_window()
+
+        yield first_page
+
+        page = first_page
+        endpoint_url = self.entities_url(page=last_page, page_size=page_size)
+
+        while window:
+            page = window.popleft().result()
+
+            if page is None:
+                return
+
+            fill_window()
+
+            yield page
+
+        # Entities created since the count was taken are on extra pages.
+        next_url = self._next_url(endpoint_url, page)
+
+        if next_url:
+            yield from self._follow_links(next_url)
+
+    def _iter_linked_pages(self, executor, endpoint_url, page):
+        """Follow `links.next`, requesting each page while the previous is used."""
+        while page is not None:
+            next_url = self._next_url(endpoint_url, page)
+            future = executor.submit(self._fetch_page, next_url) if next_url else None
+
+            yield page
+
+            if future is None:
+                return
+
+            endpoint_url = next_url
+            page = future.result()
+
+    async def _afollow_links(self, endpoint_url):
+        while endpoint_url:
+            page = await self._afetch_page(endpoint_url)
+
+            if page is None:
+                return
+
+            yield page
+
+            endpoint_url = self._next_url(endpoint_url, page)
+
+    async def aiter_pages(self, page_size=DEFAULT_PAGE_SIZE, prefetch=0, start_page=1):
+        """
+        Async generator of the pages `iter_pages` yields, the pages read
+        ahead are fetched as tasks.
+        """
+        endpoint_url = self.entities_url(page=start_page, page_size=page_size)
+
+        if not prefetch:
+            async for page in self._afollow_links(endpoint_url):
+                yield page
+
+            return
+
+        page = await self._afetch_page(endpoint_url)
+
+        if page is None:
+            return
+
+        if page.get('count') is not None:
+            pages = self._aiter_counted_pages(page, start_page, page_size, prefetch)
+        else:
+            pages = self._aiter_linked_pages(endpoint_url, page)
+
+        async for page in pages:
+            yield page
+
+    async def _aiter_counted_pages(self, first_page, start_page, page_size, prefetch):
+        last_page = int(math.ceil(first_page['count'] / float(page_size)))
+        page_numbers = iter(range(start_page + 1, last_page + 1))
+        window = deque()
+
+        def fill_window():
+            while len(window) < prefetch:
+                page_number = next(page_numbers, None)
+
+                if page_number is None:
+                    return
+
+                endpoint_url = self.entities_url(page=page_number, page_size=page_size)
+                window.append(asyncio.ensure_future(self._afetch_page(endpoint_url)))
+
+        fill_window()
+
+        try:
+            yield first_page
+
+            page = first_page
+            endpoint_url = self.entities_url(page=last_page, page_size=page_size)
+
+            while window:
+                page = await window.popleft()
+
+                if page is None:
+                    return
+
+                fill_window()
+
+                yield page
+        finally:
+            for task in window:
+                task.cancel()
+
+        next_url = self._next_url(endpoint_url, page)
+
+        if next_url:
+            async for page in self._afollow_links(next_url):
+                yield page
+
+    async def _aiter_linked_pages(self, endpoint_url, page):
+        while page is not None:
+            next_url = self._next_url(endpoint_url, page)
+            task = asyncio.ensure_future(self._afetch_page(next_url)) if next_url else None
+
+            try:
+                yield page
+            except GeneratorExit:
+                if task is not None:
+                    task.cancel()
+
+                raise
+
+            if task is None:
+                return
+
+            endpoint_url = next_url
+            page = await task
+
+
+class EntityWriter(object):
+    def __init__(self, data_gate, mapper_id, **kwargs):
+        """
+        Write-behind buffer for entity saves. Docs are collected and sent in
+        batches once `batch_size` docs are waiting or the oldest waiting doc
+        is older than `flush_interval` seconds, whether or not more docs
+        come in. Batches are sent by a sender thread of the writer, one at
+        a time, so `add` doesn't wait on requests while the data gate
+        session is only ever used by one sender. `add` only waits when
+        `max_pending` batches are already waiting to be sent.
+
+        Docs are posted one by one over the same keep-alive session; with
+        `bulk` a batch goes to the bulk ingestion endpoint instead, and is
+        posted one by one when that fails.
+
+        The outcome of every doc is handed to `on_result(key, tag,
+        status_code)`: the unique field values of the doc, the `tag` given
+        to `add`, and the status code, None when no response came. Outcomes
+        are also counted on `saved` and `failed`, and the unique field
+        values of the first FAILED_KEYS_KEPT failed docs are kept on
+        `failed_keys` for a run summary. A doc whose request raised a
+        RequestException is counted as failed. Any other error of a send
+        is raised by the next `add`, `flush` or `close`.
+        """
+        self.data_gate = data_gate
+        self.mapper_id = mapper_id
+        self.classifiers = kwargs.get('classifiers', [])
+        self.attachments = kwargs.get('attachments', [])
+        self.configs = kwargs.get('configs', {})
+        self.unique_fields = kwargs.get('unique_fields', [])
+        self.batch_size = max(1, kwargs.get('batch_size', DEFAULT_BATCH_SIZE))
+        self.flush_interval = kwargs.get('flush_interval', DEFAULT_FLUSH_INTERVAL)
+        self.compress = kwargs.get('compress', False)
+        self.bulk = kwargs.get('bulk', False)
+        self.max_pending = max(1, kwargs.get('max_pending', DEFAULT_MAX_PENDING))
+        self.on_result = kwargs.get('on_result')
+        self.sender = None
+        # (doc, tag) pairs waiting to be sent.
+        self.buffer = []
+        self.timer = None
+        self.added = 0
+        self.saved = 0
+        self.failed = 0
+        self.failed_keys = []
+        self.error = None
+        self.lock = threading.Lock()
+        # Batches taken off the buffer and still being sent.
+        self.sending = 0
+        self.sent = threading.Condition(self.lock)
+
+    def _payload(self, doc):
+        return {
+            'doc_data': doc,
+            'classifiers': self.classifiers,
+            'attachments': self.attachments,
+            'configs': self.configs
+        }
+
+    def _key(self, doc):
+        try:
+            return tuple(doc.get(field) for field in self.unique_fields)
+        except AttributeError:
+            return ()
+
+    def add(self, doc, tag=None):
+        """Queue a doc for saving, `tag` is handed back with its outcome."""
+        with self.lock:
+            self._raise_error()
+            self.added += 1
+            self.buffer.append((doc, tag))
+
+            if len(self.buffer) >= self.batch_size:
+                docs = self._take()
+            else:
+                docs = None
+
+                if self.timer is None:
+                    self.timer = self._start_timer()
+
+        if docs:
+            self._send(docs)
+
+    def _start_timer(self):
+        timer = threading.Timer(self.flush_interval, self._flush_due)
+        timer.daemon = True
+        timer.start()
+
+        return timer
+
+    def _flush_due(self):
+        with self.lock:
+            docs = self._take()
+
+        if docs:
+            self._send(docs)
+
+    def _raise_error(self):
+        """Raise the error of a send, called holding the lock."""
+        error, self.error = self.error, None
+
+        if error is not None:
+            raise error
+
+    def flush(self):
+        """Send every waiting doc, returns once every doc added is sent."""
+        with self.lock:
+            docs = self._take()
+
+        if docs:
+            self._send(docs)
+
+        with self.lock:
+            while self.sending:
+                self.sent.wait()
+
+            self._raise_error()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.sender is not None:
+                self.sender.shutdown(wait=True)
+                self.sender = None
+
+        return self.saved, self.failed
+
+    def _take(self):
+        """Take the waiting docs off the buffer, called holding the lock."""
+        docs, self.buffer = self.buffer, []
+
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        if docs:
+            self.sending += 1
+
+        return docs
+
+    def _send(self, docs):
+        """
+        Hand a batch taken off the buffer to the sender, waiting while
+        `max_pending` batches are ahead of it.
+        """
+        with self.lock:
+            while self.sending > self.max_pending:
+                self.sent.wait()
+
+            if self.sender is None:
+                self.sender = ThreadPoolExecutor(max_workers=1, thread_name_prefix='entity-writer')
+
+        self.sender.submit(self._send_batch, docs).add_done_callback(self._batch_sent)
+
+    def _batch_sent(self, future):
+        error = future.exception()
+
+        if error is not None:
+            # Nobody waits on the sender, the error is raised by the next
+            # add or flush instead.
+            with self.lock:
+                if self.error is None:
+                    self.error = error
+
+    def _send_batch(self, docs):
+        sent = 0
+
+        try:
+            if self.bulk and self._send_bulk(docs):
+                return
+
+            for doc, tag in docs:
+                try:
+                    response = self.data_gate.save_entity(
+                        self._payload(doc),
+                        self.mapper_id,
+                        compress=self.compress
+                    )
+                except requests.RequestException as err:
+                    log.warning('Entity save failed: %r', err)
+                    self._record(doc, tag, None)
+                else:
+                    self._record(doc, tag, response.status_code)
+
+                sent += 1
+        except Exception:
+            # The docs not sent yet are lost with the batch.
+            for doc, tag in docs[sent:]:
+                self._record(doc, tag, None)
+
+            raise
+        finally:
+            with self.lock:
+                self.sending -= 1
+                self.sent.notify_all()
+
+    def _send_bulk(self, docs):
+        """
+        Send docs through the bulk endpoint. Returns False when the bulk
+        request failed, and stops using bulk requests when the data gate
+        doesn't support them.
+        """
+        try:
+            response = self.data_gate.save_entities(
+                self._bulk_payload(docs),
+                self.mapper_id,
+                compress=self.compress
+            )
+        except requests.RequestException as err:
+            log.warning('Bulk entity save failed (%r), posting the batch one by one.', err)
+
+            return False
+
+        return self._bulk_sent(docs, response)
+
+    def _bulk_payload(self, docs):
+        return {
+            'items': [doc for doc, tag in docs],
+            'classifiers': self.classifiers,
+            'attachments': self.attachments,
+            'configs': self.configs
+        }
+
+    def _bulk_sent(self, docs, response):
+        """Record the outcomes of a bulk request, False when it failed."""
+        if not 200 <= response.status_code < 300:
+            if response.status_code in BULK_UNAVAILABLE_CODES:
+                log.warning(
+                    'Bulk entity save is not available (%s), posting entities one by one.',
+                    response.status_code)
+                self.bulk = False
+            else:
+                log.warning(
+                    'Bulk entity save failed (%s), posting the batch one by one.',
+                    response.status_code)
+
+            return False
+
+        # Per item outcomes when the data gate reports them, otherwise the
+        # whole batch shares the response status.
+        try:
+            item_results = response.json()['results']
+        except (ValueError, KeyError, TypeError):
+            item_results = None
+
+        if not isinstance(item_results, list) or len(item_results) != len(docs):
+            item_results = [{'status_code': response.status_code}] * len(docs)
+
+        for (doc, tag), item_result in zip(docs, item_results):
+            status_code = response.status_code
+
+            if isinstance(item_result, dict):
+                status_code = item_result.get('status_code', status_code)
+
+            self._record(doc, tag, status_code)
+
+        return True
+
+    def _record(self, doc, tag, status_code):
+        """Count and hand out the outcome of a doc, `status_code` None when no response came."""
+        key = self._key(doc)
+
+        with self.lock:
+            if status_code is not None and 200 <= status_code < 300:
+                self.saved += 1
+            else:
+                self.failed += 1
+
+                if len(self.failed_keys) < FAILED_KEYS_KEPT:
+                    self.failed_keys.append(key)
+
+        if self.on_result is not None:
+            self.on_result(key, tag, status_code)
+
+
+class AsyncEntityWriter(EntityWriter):
+    def __init__(self, data_gate, mapper_id, **kwargs):
+        """
+        EntityWriter for the event loop, sending on the data gate's async
+        client. A batch is sent by a task of its own, `add` never waits on
+        a request, and the flush interval is timed by the loop. Await
+        `aflush` and `aclose` instead of `flush` and `close`.
+        """
+        super(AsyncEntityWriter, self).__init__(data_gate, mapper_id, **kwargs)
+
+        self.tasks = set()
+
+    def _start_timer(self):
+        return asyncio.get_running_loop().call_later(self.flush_interval, self._flush_due)
+
+    def _send(self, docs):
+        task = asyncio.ensure_future(self._asend(docs))
+        self.tasks.add(task)
+        task.add_done_callback(self._sent)
+
+    def _sent(self, task):
+        self.tasks.discard(task)
+
+        if task.cancelled() or task.exception() is None:
+            return
+
+        with self.lock:
+            if self.error is None:
+                self.error = task.exception()
+
+    async def aflush(self):
+        """Send every waiting doc, returns once every doc added is sent."""
+        with self.lock:
+            docs = self._take()
+
+        if docs:
+            self._send(docs)
+
+        while self.tasks:
+            await asyncio.wait(set(self.tasks))
+
+        with self.lock:
+            error, self.error = self.error, None
+
+        if error is not None:
+            raise error
+
+    async def aclose(self):
+        await self.aflush()
+
+        return self.saved, self.failed
+
+    async def _asend(self, docs):
+        sent = 0
+
+        try:
+            if self.bulk and await self._asend_bulk(docs):
+                return
+
+            for doc, tag in docs:
+                try:
+                    response = await self.data_gate.asave_entity(
+                        self._payload(doc),
+                        self.mapper_id,
+                        compress=self.compress
+                    )
+                except httpx.HTTPError as err:
+                    log.warning('Entity save failed: %r', err)
+                    self._record(doc, tag, None)
+                else:
+                    self._record(doc, tag, response.status_code)
+
+                sent += 1
+        except BaseException:
+            # Cancelled or not, the docs not sent yet are lost with the batch.
+            for doc, tag in docs[sent:]:
+                self._record(doc, tag, None)
+
+            raise
+        finally:
+            with self.lock:
+                self.sending -= 1
+
+    async def _asend_bulk(self, docs):
+        try:
+            response = await self.data_gate.asave_entities(
+                self._bulk_payload(docs),
+                self.mapper_id,
+                compress=self.compress
+            )
+        except httpx.HTTPError as err:
+            log.warning('Bulk entity save failed (%r), posting the batch one by one.', err)
+
+            return False
+
+        return self._bulk_sent(docs, response)
@@ -3,8 +3,11 @@ import logging
 import six
 import requests
 
+from requests.utils import to_native_string
 from requests_oauthlib import OAuth1
 
+from ...aio import call_hooks
+
 if six.PY3:
     from urllib.parse import parse_qs
     from urllib.parse import urlencode
@@ -34,14 +37,27 @@ class Etsy(object):
             oauth_token=None,
             oauth_token_secret=None,
             sandbox=False,
-            callback_uri='oob'):
+            callback_uri='oob',
+            metrics=None,
+            url_base=None,
+            client=None):
         self.params = {'api_key': consumer_key}
+        # The run's httpx.AsyncClient, for the `a` prefixed methods.
+        self.client = client
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
+        self.response_hooks = {}
+
+        if metrics is not None:
+            self.response_hooks = {'response': metrics.response_hook('etsy')}
 
         if sandbox:
             self.url_base = "http://sandbox.openapi.etsy.com/v2"
 
+        # Another API host, e.g. a local stand-in for benchmarks.
+        if url_base:
+            self.url_base = url_base
+
         # generic authenticated oauth hook
         self.simple_oauth = OAuth1(
             consumer_key,
@@ -74,6 +90,15 @@ class Etsy(object):
 
         return response
 
+    async def acreate_listings(self, **kwargs):
+        payload = kwargs.get('payload')
+
+        return await self.aexecute_authed(
+            '/listings',
+            method='post',
+            params=payload,
+            payload=payload)
+
     def show_listings(self, **kwargs):
         """
         Show all listings on the site.
@@ -271,35 +296,22 @@ class Etsy(object):
             'oauth_token_secret': parsed['oauth_token_secret'][0]
         }
 
-    def execute(self, endpoint, method='get', payload=None, oauth=None, params=None, files=None):
-        """
-        Actually do the request, and raise exception if an error comes back.
-        """
-        hooks = {}
-
-        if oauth:
-            # Making an authenticated request,
-            # add the oauth hook to the request.
-            hooks = {'auth': oauth}
-
-            if params is None:
-                params = {}
-        else:
+    def _url(self, endpoint, oauth=None, params=None):
+        if not oauth:
             if params is None:
                 params = self.params
             else:
                 params.update(self.params)
 
-        querystring = urlencode(params)
+        querystring = urlencode(params or {})
         url = "%s%s" % (self.url_base, endpoint)
 
         if querystring:
             url = "%s?%s" % (url, querystring)
 
-        print(url)
-
-        response = getattr(requests, method)(url, files=files, **hooks)
+        return url
 
+    def _result(self, response):
         if response.status_code > 201:
             e = response.text
             code = response.status_code
@@ -311,6 +323,43 @@ class Etsy(object):
         except (TypeError, ValueError):
             return response.text
 
+    def execute(self, endpoint, method='get', payload=None, oauth=None, params=None, files=None):
+        """
+        Actually do the request, and raise exception if an error comes back.
+        """
+        hooks = {}
+
+        if oauth:
+            # Making an authenticated request,
+            # add the oauth hook to the request.
+            hooks = {'auth': oauth}
+
+        url = self._url(endpoint, oauth, params)
+
+        log.debug('%s %s', method.upper(), url, extra={'event': 'request'})
+
+        response = getattr(requests, method)(
+            url, files=files, hooks=self.response_hooks, **hooks)
+
+        return self._result(response)
+
+    async def aexecute(self, endpoint, method='get', payload=None, oauth=None, params=None):
+        """`execute` on the async client, OAuth signed the way OAuth1 signs."""
+        url = self._url(endpoint, oauth, params)
+        headers = {}
+
+        log.debug('%s %s', method.upper(), url, extra={'event': 'request'})
+
+        if oauth:
+            url, headers, _ = oauth.client.sign(url, method.upper(), None, {})
+            url = to_native_string(url)
+            headers = {to_native_string(k): to_native_string(v) for k, v in headers.items()}
+
+        response = await self.client.request(method.upper(), url, headers=headers)
+        call_hooks(self.response_hooks.values(), response)
+
+        return self._result(response)
+
     def execute_authed(self, endpoint, method='get', params=None, payload=None):
         return self.execute(
             endpoint,
@@ -319,6 +368,14 @@ class Etsy(object):
             params=params,
             payload=payload)
 
+    async def aexecute_authed(self, endpoint, method='get', params=None, payload=None):
+        return await self.aexecute(
+            endpoint,
+            method,
+            oauth=self.full_oauth,
+            params=params,
+            payload=payload)
+
     def iterate_pages(self, f, *p, **kwargs):
         """
         Iterates through pages in a response.
@@ -345,8 +402,26 @@ class Etsy(object):
 
                 kwargs['params']['page'] = response['pagination']['next_page']
 
-                print(kwargs)
+                log.debug('Next page %s', kwargs, extra={'event': 'page'})
 
                 response = f(*p, **kwargs)
 
                 yield response
+
+    async def aiterate_pages(self, f, *p, **kwargs):
+        """Async generator of the pages `iterate_pages` yields, `f` a coroutine method."""
+        f = getattr(self, f)
+        response = await f(*p, **kwargs)
+
+        yield response
+
+        if response['pagination']:
+            while response['pagination']['next_page'] is not None:
+                kwargs.setdefault('params', {})
+                kwargs['params']['page'] = response['pagination']['next_page']
+
+                log.debug('Next page %s', kwargs, extra={'event': 'page'})
+
+                response = await f(*p, **kwargs)
+
+                yield response
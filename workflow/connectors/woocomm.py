@@ -1,26 +1,65 @@
 import os
 import json
-import decimal
-from re import sub
-from urllib.parse import urlparse
+import logging
+from urllib.parse import urlencode, urlparse
 
-from currency_converter import CurrencyConverter
 from woocommerce import API as WooCommAPI
+from woocommerce.oauth import OAuth
 
+from ..categories import ANY_LEVEL, category_index
+from ..currency import get_converter
+from ..pricing import usd_prices, variation_offering_prices
+from ..records import Variation, attribute_option, to_payload
 from ..utils import (
-    RegexRemover,
     grouper,
+    regex_remover,
 )
 
 
+log = logging.getLogger(__name__)
+
+# Removed from listing descriptions unless the unit's `custom` config lists
+# `description_cleaners` of its own. `single_pass_cleaning` in `custom`
+# removes them in one scan, see RegexRemover.
+# The lookbehinds only let a match start where the leftmost match can: at
+# the start of a sentence for the first, at the start of a line for the
+# others. What's removed stays the same, but the patterns aren't tried
+# again from every character of a description.
+DESCRIPTION_CLEANERS = (
+    r"(?<![^.!?])([^.!?]*?(E|e)tsy.*?\.)(?!\d)",
+    r"(?<![^\n]).*.shop_home.*.",
+    r"(?<![^\n]).*.listing-shop.*.",
+    r"(?<![^\n]).*CHECK OUT THE MATCHING.*",
+)
+
+
+def add_property_values(attributes_map, property_values):
+    """
+    Add the values of Etsy product properties to `attributes_map`, values
+    by property name. Values are kept as ordered sets, dicts with every
+    value once in the order first seen.
+    """
+    for property_value in property_values:
+        attribute_values = attributes_map.setdefault(property_value['property_name'], {})
+
+        for attribute_value in property_value['values']:
+            attribute_values[attribute_value] = None
+
+    return attributes_map
+
+
 class WooComm:
     def __init__(self, doc, **kwargs):
         """
         WooCommerce connector handling all requests to a WooCommerce shop.
+        The `ahttp_` methods make the requests of the `http_` ones on
+        `client`, the run's httpx.AsyncClient.
         """
         self.doc = doc
         self.doc_data = doc['data']
         self.vars_mapped = {}
+        self.metrics = kwargs.get('metrics')
+        self.client = kwargs.get('client')
 
         wcapi = WooCommAPI(
             url=kwargs.get('url'),
@@ -34,7 +73,13 @@ class WooComm:
         self.wcapi = wcapi
     
     def _log_event(self, event):
-        print(event)
+        log.info('%s', event)
+
+    def _observe(self, response):
+        if self.metrics is not None:
+            self.metrics.observe_response('woocommerce', response)
+
+        return response
 
     def _generate_custom_structure(self, data, **kwargs):
         image_size = kwargs.get('image_size')
@@ -77,32 +122,43 @@ class WooComm:
                     position_counter += 1
 
                 data['images'] = image_list
-        try:
-            for tax_item in data['taxonomy_path']:
-                if tax_item in category_mapper:
-                    categories.append({'id': category_mapper[tax_item]})
-
-            category_string = ', '.join(data['taxonomy_path'])
+        index = category_index(category_mapper, custom.get('category_match', ANY_LEVEL))
 
-            if category_string in category_mapper:
-                categories.append({'id': category_mapper[category_string]})
+        try:
+            categories = index.categories(data['taxonomy_path'])
         except KeyError as e:
             pass
 
-        data['categories'] = list({v['id']:v for v in categories}.values())
+        data['categories'] = categories
         data['images'] = image_list
-        regex_list = [
-            "([^.!?]*?(E|e)tsy.*?\.)(?!\d)",
-            ".*.shop_home.*.",
-            ".*.listing-shop.*.",
-            ".*CHECK OUT THE MATCHING.*",
-        ]
-        remover = RegexRemover(regex_list)
-        description = remover.handle(data['description'])
+        description = self._description_remover().handle(data['description'])
         data['description'] = description
 
         return data
 
+    def _description_remover(self):
+        custom = self.doc_data.get('custom') or {}
+        cleaners = custom.get('description_cleaners', DESCRIPTION_CLEANERS)
+
+        return regex_remover(
+            tuple(cleaners),
+            single_pass=bool(custom.get('single_pass_cleaning', False))
+        )
+
+    def clean_descriptions(self, listings):
+        """
+        Clean the descriptions of a page of listings in one go, the way
+        `_generate_custom_structure` cleans a single one.
+        """
+        listings = list(listings)
+        descriptions = self._description_remover().handle_many(
+            listing['description'] for listing in listings)
+
+        for listing, description in zip(listings, descriptions):
+            listing['description'] = description
+
+        return listings
+
     def _generate_attributes(self, data):
         data['attributes'] = []
         attributes_map = {}
@@ -114,107 +170,142 @@ class WooComm:
 
             for product in data['products']:
                 if type(product) is dict:
-                    for product_value in product['property_values']:
-                        attribute_name = product_value['property_name']
-                        
-                        if attribute_name not in attributes_map:
-                            attributes_map[attribute_name] = []
-
-                        for attribute_value in product_value['values']:
-                            if attribute_value not in attributes_map[attribute_name]:
-                                attributes_map[attribute_name].append(attribute_value)
-
-        if attributes_map:
-            for attributes_map_key in attributes_map:
-                attribute = {
-                    'name': '',
-                    'visible': True,
-                    'variation': True,
-                    'options': []
-                }
-
-                attribute['name'] = attributes_map_key
-                attribute['options'] = attributes_map[attributes_map_key]
-
-                data['attributes'].append(attribute)
+                    add_property_values(attributes_map, product['property_values'])
+
+        for attribute_name, attribute_values in attributes_map.items():
+            data['attributes'].append({
+                'name': attribute_name,
+                'visible': True,
+                'variation': True,
+                'options': list(attribute_values)
+            })
 
         return data
 
-    def _generate_variations(self, data):
+    def _generate_variations(self, data, prices=None):
+        """
+        The variations of a listing, priced from `prices` when they're
+        priced ahead, see `pricing.page_variation_prices`.
+        """
         create_obj = []
+        products = [
+            product for product in data['products']
+            if type(product) is dict and product['property_values']
+        ]
 
-        for product in data['products']:
-            if type(product) is dict:
-                if product['property_values']:
-                    attributes_map = {}
-
-                    # Generate the attribute map to be used for all the
-                    # offerings in this product set.
-                    for product_value in product['property_values']:
-                        attribute_name = product_value['property_name']
-                    
-                        if attribute_name not in attributes_map:
-                            attributes_map[attribute_name] = []
-
-                        for attribute_value in product_value['values']:
-                            if attribute_value not in attributes_map[attribute_name]:
-                                attributes_map[attribute_name].append(attribute_value)
-
-                    for product_offering in product['offerings']:
-                        variation = {
-                            'regular_price': '',
-                            'purchasable': True,
-                            'stock_quantity': 0,
-                            'attributes': [],
-                        }
-                        cconverter = CurrencyConverter()
-                        amount = decimal.Decimal(sub(r'[^\d.]', '', product_offering['price']['currency_formatted_raw']))
-                        currency_code = product_offering['price']['currency_code']
-                        amount_in_usd = cconverter.convert(amount, currency_code, 'USD')
-                        D = decimal.Decimal
-                        cent = D('0.01')
-                        x = D(amount_in_usd)
-                        variation['regular_price'] = str(x.quantize(cent,rounding=decimal.ROUND_UP))
-                        variation['stock_quantity'] = product_offering['quantity']
-
-                        for attribute in attributes_map:
-                            for attribute_value in attributes_map[attribute]:
-                                attribute_obj = {
-                                    'name': attribute,
-                                    'option': attribute_value
-                                }
-
-                                variation['attributes'].append(attribute_obj)
-
-                    create_obj.append(variation)
+        # Only the last offering of a product makes it into its variation,
+        # so it's the only one shaped, and all of them are priced in one go.
+        if prices is None:
+            prices = usd_prices(variation_offering_prices(data), get_converter())
+
+        prices = iter(prices)
+
+        for product in products:
+            if product['offerings']:
+                # The attribute map used for all the offerings in this
+                # product set.
+                attributes_map = add_property_values({}, product['property_values'])
+                variation = Variation(
+                    next(prices),
+                    product['offerings'][-1]['quantity'],
+                    tuple(
+                        attribute_option(attribute_name, attribute_value)
+                        for attribute_name, attribute_values in attributes_map.items()
+                        for attribute_value in attribute_values
+                    )
+                )
+
+            create_obj.append(variation)
 
         data['create'] = create_obj
 
         return data
 
-    def http_get(self, endpoint, offset, per_page):
+    async def _arequest(self, method, endpoint, data=None):
+        """
+        Make the request `self.wcapi` makes, authenticated the same way, on
+        the async client.
+        """
+        api = self.wcapi
+        url = "{}/{}/{}/{}".format(
+            api.url.rstrip('/'), 'wp-json' if api.wp_api else 'wc-api', api.version, endpoint)
+        headers = {"accept": "application/json"}
+        auth = None
+        params = {}
+
+        if api.is_ssl and not api.query_string_auth:
+            auth = (api.consumer_key, api.consumer_secret)
+        elif api.is_ssl:
+            params = {"consumer_key": api.consumer_key, "consumer_secret": api.consumer_secret}
+        else:
+            url = OAuth(
+                url="{}?{}".format(url, urlencode(params)),
+                consumer_key=api.consumer_key,
+                consumer_secret=api.consumer_secret,
+                version=api.version,
+                method=method
+            ).get_oauth_url()
+
+        if data is not None:
+            data = json.dumps(data, ensure_ascii=False).encode('utf-8')
+            headers["content-type"] = "application/json;charset=utf-8"
+
+        response = await self.client.request(
+            method, url, params=params or None, content=data, headers=headers,
+            auth=auth, timeout=api.timeout)
+
+        return self._observe(response)
+
+    def _get_endpoint(self, endpoint, offset, per_page):
         if offset and per_page:
             endpoint = "{}&per_page={}&offset={}".format(endpoint, per_page, offset)
         
         if per_page:
             endpoint = "{}&per_page={}".format(endpoint, per_page)
 
-        response = self.wcapi.get(endpoint)
+        return endpoint
+
+    def http_get(self, endpoint, offset, per_page):
+        response = self._observe(self.wcapi.get(self._get_endpoint(endpoint, offset, per_page)))
 
         return response.json()
 
+    async def ahttp_get(self, endpoint, offset, per_page):
+        response = await self._arequest("GET", self._get_endpoint(endpoint, offset, per_page))
+
+        return response.json()
+
+    def _post_bodies(self, endpoint, data):
+        """The bodies a post sends, variations go 20 at a time."""
+        if "variations/batch" not in endpoint:
+            return [data]
+
+        attributes = data['create']
+
+        if not attributes:
+            return [{'create': []}]
+
+        return [{'create': list(filter(None.__ne__, i))} for i in grouper(attributes, 20)]
+
     def http_post(self, endpoint, data):
-        if "variations/batch" in endpoint:
-            attributes = data['create']
-
-            if attributes:
-                for i in grouper(attributes, 20):
-                    chunked_list = list(filter(None.__ne__, i))
-                    response = self.wcapi.post(endpoint, {'create': chunked_list})
-            else:
-                response = self.wcapi.post(endpoint, {'create': []})
-        else:
-            response = self.wcapi.post(endpoint, data)
+        # Records become plain dicts here, on their way out.
+        data = to_payload(data)
+
+        for body in self._post_bodies(endpoint, data):
+            response = self._observe(self.wcapi.post(endpoint, body))
+
+        return {
+            "endpoint": endpoint,
+            "method": 'post',
+            "req": data,
+            "res": response.json()
+        }
+
+    async def ahttp_post(self, endpoint, data):
+        data = to_payload(data)
+
+        for body in self._post_bodies(endpoint, data):
+            response = await self._arequest("POST", endpoint, body)
 
         return {
             "endpoint": endpoint,
@@ -223,35 +314,57 @@ class WooComm:
             "res": response.json()
         }
 
+    def _put_requests(self, endpoint, temp_data):
+        """(endpoint, payload) pairs of the products a put sends."""
+        if not isinstance(temp_data, list):
+            return [("{0}/{1}".format(endpoint, temp_data['id']), temp_data)]
+
+        requests = []
+
+        for req_data in temp_data:
+            endpoint = "{0}/{1}".format(endpoint, req_data['id'])
+            requests.append((endpoint, req_data))
+
+        return requests
+
     def http_put(self, endpoint, temp_data):
         ret = []
 
-        if isinstance(temp_data, list):
-            for req_data in temp_data:
-                endpoint = "{0}/{1}".format(endpoint, req_data['id'])
-                response = self.wcapi.put(endpoint, req_data)
-
-                ret.append({
-                    "endpoint": endpoint,
-                    "method": 'put',
-                    "req": req_data,
-                    "res": response.json()
-                })
-        else:
-            endpoint = "{0}/{1}".format(endpoint, temp_data['id'])
-            response = self.wcapi.put(endpoint, temp_data)
+        for endpoint, req_data in self._put_requests(endpoint, to_payload(temp_data)):
+            response = self._observe(self.wcapi.put(endpoint, req_data))
 
             ret.append({
                 "endpoint": endpoint,
                 "method": 'put',
-                "req": temp_data,
+                "req": req_data,
+                "res": response.json()
+            })
+
+        return ret
+
+    async def ahttp_put(self, endpoint, temp_data):
+        ret = []
+
+        for endpoint, req_data in self._put_requests(endpoint, to_payload(temp_data)):
+            response = await self._arequest("PUT", endpoint, req_data)
+
+            ret.append({
+                "endpoint": endpoint,
+                "method": 'put',
+                "req": req_data,
                 "res": response.json()
             })
 
         return ret
 
     def http_delete(self, endpoint):
-        return self.wcapi.delete(endpoint)
+        return self._observe(self.wcapi.delete(endpoint))
+
+    async def ahttp_delete(self, endpoint):
+        return await self._arequest("DELETE", endpoint)
 
     def http_options(self, endpoint):
-        return self.wcapi.options(endpoint)
+        return self._observe(self.wcapi.options(endpoint))
+
+    async def ahttp_options(self, endpoint):
+        return await self._arequest("OPTIONS", endpoint)
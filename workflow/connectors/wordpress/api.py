@@ -14,12 +14,16 @@ from wordpress.auth import BasicAuth, OAuth, OAuth_3Leg
 from wordpress.helpers import StrUtils, UrlUtils
 from wordpress.transport import API_Requests_Wrapper
 
+from ...aio import call_hooks
+
 
 class API(object):
     """ API Class """
 
     def __init__(self, url, consumer_key, consumer_secret, **kwargs):
         self.logger = logging.getLogger(__name__)
+        # httpx.AsyncClient of the run, for the `a` prefixed methods.
+        self.client = kwargs.pop('client', None)
         self.requester = API_Requests_Wrapper(url=url, **kwargs)
 
         auth_kwargs = dict(
@@ -192,6 +196,33 @@ class API(object):
 
         return response
 
+    async def __arequest(self, method, endpoint, data, **kwargs):
+        """ Do requests on the async client """
+
+        endpoint_url = self.requester.endpoint_url(endpoint)
+        endpoint_url = self.auth.get_auth_url(endpoint_url, method, **kwargs)
+        auth = self.auth.get_auth()
+        headers = {"accept": "application/json"}
+
+        if data is not None:
+            data = jsonencode(data, ensure_ascii=False).encode('utf-8')
+            headers["content-type"] = "application/json;charset=utf-8"
+
+        response = await self.client.request(
+            method,
+            endpoint_url,
+            auth=(auth.username, auth.password) if auth is not None else None,
+            content=data,
+            headers=headers,
+            timeout=self.requester.timeout
+        )
+        call_hooks(self.requester.session.hooks['response'], response)
+
+        if response.status_code not in [200, 201, 202]:
+            self.request_post_mortem(response)
+
+        return response
+
     # TODO add kwargs option for headers
 
     def get(self, endpoint, **kwargs):
@@ -210,6 +241,10 @@ class API(object):
         """ DELETE requests """
         return self.__request("DELETE", endpoint, None, **kwargs)
 
+    async def adelete(self, endpoint, **kwargs):
+        """ DELETE requests on the async client """
+        return await self.__arequest("DELETE", endpoint, None, **kwargs)
+
     def options(self, endpoint, **kwargs):
         """ OPTIONS requests """
         return self.__request("OPTIONS", endpoint, None, **kwargs)
@@ -0,0 +1,88 @@
+class DataScope(object):
+    def __init__(self, parent=None):
+        """
+        Layered store for the data units read and write through their
+        `get_data_on` and `store_data_on` paths.
+
+        A child scope sees everything stored on its parents, but its own
+        writes stay local: writing below a key that belongs to a parent,
+        e.g. "entity.woocomm_save_response", copies the containers along
+        the path first, so the parent data is never changed. Dropping the
+        child drops everything it stored.
+        """
+        self.parent = parent
+        self.values = {}
+        # Containers copied or created by this scope, by id. The objects
+        # are kept so that their ids can't be reused while the scope lives.
+        self.owned = {}
+
+    def child(self):
+        return DataScope(self)
+
+    def _lookup(self, key):
+        scope = self
+
+        while scope is not None:
+            if key in scope.values:
+                return scope.values[key]
+
+            scope = scope.parent
+
+        return None
+
+    def get(self, keys):
+        """Value stored on the key path, or None if there is none."""
+        value = self._lookup(keys[0])
+
+        for key in keys[1:]:
+            try:
+                value = value[key]
+            except (KeyError, IndexError, TypeError):
+                return None
+
+        return value
+
+    def _own(self, container, key, value):
+        """
+        Make sure `container[key]` is a dict owned by this scope, copying
+        it, or creating it when missing, and return it.
+        """
+        if id(value) in self.owned and self.owned[id(value)] is value:
+            return value
+
+        if isinstance(value, dict):
+            # The root scope has no parent to protect.
+            if self.parent is None:
+                return value
+
+            value = dict(value)
+        else:
+            value = {}
+
+        container[key] = value
+        self.owned[id(value)] = value
+
+        return value
+
+    def put(self, keys, value):
+        """Store a value on the key path, creating missing levels."""
+        head = keys[0]
+
+        if len(keys) == 1:
+            self.values[head] = value
+
+            return
+
+        container = self._own(self.values, head, self._lookup(head))
+
+        for key in keys[1:-1]:
+            container = self._own(container, key, container.get(key))
+
+        container[keys[-1]] = value
+
+    def as_dict(self):
+        """All the data visible from this scope as a plain dict."""
+        data = self.parent.as_dict() if self.parent is not None else {}
+        data.update(self.values)
+
+        return data
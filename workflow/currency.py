@@ -0,0 +1,170 @@
+import importlib.metadata
+import logging
+import os
+import pickle
+import threading
+
+from currency_converter import CURRENCY_FILE, CurrencyConverter
+
+
+SNAPSHOT_VERSION = 1
+
+log = logging.getLogger(__name__)
+
+# The converter every conversion of the process goes through, see
+# get_converter.
+_converter = None
+_converter_lock = threading.Lock()
+_snapshot_path = None
+
+
+def _source_signature(currency_file):
+    """
+    What a snapshot was made from: the rate file, and the CurrencyConverter
+    release whose internals it holds.
+    """
+    stat = os.stat(currency_file)
+
+    return (
+        os.path.abspath(currency_file),
+        stat.st_size,
+        stat.st_mtime,
+        importlib.metadata.version('CurrencyConverter'),
+    )
+
+
+class RateProvider(object):
+    def __init__(self, currency_file=CURRENCY_FILE, snapshot_path=None):
+        """
+        Currency conversions off a single load of the ECB rate history.
+
+        Loading the history means parsing some 300k rates, which takes a
+        good part of a second, so it's done once per process instead of
+        for every conversion. With `snapshot_path` the parsed rates are
+        kept in a pickle next to the run and loaded from there as long as
+        the rate file they were parsed from stays the same.
+
+        The rates of every (currency, new currency, date) asked for are
+        memoized, conversions give the same results CurrencyConverter
+        gives.
+
+        Snapshots and rate lookups use CurrencyConverter internals
+        (`_rates`, `bounds`, `_get_rate`), which is why requirements.txt
+        pins the release they were written against. A snapshot of another
+        release is never loaded.
+        """
+        self.currency_file = currency_file
+        self.snapshot_path = snapshot_path
+        self.rates = {}
+        self.converter = self._load()
+
+    def _load(self):
+        signature = _source_signature(self.currency_file)
+
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path, 'rb') as snapshot_file:
+                    snapshot = pickle.load(snapshot_file)
+
+                if snapshot['version'] == SNAPSHOT_VERSION and snapshot['source'] == signature:
+                    converter = CurrencyConverter(currency_file=None)
+                    converter._rates = snapshot['rates']
+                    converter.bounds = snapshot['bounds']
+                    converter.currencies = snapshot['currencies']
+
+                    return converter
+            except (OSError, pickle.UnpicklingError, EOFError, KeyError) as err:
+                log.warning('Unreadable rates snapshot %s, reloading the rates: %s', self.snapshot_path, err)
+
+        converter = CurrencyConverter(currency_file=self.currency_file)
+
+        if self.snapshot_path:
+            self._write_snapshot(converter, signature)
+
+        return converter
+
+    def _write_snapshot(self, converter, signature):
+        tmp_path = '{}.tmp'.format(self.snapshot_path)
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'source': signature,
+            'rates': converter._rates,
+            'bounds': converter.bounds,
+            'currencies': converter.currencies,
+        }
+
+        with open(tmp_path, 'wb') as snapshot_file:
+            pickle.dump(snapshot, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp_path, self.snapshot_path)
+
+    def _load_rate_pair(self, currency, new_currency, date):
+        converter = self.converter
+
+        for c in currency, new_currency:
+            if c not in converter.currencies:
+                raise ValueError('{} is not a supported currency'.format(c))
+
+        if date is None:
+            date = converter.bounds[currency].last_date
+        else:
+            try:
+                date = date.date()
+            except AttributeError:
+                pass
+
+        return converter._get_rate(currency, date), converter._get_rate(new_currency, date)
+
+    def rate_pair(self, currency, new_currency='EUR', date=None):
+        """
+        The rates of both currencies against the reference currency, an
+        amount converts as `amount / rates[0] * rates[1]`.
+        """
+        key = (currency, new_currency, date)
+        rates = self.rates.get(key)
+
+        if rates is None:
+            rates = self.rates[key] = self._load_rate_pair(currency, new_currency, date)
+
+        return rates
+
+    def convert(self, amount, currency, new_currency='EUR', date=None):
+        rates = self.rate_pair(currency, new_currency, date)
+
+        return self.converter.cast(amount) / rates[0] * rates[1]
+
+
+def configure(snapshot_path=None):
+    """
+    Keep the parsed rates in a snapshot at `snapshot_path`, from the next
+    time the converter is loaded on.
+    """
+    global _converter, _snapshot_path
+
+    with _converter_lock:
+        _snapshot_path = snapshot_path
+        _converter = None
+
+
+def snapshot_path():
+    return _snapshot_path
+
+
+def set_converter(converter):
+    """Have every conversion go through `converter`, e.g. a fixed rate."""
+    global _converter
+
+    with _converter_lock:
+        _converter = converter
+
+
+def get_converter():
+    """The converter shared by every conversion of the process."""
+    global _converter
+
+    if _converter is None:
+        with _converter_lock:
+            if _converter is None:
+                _converter = RateProvider(snapshot_path=_snapshot_path)
+
+    return _converter
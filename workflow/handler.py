@@ -1,145 +1,569 @@
 import re
-import os
 import sys
-import shutil
 import json
 import collections
-import boto3
-import copy
-import decimal
-import requests
-import operator
-from collections import defaultdict
-from functools import reduce
-from jsonpath_ng import parse
-from currency_converter import CurrencyConverter
-
-from requests import (
-    Request,
-    Session,
-    RequestException
-)
+import hashlib
+import logging
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
 
 from .connectors.wordpress.api import API
 from .connectors.etsy import main
+from .connectors.datagate import (
+    DataGate,
+    EntityWriter,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_FLUSH_INTERVAL,
+    DEFAULT_PAGE_SIZE,
+    DEFAULT_PREFETCH,
+)
 from .connectors.woocomm import WooComm
 
-from .actions import Iterate
-from .utils import form_doc
+from .checkpoint import Checkpoint, DEFAULT_CHECKPOINT_INTERVAL
+from .concurrency import ItemPool, FAIL_FAST
+from .context import DataScope
+from .currency import get_converter
+from .metrics import DEFAULT_TEXTFILE_INTERVAL, Metrics
+from .plan import compile_steps
+from .pricing import page_variation_prices
+from .state import HashIndex, StateStore, payload_hash
+from .transform import DEFAULT_CHUNKSIZE, TransformPool, transform_product
+from .utils import form_doc, form_docs
+
+
+# Listings are imported incrementally by this field, the watermarks are
+# kept in the state store per shop listings url.
+DEFAULT_WATERMARK_FIELD = 'last_modified_tsz'
+WATERMARK_NAMESPACE = 'etsy_watermark'
+
+# Step banners and entity saves are logged for every item, tagged so they
+# can be sampled.
+STEP_EVENT = {'event': 'step'}
+SAVE_EVENT = {'event': 'entity_save'}
+
+log = logging.getLogger(__name__)
 
 
 class WorkflowHandler(object):
-    def __init__(self, workflow_doc, **kwargs):
-        infinitedict = lambda: defaultdict(infinitedict)
+    entity_writer_class = EntityWriter
 
+    def __init__(self, workflow_doc, **kwargs):
         self.workflow_doc = workflow_doc
-        self.data = infinitedict()
-        self.steps = self._sort_steps(self.workflow_doc.get('steps'))
+        self.current_scope = contextvars.ContextVar('workflow_scope')
+        self.current_item = contextvars.ContextVar('workflow_item', default='')
+        # Keys of the current item and of the items it runs within.
+        self.item_path = contextvars.ContextVar('workflow_item_path', default=())
+        self.lock = threading.Lock()
+        self.root_scope = DataScope()
         self.unit_handlers = self._get_unit_handlers()
+        self.steps = compile_steps(self.workflow_doc.get('steps'), self.unit_handlers)
         self.source = self.workflow_doc.get('source', -1)
         self.events = []
         self.return_response_body = True
         self.data_gate_url = kwargs.get('data_gate_url', 'http://localhost')
+        self.etsy_url = kwargs.get('etsy_url')
+        self.data_gates = {}
+        # The async HTTP client of AsyncWorkflowHandler runs.
+        self.http_client = None
+        self.entity_writers = {}
+        self.on_entity_save = kwargs.get('on_entity_save')
+        self.item_pools = {}
+        self.transform_pools = {}
+        # Listings shaped or priced ahead for a page, by unit, see
+        # `_shape_page`.
+        self.shaped_ahead = {}
+        self.state = None
+        self.checkpoint = None
+        self.checkpoint_interval = kwargs.get('checkpoint_interval', DEFAULT_CHECKPOINT_INTERVAL)
+        self.progress_lock = threading.Lock()
+        # Entity saves not confirmed yet by item key, the items done waiting
+        # on them, and the items with a save that failed.
+        self.unconfirmed = collections.Counter()
+        self.waiting_items = {}
+        self.unsaved_items = set()
+        self.held_cursors = set()
+        self.put_hashes = {}
+        self.warnings = set()
+        self.metrics = kwargs.get('metrics') or Metrics()
+        self.metrics_path = kwargs.get('metrics_path')
+        self.metrics_textfile = kwargs.get('metrics_textfile')
+
+        if self.metrics_textfile:
+            self.metrics.start_textfile(
+                self.metrics_textfile,
+                kwargs.get('metrics_interval', DEFAULT_TEXTFILE_INTERVAL)
+            )
+        self.watermarks = {}
+        self.put_counts = {}
+
+        if kwargs.get('state_path'):
+            self.state = StateStore(kwargs['state_path'])
+            self.checkpoint = Checkpoint(
+                self.state,
+                kwargs.get('run_id') or self._run_id(),
+                resume=kwargs.get('resume', False)
+            )
+
+    @property
+    def data(self):
+        """
+        Data scope of the running unit. The scope is tracked per thread, or
+        per task on an event loop, so concurrent items don't see each other.
+        """
+        return self.current_scope.get(self.root_scope)
 
-    def _handle_entity_save(self, doc, data):
-        doc_data = doc['data']
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': doc_data['jwt_token']
-        }
-        payload = {
-            'doc_data': data,
-            'classifiers': doc_data['classifiers'],
-            'attachments': doc_data['attachments'],
-            'configs': {
-                'compound': doc_data['compound'],
-                'unique_fields': doc_data['unique_fields'],
-                'merge': doc_data['merge']
-            }
-        }
-        endpoint_url = "{}/data_gate/in/{}/?mapper_id={}".format(
-            self.data_gate_url,
-            doc_data['org_id'],
-            doc_data['import_mapper_id']
-        )
+    @contextmanager
+    def _child_scope(self, parent=None, item_key=None):
+        """
+        Run the block in a child of the current data scope, or of `parent`,
+        and drop everything it stored when the block is done. With
+        `item_key` the block runs for that item of a checkpointed sequence.
+        """
+        token = self.current_scope.set((parent or self.data).child())
+        item_tokens = None
 
-        ret = requests.post(
-            endpoint_url,
-            data = json.dumps(payload),
-            headers=headers
-        )
+        if item_key is not None:
+            item_tokens = (
+                self.current_item.set(item_key),
+                self.item_path.set(self.item_path.get() + (item_key,))
+            )
 
-        return ret
+        try:
+            yield
+        finally:
+            if item_tokens is not None:
+                self.current_item.reset(item_tokens[0])
+                self.item_path.reset(item_tokens[1])
 
-    def _handle_entity_fetch(self, doc, page=1):
-        print("_handle_entity_fetch page {}".format(page))
+            self.current_scope.reset(token)
 
-        doc_data = doc['data']
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': doc_data['jwt_token']
-        }
-        endpoint_url = "{}/entities/{}/?page={}&page_size=1".format(
-            self.data_gate_url,
-            doc_data['org_id'],
-            page
-        )
+    def _run_id(self):
+        """Checkpoints belong to the workflow doc they were made for."""
+        workflow_json = json.dumps(self.workflow_doc, sort_keys=True)
 
-        response = requests.get(
-            endpoint_url,
-            headers=headers
-        )
+        return hashlib.sha1(workflow_json.encode('utf-8')).hexdigest()
+
+    def _sequence_key(self, step):
+        """Checkpoint key of the items a unit runs within the current item."""
+        return '{}/{}'.format(self.current_item.get(), step.key)
+
+    def _item_key(self, sequence_key, index):
+        return '{}#{}'.format(sequence_key, index)
+
+    def _is_done(self, sequence_key, index):
+        if self.checkpoint is None or index is None:
+            return False
+
+        return self.checkpoint.is_done(sequence_key, index)
+
+    def _item_done(self, sequence_key, index):
+        if self._mark_done(sequence_key, index):
+            self._save_progress()
+
+    def _mark_done(self, sequence_key, index):
+        """
+        Mark an item whose nested steps are done. An item whose entity
+        saves aren't confirmed yet is marked once they are, see
+        `_save_confirmed`, and an item with a failed save never is.
+        Returns whether it's time to save the progress.
+        """
+        if self.checkpoint is None or index is None:
+            return False
+
+        item_key = self._item_key(sequence_key, index)
+
+        with self.lock:
+            if item_key in self.unsaved_items:
+                return False
+
+            if self.unconfirmed[item_key]:
+                self.waiting_items[item_key] = (sequence_key, index)
+
+                return False
+
+        self.checkpoint.done(sequence_key, index)
+
+        return self.checkpoint.pending >= self.checkpoint_interval
+
+    def _save_started(self, tag):
+        """Count an entity save of the items in `tag` as not confirmed yet."""
+        with self.lock:
+            for item_key in tag:
+                self.unconfirmed[item_key] += 1
+
+    def _save_confirmed(self, tag, saved):
+        """
+        Take the outcome of an entity save of the items in `tag`, and mark
+        the items that were only waiting for it.
+        """
+        ready = []
+
+        with self.lock:
+            for item_key in tag:
+                self.unconfirmed[item_key] -= 1
+
+                if not saved:
+                    self.unsaved_items.add(item_key)
+                    self.waiting_items.pop(item_key, None)
+
+                if self.unconfirmed[item_key]:
+                    continue
 
-        if response.status_code in [401, 404]:
-            print('Got a response error {}, reason: {}'.format(
-                response.status_code,
-                response.reason))
+                del self.unconfirmed[item_key]
+
+                if item_key in self.waiting_items:
+                    ready.append(self.waiting_items.pop(item_key))
+
+        # Saved on the writer's thread, within a flush of `_save_progress`
+        # maybe, the marks are written by the next one.
+        for sequence_key, index in ready:
+            self.checkpoint.done(sequence_key, index)
+
+    def _flush_entity_writers(self):
+        for writer in list(self.entity_writers.values()):
+            writer.flush()
+
+    def _save_progress(self):
+        """
+        Write the progress made so far. The entity saves are flushed first,
+        items are only marked once their saves are confirmed.
+        """
+        with self.progress_lock:
+            self._flush_entity_writers()
+            self._write_progress()
+
+    def _write_progress(self):
+        self.checkpoint.save(self.checkpoint.take())
+
+    def _close_checkpoint(self, completed):
+        if self.checkpoint is None:
             return
 
-        response = response.json()
-        next_set = response['links']['next']
-        local_data = response['results']
+        # Pending entity saves have been flushed by now. A run that lost
+        # saves keeps its progress, so a resumed run redoes those items.
+        if completed and not self.unsaved_items:
+            self.checkpoint.clear()
+        else:
+            if completed:
+                log.warning('%s items had entity saves fail, keeping the progress to resume from.',
+                            len(self.unsaved_items))
 
-        self._put_data(local_data, doc_data['store_data_on'])
+            self.checkpoint.save(self.checkpoint.take())
 
-        steps = doc_data.get('steps', False)
+    def _warn_once(self, message):
+        with self.lock:
+            if message in self.warnings:
+                return
 
-        self._run_steps(steps)
+            self.warnings.add(message)
 
-        if next_set:
-            page = int(page) + 1
+        log.warning(message)
 
-            self._handle_entity_fetch(doc, page=page)
+    def _close_state(self):
+        if self.state is not None:
+            self.state.close()
 
-    def _handle_single_entity_fetch(self, doc):
-        print("_handle_single_entity_fetch")
+    def _get_put_hashes(self, step):
+        """
+        Hashes of the products last sent by a WooCommerce put unit with
+        `skip_unchanged` set, shared by the units of the same shop. None
+        when every put is to be sent.
+        """
+        if not step.data.get('skip_unchanged'):
+            return None
 
-        doc_data = doc['data']
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': doc_data['jwt_token']
-        }
-        endpoint_url = "{}/entities/{}/{}".format(
-            self.data_gate_url,
-            doc_data['org_id'],
-            doc_data['entity_id']
-        )
+        if self.state is None:
+            self._warn_once('skip_unchanged needs a state_path to keep hashes in, sending every product.')
+
+            return None
+
+        namespace = 'woocomm_put:{}'.format(step.data.get('url'))
+
+        with self.lock:
+            if namespace not in self.put_hashes:
+                self.put_hashes[namespace] = HashIndex(self.state, namespace)
+
+        return self.put_hashes[namespace]
+
+    def _count_put(self, step, outcome):
+        with self.lock:
+            counts = self.put_counts.setdefault(id(step), {'sent': 0, 'skipped': 0})
+            counts[outcome] += 1
+
+    def _woocomm_put(self, step, woocomm, endpoint, payload):
+        """
+        Put a product, unless it is exactly what was sent for it last time.
+        The hash is only kept once WooCommerce accepted the product.
+        """
+        digest, skipped = self._check_put(step, endpoint, payload)
+
+        if skipped:
+            return skipped
+
+        response = woocomm.http_put(endpoint, payload)
+        self._put_sent(step, payload, digest, response)
+
+        return response
+
+    def _check_put(self, step, endpoint, payload):
+        """
+        The hash of a product put, None when every put is to be sent, and
+        the response standing in for the put when it's unchanged.
+        """
+        hashes = self._get_put_hashes(step)
+
+        if hashes is None:
+            return None, None
+
+        digest = payload_hash(payload)
 
-        response = requests.get(
-            endpoint_url,
-            headers=headers
+        if not hashes.unchanged(str(payload['id']), digest):
+            return digest, None
+
+        self._count_put(step, 'skipped')
+
+        return digest, [{
+            "endpoint": "{0}/{1}".format(endpoint, payload['id']),
+            "method": 'put',
+            "req": payload,
+            "res": None,
+            "skipped": True
+        }]
+
+    def _put_sent(self, step, payload, digest, response):
+        if digest is None:
+            return
+
+        self._count_put(step, 'sent')
+
+        if all(isinstance(item['res'], dict) and 'id' in item['res'] for item in response):
+            self._get_put_hashes(step).update(str(payload['id']), digest)
+
+    def _close_put_counts(self):
+        counts, self.put_counts = self.put_counts, {}
+
+        for step_counts in counts.values():
+            log.info(
+                'WooCommerce products sent: %s, unchanged and skipped: %s',
+                step_counts['sent'],
+                step_counts['skipped'])
+
+            self.events.append({
+                'type': 'woocomm_put',
+                'sent': step_counts['sent'],
+                'skipped': step_counts['skipped']
+            })
+
+    def _get_data_gate(self, step):
+        """Data gate connector for the org and token of a unit, shared per run."""
+        doc_data = step.data
+        key = (doc_data['org_id'], doc_data['jwt_token'])
+
+        with self.lock:
+            if key not in self.data_gates:
+                self.data_gates[key] = DataGate(
+                    self.data_gate_url,
+                    doc_data['org_id'],
+                    doc_data['jwt_token'],
+                    metrics=self.metrics,
+                    client=self.http_client
+                )
+
+        return self.data_gates[key]
+
+    def _get_entity_writer(self, step):
+        """Write-behind buffer collecting the entity saves of a create unit."""
+        data_gate = self._get_data_gate(step)
+
+        with self.lock:
+            if id(step) in self.entity_writers:
+                return self.entity_writers[id(step)]
+
+            doc_data = step.data
+            self.entity_writers[id(step)] = self.entity_writer_class(
+                data_gate,
+                doc_data['import_mapper_id'],
+                classifiers=doc_data['classifiers'],
+                attachments=doc_data['attachments'],
+                configs={
+                    'compound': doc_data['compound'],
+                    'unique_fields': doc_data['unique_fields'],
+                    'merge': doc_data['merge']
+                },
+                unique_fields=doc_data['unique_fields'],
+                batch_size=doc_data.get('batch_size', DEFAULT_BATCH_SIZE),
+                flush_interval=doc_data.get('flush_interval', DEFAULT_FLUSH_INTERVAL),
+                compress=doc_data.get('gzip', False),
+                bulk=doc_data.get('bulk', False),
+                on_result=self._entity_saved
+            )
+
+        return self.entity_writers[id(step)]
+
+    def _entity_saved(self, key, tag, status_code):
+        """
+        Report the outcome of an entity save, to `on_entity_save(key,
+        status_code)` when the handler was given one. `tag` holds the keys
+        of the checkpointed items the save was made for.
+        """
+        saved = status_code is not None and 200 <= status_code < 300
+
+        if saved:
+            log.debug('Saved entity %s', key, extra=SAVE_EVENT)
+        else:
+            log.warning('Entity %s not saved: %s', key, status_code or 'no response')
+
+        if tag:
+            self._save_confirmed(tag, saved)
+
+        if self.on_entity_save is not None:
+            self.on_entity_save(key, status_code)
+
+    def _handle_entity_save(self, step, data):
+        writer = self._get_entity_writer(step)
+        tag = None
+
+        if self.checkpoint is not None:
+            tag = self.item_path.get()
+            self._save_started(tag)
+
+        writer.add(data, tag)
+
+    def _close_entity_writers(self):
+        """
+        Flush every pending entity save and report the outcomes. Returns
+        the first error a writer raised, for the run to raise once it's
+        closed.
+        """
+        writers, self.entity_writers = self.entity_writers, {}
+        error = None
+
+        for writer in writers.values():
+            try:
+                writer.close()
+            except Exception as err:
+                log.error('Entity saves failed: %r', err)
+                error = error or err
+
+            self._report_entity_saves(writer)
+
+        return error
+
+    def _report_entity_saves(self, writer):
+        self.events.append({
+            'type': 'entity_save',
+            'submitted': writer.added,
+            'saved': writer.saved,
+            'failed': writer.failed,
+            'failed_keys': writer.failed_keys
+        })
+
+    def _handle_entity_fetch(self, step):
+        """
+        Page through the org entities. Pages are fetched `page_size` entities
+        at a time, but the nested steps still get one entity per run, stored
+        as a single item list like a page of one. Up to `prefetch` pages are
+        read in the background while the current page is processed.
+
+        With `concurrency` the entities of a page run on the unit's pool,
+        as loop items do, and the page is done once all of them are.
+        """
+        data_gate, sequence_key, page_size, start_page = self._entity_paging(step)
+        pool = None
+
+        if step.data.get('concurrency', 1) > 1:
+            pool = self._get_item_pool(step)
+
+        pages = data_gate.iter_pages(
+            page_size,
+            prefetch=step.data.get('prefetch', DEFAULT_PREFETCH),
+            start_page=start_page
         )
 
-        if response.status_code in [401, 404]:
-            print('Got a response error {}, reason: {}'.format(
-                response.status_code,
-                response.reason))
+        for page_number, page in enumerate(pages, start_page):
+            shaping_units = self._shape_page(step, page['results'], sequence_key)
+            entities = self._page_entities(page, sequence_key)
+            batch = pool.batch() if pool else None
+
+            for entity_id, entity in entities:
+                if pool:
+                    pool.submit(self._run_item, step, self.data, [entity], sequence_key, entity_id, batch=batch)
+                else:
+                    self._run_item(step, None, [entity], sequence_key, entity_id)
+
+            if pool:
+                pool.wait(batch)
+
+            self._drop_shaped(shaping_units)
+
+            if self.checkpoint is not None:
+                self._page_done(step, sequence_key, page_number + 1, page_size, entities)
+
+    def _entity_paging(self, step):
+        """
+        The data gate an entity unit pages through, the checkpoint key of
+        its entities, its page size and the page to start at.
+        """
+        page_size = step.data.get('page_size', DEFAULT_PAGE_SIZE)
+        sequence_key = self._sequence_key(step)
+        start_page = 1
+
+        if self.checkpoint is not None:
+            start_page = self.checkpoint.start_page(sequence_key, page_size)
+
+        return self._get_data_gate(step), sequence_key, page_size, start_page
+
+    def _page_entities(self, page, sequence_key):
+        """(id, entity) pairs of the entities of a page not done yet."""
+        entities = []
+
+        for entity in page['results']:
+            entity_id = entity.get('id')
+
+            if not self._is_done(sequence_key, entity_id):
+                entities.append((entity_id, entity))
+
+        return entities
+
+    def _page_done(self, step, sequence_key, next_page, page_size, entities):
+        """
+        Move the page cursor of an entity unit once every entity of a page
+        is done, see `_move_cursor`.
+        """
+        self._flush_entity_writers()
+        self._move_cursor(sequence_key, next_page, page_size, entities)
+        self._save_progress()
+
+    def _move_cursor(self, sequence_key, next_page, page_size, entities):
+        """
+        Move the page cursor past a page whose entity saves are flushed.
+        After a page with entities not done, the cursor stays where it is
+        for the rest of the run, a resumed run reads the page again and
+        skips the entities done.
+        """
+        item_keys = [self._item_key(sequence_key, entity_id) for entity_id, entity in entities]
+
+        with self.lock:
+            if any(key in self.unsaved_items or key in self.waiting_items for key in item_keys):
+                self.held_cursors.add(sequence_key)
+
+            held = sequence_key in self.held_cursors
+
+        if not held:
+            self.checkpoint.set_page(sequence_key, next_page, page_size)
+
+    def _handle_single_entity_fetch(self, step):
+        log.debug('Fetching entity %s', step.data['entity_id'])
+
+        response = self._get_data_gate(step).get_entity(step.data['entity_id'])
+
+        if response is None:
             return
 
-        response = response.json()
-        self._put_data(response['doc_data'], doc_data['store_data_on'])
-        steps = doc_data.get('steps', False)
-        self._run_steps(steps)
+        self._put_data(response['doc_data'], step.store_data_on)
+        self._run_steps(step.steps)
 
     def _get_unit_handlers(self):
         """Collects references for all unit handlers."""
@@ -148,36 +572,228 @@ class WorkflowHandler(object):
 
         return handlers
 
-    def _sort_steps(self, steps):
-        """Sort steps by order number."""
-        return sorted(steps, key=lambda k: k['order'])
-
-    def _run_units(self, unit):
-        """Run a single workflow unit."""
+    def _run_units(self, step):
+        """Run a single compiled workflow unit."""
         # If unit type is implemented within handler run it.
-        if unit['type'] in self.unit_handlers:
-            handler = self.unit_handlers.get(unit['type'])
+        if step.handler:
+            with self._measure(step):
+                step.handler(step)
 
-            handler(unit)
+    @contextmanager
+    def _measure(self, step):
+        """Count and time a unit run, nested steps included."""
+        start = time.perf_counter()
+
+        try:
+            yield
+        except Exception:
+            self.metrics.inc('unit_errors_total', unit=step.type)
+            raise
+        finally:
+            self.metrics.inc('unit_calls_total', unit=step.type)
+            self.metrics.observe('unit_seconds', time.perf_counter() - start, unit=step.type)
+
+    def _close_metrics(self):
+        self.metrics.stop_textfile()
+
+        if self.metrics_textfile:
+            self.metrics.write_prometheus(self.metrics_textfile)
+
+        if self.metrics_path:
+            self.metrics.write_json(self.metrics_path)
 
     def _run_steps(self, steps):
-        """Check if the doc has steps to run, then run them."""
+        """Check if the unit has nested steps to run, then run them."""
         if steps:
-            steps = self._sort_steps(steps)
+            self._run_plan(steps)
+
+    def _run_plan(self, steps):
+        for idx, step in enumerate(steps):
+            log.debug('Running step %s, type %s', idx, step.type, extra=STEP_EVENT)
+
+            self._run_units(step)
+
+    def _get_item_pool(self, step):
+        """
+        Worker pool of a loop or entity unit with concurrency, shared per
+        run.
+        """
+        with self.lock:
+            if id(step) not in self.item_pools:
+                self.item_pools[id(step)] = ItemPool(
+                    step.data['concurrency'],
+                    on_error=step.data.get('on_error', FAIL_FAST),
+                    name=step.type,
+                )
+
+        return self.item_pools[id(step)]
+
+    def _close_item_pools(self):
+        pools, self.item_pools = self.item_pools, {}
+
+        for pool in pools.values():
+            pool.shutdown()
+
+            for error in pool.errors:
+                self.events.append({
+                    'type': 'loop_error',
+                    'error': repr(error)
+                })
+
+    def _get_transform_pool(self, step):
+        """
+        Worker processes shaping the products of a WooCommerce unit with
+        `transform_processes` set, shared per run. None when the unit
+        shapes its products in process.
+        """
+        processes = step.data.get('transform_processes')
+
+        if not processes:
+            return None
+
+        with self.lock:
+            if id(step) not in self.transform_pools:
+                self.transform_pools[id(step)] = TransformPool(step.doc, processes)
+
+        return self.transform_pools[id(step)]
+
+    def _shaping_units(self, step):
+        """
+        The WooCommerce post and put units shaping in worker processes, or
+        generating variations, that run first for every entity of an entity
+        unit, in a loop reading the entity. Yields (loop, unit) pairs.
+        """
+        for loop in step.steps:
+            if loop.type != 'loop' or loop.get_data_on != step.store_data_on or not loop.steps:
+                continue
+
+            unit = loop.steps[0]
+
+            if unit.type == 'action_connector_woocommerce' and \
+                    unit.data.get('method', 'get').lower() in ['post', 'put'] and \
+                    (unit.data.get('transform_processes') or unit.data.get('generate_variations')) and \
+                    unit.get_data_on == loop.store_data_on:
+                yield loop, unit
+
+    def _page_listings(self, loop, entities, sequence_key):
+        """The listings `loop` runs over for the entities not done yet."""
+        listings = []
+
+        for entity in entities:
+            if self._is_done(sequence_key, entity.get('id')):
+                continue
 
-            self.run(steps)
+            try:
+                entries = loop.loop_path.first_truthy([entity])
+            except IndexError:
+                continue
+
+            for entry in entries if isinstance(entries, list) else []:
+                try:
+                    listing = loop.path.first_truthy(entry)
+                except IndexError:
+                    continue
+
+                if isinstance(listing, dict):
+                    listings.append(listing)
+
+        return listings
+
+    def _shape_page(self, step, entities, sequence_key):
+        """
+        Get the listings of a page of entities ready for the units found by
+        `_shaping_units` in one go. The variations of the whole page are
+        priced in one pass. Units with a transform pool have the page
+        shaped `transform_chunksize` listings at a time per worker, instead
+        of one round trip to the workers per listing. The units pick their
+        listing up when they run. Entities done before a resume are left
+        out. Returns the units got ready.
+        """
+        units = []
+
+        for loop, unit in self._shaping_units(step):
+            listings = self._page_listings(loop, entities, sequence_key)
+            prices = None
+
+            if unit.data.get('generate_variations'):
+                prices = page_variation_prices(listings, get_converter())
+
+            transform_pool = self._get_transform_pool(unit)
+
+            if transform_pool:
+                results = transform_pool.map(
+                    listings,
+                    prices,
+                    chunksize=unit.data.get('transform_chunksize', DEFAULT_CHUNKSIZE)
+                )
+            else:
+                results = prices
+
+            # The listings are kept with their results, so their ids can't
+            # be reused while the page runs.
+            ahead = {id(listing): (listing, result) for listing, result in zip(listings, results or ())}
+
+            with self.lock:
+                self.shaped_ahead[id(unit)] = ahead
+
+            units.append(unit)
+
+        return units
+
+    def _take_shaped(self, step, data):
+        """
+        The listing and payload shaped ahead for `data`, or its variation
+        prices for a unit shaping in process, if there are any.
+        """
+        with self.lock:
+            found = self.shaped_ahead.get(id(step), {}).pop(id(data), None)
+
+        if found is None or found[0] is not data:
+            return None
+
+        return found[1]
+
+    def _drop_shaped(self, units):
+        with self.lock:
+            for unit in units:
+                self.shaped_ahead.pop(id(unit), None)
+
+    def _close_transform_pools(self):
+        pools, self.transform_pools = self.transform_pools, {}
+
+        for pool in pools.values():
+            pool.shutdown()
+
+    def _run_item(self, step, scope, item, sequence_key=None, index=None):
+        """Run the nested steps of a loop or entity unit for one item."""
+        item_key = None
+
+        if sequence_key is not None:
+            item_key = self._item_key(sequence_key, index)
+
+        self.metrics.inc('items_total', unit=step.type)
+
+        with self._child_scope(scope, item_key):
+            self._put_data(item, step.store_data_on)
+            self._run_steps(step.steps)
+
+        if sequence_key is not None:
+            self._item_done(sequence_key, index)
 
     def _dict_put(self, keys, item):
-        keys = keys.split(".")
-        lastplace = reduce(operator.getitem, keys[:-1], self.data)
-        lastplace[keys[-1]] = item
+        if isinstance(keys, str):
+            keys = keys.split(".")
+
+        self.data.put(keys, item)
 
     def _dict_get(self, keys):
-        try:
+        if not keys:
+            return None
+
+        if isinstance(keys, str):
             keys = keys.split(".")
-            return reduce(operator.getitem, keys, self.data)
-        except AttributeError as err:
-            pass
+
+        return self.data.get(keys)
 
     def _get_data(self, get_data_on):
         return self._dict_get(get_data_on)
@@ -187,26 +803,14 @@ class WorkflowHandler(object):
 
     def process_etsy_request(self, conn_etsy, **kwargs):
         """Process Etsy request."""
-        doc = kwargs.get('doc')
-        doc_data = doc['data']
-        url = kwargs.get('url')
+        step = kwargs.get('step')
+        url = self._etsy_url(step, kwargs.get('url'))
         steps = kwargs.get('steps')
         method = kwargs.get('method')
-        params = doc_data.get('params', None)
-        vars_mapped = {}
-        data = self._get_data(doc_data.get('get_data_on'))
-
-        if doc_data.get('vars'):
-            var_list = doc_data.get('vars').items()
-
-            for k, v in var_list:
-                jsonpath_expr = parse(v)
-                vars_mapped[k] = [match.value for match in jsonpath_expr.find(data)][0]
-
-            for k, v in vars_mapped.items():
-                url = url.replace("$%s" % k, str(v))
 
         if method == 'get':
+            params, incremental, watermark = self._etsy_paging(step, url)
+
             if params:
                 listings_generator = conn_etsy.iterate_pages(
                     'execute_authed',
@@ -220,44 +824,179 @@ class WorkflowHandler(object):
                 )
 
             for result in listings_generator:
-                # In special cases save specific payloads into data, and
-                # everything else are the results.
-                try:
-                    if result['type'] == 'ListingInventory':
-                        self._put_data(result, doc_data.get('store_data_on'))
+                result, last_page = self._etsy_page(step, url, result, incremental, watermark)
 
-                    if result['type'] == 'Listing':
-                        self._put_data(result['results'], doc_data.get('store_data_on'))
-                except KeyError as err:
-                    self._put_data(result['results'], doc_data.get('store_data_on'))
+                with self._child_scope():
+                    self._put_etsy_page(step, result)
+                    self._run_steps(steps)
 
-                self._run_steps(steps)
+                if last_page:
+                    break
 
         if method == 'post':
-            mapper = doc_data.get('export_mapper')
-            _map = mapper['map']
+            for payload in self._etsy_listings(step):
+                conn_etsy.create_listings(payload=payload)
 
-            if isinstance(self.data, list):
-                mapped_list = [form_doc(i, _map) for i in self.data]
+    def _etsy_url(self, step, url):
+        if step.vars:
+            vars_mapped = self._map_variables(step.vars, self._get_data(step.get_data_on))
 
-                self.data = mapped_list
-            else:
-                self.data = form_doc(self.data, _map)
+            for k, v in vars_mapped.items():
+                url = url.replace("$%s" % k, str(v))
+
+        return url
+
+    def _etsy_paging(self, step, url):
+        """
+        The params an Etsy get unit pages with, its `incremental` config
+        and the watermark of `url`.
+        """
+        doc_data = step.data
+        params = doc_data.get('params', None)
+        incremental = doc_data.get('incremental')
+        watermark = None
+
+        if incremental:
+            watermark = self._get_watermark(url)
+
+            # Listings ordered by their modification time, newest first,
+            # so that paging can stop at the watermark.
+            if incremental.get('sort_on'):
+                params = dict(
+                    params or {},
+                    sort_on=incremental['sort_on'],
+                    sort_order=incremental.get('sort_order', 'down')
+                )
+
+        return params, incremental, watermark
+
+    def _etsy_page(self, step, url, result, incremental, watermark):
+        """
+        The listings of a page to run the nested steps for, and whether
+        paging is done after it.
+        """
+        reached_watermark = False
+
+        if incremental:
+            result, reached_watermark = self._modified_listings(
+                result,
+                url,
+                incremental.get('field', DEFAULT_WATERMARK_FIELD),
+                watermark
+            )
+
+        if isinstance(result.get('results'), list):
+            self.metrics.inc('items_total', len(result['results']), unit=step.type)
+
+        if reached_watermark and incremental.get('sort_on'):
+            log.info('Reached listings not modified since %s, done paging.', watermark)
+
+            return result, True
+
+        return result, False
+
+    def _put_etsy_page(self, step, result):
+        # In special cases save specific payloads into data, and
+        # everything else are the results.
+        try:
+            if result['type'] == 'ListingInventory':
+                self._put_data(result, step.store_data_on)
+
+            if result['type'] == 'Listing':
+                self._put_data(result['results'], step.store_data_on)
+        except KeyError as err:
+            self._put_data(result['results'], step.store_data_on)
+
+    def _etsy_listings(self, step):
+        """Payloads of the listings an Etsy post unit creates."""
+        mapper = step.data.get('export_mapper')
+        _map = mapper['map']
+
+        # Without get_data_on the whole data set is the listing.
+        if step.get_data_on:
+            data = self._get_data(step.get_data_on)
+        else:
+            data = self.data.as_dict()
+
+        if isinstance(data, list):
+            return form_docs(data, _map)
+
+        return [form_doc(data, _map)]
+
+    def _get_watermark(self, key):
+        """
+        Modification time up to which the listings of `key`, a shop listings
+        url, have been imported, or None to import everything.
+        """
+        if self.state is None:
+            self._warn_once('incremental needs a state_path to keep watermarks in, importing every listing.')
+
+            return None
+
+        return self.state.get(WATERMARK_NAMESPACE, key)
 
-            if isinstance(self.data, list):
-                for item in self.data:
-                    conn_etsy.create_listings(payload=item)
+    def _modified_listings(self, result, key, field, watermark):
+        """
+        Keep the listings of a result page modified at or after the
+        watermark, the ones modified in the same second are imported again
+        rather than missed. Returns the page and whether it had older
+        listings.
+        """
+        listings = result.get('results')
+
+        if not isinstance(listings, list):
+            return result, False
+
+        modified = []
+        reached = False
+        newest = watermark
+
+        for listing in listings:
+            modified_at = listing.get(field)
+
+            if modified_at is None or watermark is None or modified_at >= watermark:
+                modified.append(listing)
             else:
-                conn_etsy.create_listings(payload=self.data)
+                reached = True
+
+            if modified_at is not None and (newest is None or modified_at > newest):
+                newest = modified_at
+
+        if newest is not None:
+            with self.lock:
+                self.watermarks[key] = max(newest, self.watermarks.get(key, newest))
+
+        return dict(result, results=modified), reached
+
+    def _close_watermarks(self, completed):
+        """
+        Move the watermarks once a run imported everything, otherwise the
+        next run starts from the old ones.
+        """
+        watermarks, self.watermarks = self.watermarks, {}
+
+        if self.state is None or not watermarks:
+            return
+
+        # Every entity submitted has to be accounted for and saved.
+        unsaved = any(
+            event['failed'] or event['saved'] != event['submitted']
+            for event in self.events if event['type'] == 'entity_save'
+        )
+
+        if not completed or unsaved:
+            log.warning('Run not complete, keeping the listing watermarks.')
+
+            return
+
+        self.state.put_many(WATERMARK_NAMESPACE, watermarks)
 
     def _map_variables(self, var_list, data):
-        """Map values to variables in the car_list."""
+        """Map values to variables in the compiled var_list."""
         vars_mapped = {}
 
-        for k, v in var_list:
-            jsonpath_expr = parse(v)
-            found_data = jsonpath_expr.find(data)
-            vars_mapped[k] = [match.value for match in found_data][0]
+        for k, path in var_list:
+            vars_mapped[k] = path.first(data)
         
         return vars_mapped
 
@@ -266,112 +1005,91 @@ class WorkflowHandler(object):
 
         return response
 
-    def _unit_action_connector_wordpress(self, doc):
-        doc_data = doc['data']
-        method = doc_data.get('method', 'get').lower()
-        wp_url = doc_data.get('wp_url')
-        wp_user = doc_data.get('wp_user')
-        wp_pass = doc_data.get('wp_pass')
-        consumer_key = doc_data.get('consumer_key')
-        consumer_secret = doc_data.get('consumer_secret')
-        expected_codes = doc_data.get('expects_response_code')
-        endpoint = doc_data.get('endpoint')
-        get_data_on = doc_data.get('get_data_on')
-        steps = doc_data.get('steps')
-        data = self._get_data(get_data_on)
-        response = {}
+    def _get_wordpress(self, step):
+        doc_data = step.data
         wpapi = API(
-            url=wp_url,
+            url=doc_data.get('wp_url'),
             api="wp-json",
             version='wp/v2',
-            wp_user=wp_user,
-            wp_pass=wp_pass,
-            consumer_key=consumer_key,
-            consumer_secret=consumer_secret,
+            wp_user=doc_data.get('wp_user'),
+            wp_pass=doc_data.get('wp_pass'),
+            consumer_key=doc_data.get('consumer_key'),
+            consumer_secret=doc_data.get('consumer_secret'),
             basic_auth=True,
             user_auth=True,
+            client=self.http_client,
         )
+        wpapi.requester.session.hooks['response'].append(
+            self.metrics.response_hook('wordpress'))
+
+        return wpapi
 
-        if doc_data.get('vars'):
-            var_list = doc_data.get('vars').items()
-            vars_mapped = self._map_variables(var_list, data)
+    def _wordpress_endpoint(self, step):
+        endpoint = step.data.get('endpoint')
+
+        if step.vars:
+            vars_mapped = self._map_variables(step.vars, self._get_data(step.get_data_on))
 
             for k, v in vars_mapped.items():
                 endpoint = endpoint.replace("$%s" % k, str(v))
 
+        return endpoint
+
+    def _unit_action_connector_wordpress(self, step):
+        method = step.data.get('method', 'get').lower()
+        wpapi = self._get_wordpress(step)
+        endpoint = self._wordpress_endpoint(step)
+
         if method == 'delete':
             try:
-                response = wpapi.delete(endpoint)
+                wpapi.delete(endpoint)
             except UserWarning as err:
                 pass
 
-        if steps:
-            self._run_steps(steps)
+        self._run_steps(step.steps)
 
-    def _unit_action_connector_woocommerce(self, doc, offset=None):
-        doc_data = doc['data']
-        url = doc_data.get('url')
-        method = doc_data.get('method', 'get').lower()
-        consumer_key = doc_data.get('consumer_key')
-        consumer_secret = doc_data.get('consumer_secret')
-        expected_codes = doc_data.get('expects_response_code')
-        endpoint = doc_data.get('endpoint')
-        get_data_on = doc_data.get('get_data_on')
-        steps = doc_data.get('steps')
-        generate_attributes = doc_data.get('generate_attributes', False)
-        generate_variations = doc_data.get('generate_variations', False)
-        image_size = doc_data.get('image_size', 'url_fullxfull')
-        do_hacky_shit = doc_data.get('do_hacky_shit', False)
-        tmp_data = False
-        data = self._get_data(get_data_on)
-        response = {}
-        woocomm = WooComm(
-            doc,
-            url=url,
-            consumer_key=consumer_key,
-            consumer_secret=consumer_secret,
+    def _get_woocomm(self, step):
+        doc_data = step.data
+
+        return WooComm(
+            step.doc,
+            url=doc_data.get('url'),
+            consumer_key=doc_data.get('consumer_key'),
+            consumer_secret=doc_data.get('consumer_secret'),
+            metrics=self.metrics,
+            client=self.http_client,
         )
 
-        if method in ['post', 'put']:
-            custom = doc_data.get('custom')
-            formatted_object = data
-
-            # By default all products are simple products.
-            # And attributes is a list.
-            formatted_object['type'] = 'simple'
-            formatted_object['attributes'] = []
-
-            if custom:
-                formatted_object = woocomm._generate_custom_structure(
-                    formatted_object,
-                    image_size=image_size
-                )
+    def _shape_product(self, step, woocomm, data):
+        """
+        Shape the listing `data` into the payload of a WooCommerce post or
+        put unit, in process or on the unit's transform pool.
+        """
+        transform_pool = self._get_transform_pool(step)
 
-            if generate_attributes:
-                formatted_object = woocomm._generate_attributes(formatted_object)
+        if not transform_pool:
+            return transform_product(woocomm, step.data, data, self._take_shaped(step, data))
 
-            if generate_variations:
-                formatted_object = woocomm._generate_variations(formatted_object)
+        shaped, tmp_data = self._take_shaped(step, data) or transform_pool.transform(data)
+        self._update_listing(data, shaped)
 
-            if doc_data.get('export_mapper'):
-                mapper = doc_data.get('export_mapper')
-                _map = mapper['map']
-                cconverter = CurrencyConverter()
-                amount = formatted_object['price']
-                currency_code = formatted_object['currency_code']
-                amount_in_usd = cconverter.convert(amount, currency_code, 'USD')
-                D = decimal.Decimal
-                cent = D('0.01')
-                x = D(amount_in_usd)
-                formatted_object['price'] = str(x.quantize(cent,rounding=decimal.ROUND_UP))
-                _map_copy = copy.copy(_map)
-                mapped_obj = form_doc(formatted_object, _map_copy)
+        return tmp_data
 
-                if 'ignored_parts' in mapped_obj:
-                    ignored_parts = mapped_obj.pop('ignored_parts')
-                    mapped_obj = {**mapped_obj, **ignored_parts}
+    def _update_listing(self, data, shaped):
+        # Keep the listing updated in place, as the nested steps and the
+        # variables expect.
+        data.clear()
+        data.update(shaped)
 
-                tmp_data = mapped_obj
+    def _woocomm_request(self, step, data, tmp_data):
+        """
+        The endpoint and payload of a WooCommerce unit request, once the
+        listing `data` is shaped into `tmp_data`.
+        """
+        doc_data = step.data
+        method = doc_data.get('method', 'get').lower()
+        endpoint = doc_data.get('endpoint')
+        do_hacky_shit = doc_data.get('do_hacky_shit', False)
 
         # Hack!
         if do_hacky_shit:
@@ -387,9 +1105,8 @@ class WorkflowHandler(object):
 
         # Because this happens here after the data gets mapped propely above,
         # the pagination of entities has to be one at a time.
-        if doc_data.get('vars'):
-            var_list = doc_data.get('vars').items()
-            vars_mapped = self._map_variables(var_list, data)
+        if step.vars:
+            vars_mapped = self._map_variables(step.vars, data)
 
             for k, v in vars_mapped.items():
                 endpoint = endpoint.replace("$%s" % k, str(v))
@@ -406,13 +1123,29 @@ class WorkflowHandler(object):
             except KeyError as err:
                 pass
 
+        return endpoint, tmp_data
+
+    def _unit_action_connector_woocommerce(self, step):
+        doc_data = step.data
+        method = doc_data.get('method', 'get').lower()
+        steps = step.steps
+        tmp_data = False
+        data = self._get_data(step.get_data_on)
+        response = {}
+        woocomm = self._get_woocomm(step)
+
+        if method in ['post', 'put']:
+            tmp_data = self._shape_product(step, woocomm, data)
+
+        endpoint, tmp_data = self._woocomm_request(step, data, tmp_data)
+
         # Making a POST only if woocomm_listing_id is not set.
         if method == 'post':
             try:
                 if not tmp_data['woocomm_listing_id']:
                     raise KeyError()
             except KeyError as err:
-                print("{} KeyError, woocomm_listing_id is not set for a create request, proceeding...".format(str(err)))
+                log.debug('%s KeyError, woocomm_listing_id is not set for a create request, proceeding...', err)
                 response = woocomm.http_post(endpoint, tmp_data)
 
         if method == 'put':
@@ -420,9 +1153,9 @@ class WorkflowHandler(object):
                 if not tmp_data['id']:
                     raise KeyError()
                 
-                response = woocomm.http_put(endpoint, tmp_data)
+                response = self._woocomm_put(step, woocomm, endpoint, tmp_data)
             except KeyError as err:
-                print("{} KeyError, woocommerce listing 'id' is not set for an update request, ignoring...".format(str(err)))
+                log.warning("%s KeyError, woocommerce listing 'id' is not set for an update request, ignoring...", err)
 
         if method == 'get':
             paginated = doc_data.get('paginated', None)
@@ -436,7 +1169,7 @@ class WorkflowHandler(object):
                     response = self._make_paginated_woocomm_request(woocomm, endpoint, 0, per_page)
 
                     if response:
-                        self._put_data(response, doc_data['store_data_on'])
+                        self._put_data(response, step.store_data_on)
 
                         if steps:
                             self._run_steps(steps)
@@ -453,99 +1186,147 @@ class WorkflowHandler(object):
             response = woocomm.http_options(endpoint)
 
         self.http_response_data = response
-        self._put_data(response, doc_data['store_data_on'])
+        self._put_data(response, step.store_data_on)
 
         if steps:
             self._run_steps(steps)
 
-    def _unit_connector_etsy(self, doc):
-        doc_data = doc['data']
-        consumer_key = doc_data.get('consumer_key')
-        consumer_secret = doc_data.get('consumer_secret')
-        oauth_token = doc_data.get('oauth_token')
-        oauth_token_secret = doc_data.get('oauth_token_secret')
-        paginated = doc_data.get('paginated')
-        endpoint = doc_data.get('endpoint')
-        steps = doc_data.get('steps')
-        method = doc_data.get('method', 'get').lower()
-        export_mapper = doc_data.get('export_mapper')
-        url = doc_data.get('url')
-        conn_etsy = main.Etsy(
-            consumer_key,
-            consumer_secret,
-            oauth_token=oauth_token,
-            oauth_token_secret=oauth_token_secret
+    def _get_etsy(self, step):
+        doc_data = step.data
+
+        return main.Etsy(
+            doc_data.get('consumer_key'),
+            doc_data.get('consumer_secret'),
+            oauth_token=doc_data.get('oauth_token'),
+            oauth_token_secret=doc_data.get('oauth_token_secret'),
+            metrics=self.metrics,
+            url_base=self.etsy_url,
+            client=self.http_client
         )
 
+    def _unit_connector_etsy(self, step):
+        doc_data = step.data
+
         self.process_etsy_request(
-            conn_etsy,
-            paginated=paginated,
-            endpoint=endpoint,
-            steps=steps,
-            method=method,
-            url=url,
-            export_mapper=export_mapper,
-            doc=doc
+            self._get_etsy(step),
+            paginated=doc_data.get('paginated'),
+            endpoint=doc_data.get('endpoint'),
+            steps=step.steps,
+            method=doc_data.get('method', 'get').lower(),
+            url=doc_data.get('url'),
+            export_mapper=doc_data.get('export_mapper'),
+            step=step
         )
 
-    def _unit_entity(self, doc):
+    def _unit_entity(self, step):
         """
         Operate on the entity objects.
 
         The classifiers and catalogs on creation are merged.
         """
-        doc_data = doc['data']
+        doc_data = step.data
 
         if doc_data['operation'] == 'read':
             try:
                 if doc_data['entity_id']:
-                    self._handle_single_entity_fetch(doc)
+                    self._handle_single_entity_fetch(step)
             except KeyError as err:
-                self._handle_entity_fetch(doc)
+                self._handle_entity_fetch(step)
 
         if doc_data['operation'] == 'create':
-            data = self._get_data(doc_data.get('get_data_on'))
+            self._save_entities(step)
 
-            if data and isinstance(data, list):
-                for data_item in data:
-                    self._handle_entity_save(doc, data_item)
+    def _save_entities(self, step):
+        data = self._get_data(step.get_data_on)
 
-            if data and isinstance(data, dict):
-                self._handle_entity_save(doc, data)
+        if data and isinstance(data, list):
+            for data_item in data:
+                self._handle_entity_save(step, data_item)
 
-    def _unit_loop(self, doc):
-        doc_data = doc['data']
+        if data and isinstance(data, dict):
+            self._handle_entity_save(step, data)
+
+    def _loop_items(self, step):
+        """
+        Items of a loop unit, resolved through its loop_path and path, with
+        the entry of the loop_path list each item was read from.
+        """
+        doc_data = step.data
         loop_path = doc_data.get('loop_path', '$')
-        loop_path_jsonpath_expr = parse(loop_path)
         path = doc_data.get('path', '$')
-        steps = doc_data.get('steps', False)
-        jsonpath_expr = parse(path)
-        data = self._get_data(doc_data['get_data_on'])
+        data = self._get_data(step.get_data_on)
         loop_data = data
 
         try:
-            loop_data = [match.value for match in loop_path_jsonpath_expr.find(loop_data) if match.value][0]
+            loop_data = step.loop_path.first_truthy(loop_data)
         except IndexError as err:
-            print('path {} not found in the data set'.format(loop_path))
+            log.warning('path %s not found in the data set', loop_path)
             pass
 
         if loop_data and isinstance(loop_data, list):
             for data_item in loop_data:
                 try:
-                    temp_data = [match.value for match in jsonpath_expr.find(data_item) if match.value][0]
+                    temp_data = step.path.first_truthy(data_item)
                 except IndexError as err:
-                    print('path {} not found in the data set'.format(path))
+                    log.error('path %s not found in the data set', path)
                     sys.exit(1)
 
                 if temp_data:
-                    self._put_data(temp_data, doc_data['store_data_on'])
-                    self._run_steps(steps)
+                    yield data_item, temp_data
         else:
             # exit?
             pass
 
-    def _unit_stop(self, doc):
-        doc_data = doc['data']
+    def _loop_item_key(self, entry, item, index):
+        """
+        Checkpoint key of a loop item: the id of the entry it was read from,
+        or of the item itself, so a resumed run finds the items it already
+        did even when the list has changed in between. Items without an id
+        are keyed by their position.
+        """
+        for source in (entry, item):
+            if isinstance(source, dict):
+                item_id = source.get('id')
+
+                if isinstance(item_id, (int, str)) and not isinstance(item_id, bool):
+                    return 'id:{}'.format(item_id)
+
+        return index
+
+    def _unit_loop(self, step):
+        """
+        Run the nested steps for every item. With concurrency the items
+        run on the loop's pool, the loop is done once all of its items are:
+        the steps after it, and the units around it, may depend on what
+        the items did.
+        """
+        pool = None
+        batch = None
+
+        if step.data.get('concurrency', 1) > 1:
+            pool = self._get_item_pool(step)
+            batch = pool.batch()
+
+        sequence_key = self._sequence_key(step)
+
+        for index, (entry, item) in enumerate(self._loop_items(step)):
+            index = self._loop_item_key(entry, item, index)
+
+            if self._is_done(sequence_key, index):
+                continue
+
+            if pool:
+                # The item only reads from the current scope, its own
+                # writes go to a child scope of its own.
+                pool.submit(self._run_item, step, self.data, item, sequence_key, index, batch=batch)
+            else:
+                self._run_item(step, None, item, sequence_key, index)
+
+        if pool:
+            pool.wait(batch)
+
+    def _unit_stop(self, step):
+        doc_data = step.data
 
         self.return_response_body = doc_data.get('return_response_body', True)
 
@@ -556,9 +1337,22 @@ class WorkflowHandler(object):
         if passed_steps:
             run_steps = passed_steps
 
-        for idx, unit_item in enumerate(run_steps):
-            print("============")
-            print("============> Running STEP {}, TYPE {}...".format(idx, unit_item['type']))
-            print("============")
+        completed = False
+        save_error = None
 
-            self._run_units(unit_item)
+        try:
+            self._run_plan(run_steps)
+            completed = True
+        finally:
+            self._close_item_pools()
+            self._close_transform_pools()
+            save_error = self._close_entity_writers()
+            completed = completed and save_error is None
+            self._close_checkpoint(completed)
+            self._close_put_counts()
+            self._close_watermarks(completed)
+            self._close_state()
+            self._close_metrics()
+
+        if save_error is not None:
+            raise save_error
@@ -0,0 +1,105 @@
+import itertools
+import logging
+import logging.handlers
+import queue
+import re
+import sys
+
+
+DEFAULT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# Query string parameters carrying credentials, their values never make it
+# into the logs.
+SECRET_PARAMS = (
+    'api_key',
+    'consumer_key',
+    'consumer_secret',
+    'oauth_consumer_key',
+    'oauth_nonce',
+    'oauth_signature',
+    'oauth_token',
+    'oauth_token_secret',
+)
+SECRET_PARAM_VALUE = re.compile(
+    r'(?<![\w])((?:{})=)[^&\s\'"]*'.format('|'.join(SECRET_PARAMS)))
+
+
+def redact(text):
+    """Replace the values of credential query parameters in `text`."""
+    return SECRET_PARAM_VALUE.sub(r'\1REDACTED', text)
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates):
+        """
+        Let only one in every `rates[event]` records of an event through.
+        Records are tagged with an event through `extra={'event': ...}`,
+        records of other events always pass.
+        """
+        super(SamplingFilter, self).__init__()
+        self.rates = rates
+        self.counters = {event: itertools.count() for event in rates}
+
+    def filter(self, record):
+        event = getattr(record, 'event', None)
+        counter = self.counters.get(event)
+
+        if counter is None:
+            return True
+
+        return next(counter) % self.rates[event] == 0
+
+
+class RedactingFilter(logging.Filter):
+    """Remove credentials from the message of every record that is emitted."""
+
+    def filter(self, record):
+        message = record.getMessage()
+        redacted = redact(message)
+
+        if redacted != message:
+            record.msg = redacted
+            record.args = None
+
+        return True
+
+
+def parse_sample_rates(value):
+    """Sample rates from "event=rate,..." as given on the command line."""
+    rates = {}
+
+    for item in filter(None, (value or '').split(',')):
+        event, rate = item.split('=')
+        rates[event.strip()] = max(1, int(rate))
+
+    return rates
+
+
+def setup_logging(level=logging.INFO, sample_rates=None, stream=None, fmt=DEFAULT_FORMAT):
+    """
+    Route the workflow logs through a queue to a stream handler running on
+    its own thread, so logging never blocks the workers on a slow terminal
+    or pipe. Records below `level` are dropped by the logger before any
+    formatting happens. Returns the queue listener, stop it once the run
+    is done to flush what is left.
+    """
+    records = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(stream or sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(fmt))
+
+    queue_handler = logging.handlers.QueueHandler(records)
+
+    # Sampled out records are dropped before anything is formatted.
+    if sample_rates:
+        queue_handler.addFilter(SamplingFilter(sample_rates))
+
+    queue_handler.addFilter(RedactingFilter())
+
+    logger = logging.getLogger('workflow')
+    logger.setLevel(level)
+    logger.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(records, stream_handler)
+    listener.start()
+
+    return listener
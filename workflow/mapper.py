@@ -1,5 +1,7 @@
+import copy
 import json
 from functools import reduce
+from itertools import islice
 
 
 def list_of_objects(data, old_key_path_list, new_key):
@@ -52,6 +54,45 @@ def as_list(payload):
     return payload if isinstance(payload, list) else [payload]
 
 
+def chunked(iterable, size):
+    """ 
+    Yields lists of `size` items of iterable, the last one may be shorter.
+    """
+    iterator = iter(iterable)
+
+    while True:
+        chunk = list(islice(iterator, size))
+
+        if not chunk:
+            return
+
+        yield chunk
+
+
+def iter_docs(docs):
+    """ 
+    Yields source documents of an iterable of dicts, or of NDJSON lines
+    such as an open file, skipping blank lines.
+    """
+    for doc in docs:
+        if isinstance(doc, (str, bytes)):
+            if not doc.strip():
+                continue
+
+            doc = json.loads(doc)
+
+        yield doc
+
+
+def form_docs(form_doc_dict, docs, chunk_size=None):
+    mapped = (form_doc_dict(doc) for doc in iter_docs(docs))
+
+    if chunk_size:
+        return chunked(mapped, chunk_size)
+
+    return mapped
+
+
 class DataMapper:
     """
     Class for mapping JSON strings from one format to another.
@@ -103,6 +144,17 @@ class DataMapper:
         """
         return self.form_doc_dict(json.loads(from_json_str))
         
+    def form_docs(self, docs, chunk_size=None):
+        """
+        :in docs iterable of documents (as dictionaries), or of NDJSON lines
+            such as an open file.
+        :in chunk_size when given, mapped documents are handed out in lists
+            of chunk_size, e.g. for bulk saves.
+        :out generator of the mapped documents, mapped as they are taken, so
+        any number of documents is mapped in constant memory.
+        """
+        return form_docs(self.form_doc_dict, docs, chunk_size)
+
     def form_doc_dict(self, from_dict):
         """
         :in from_dict document (as dictionary) which should be mapped according
@@ -154,3 +206,222 @@ class DataMapper:
                     new_doc[last] = payload
 
         return data
+
+
+# Kinds of target a rule part writes to, see DataMapper for the syntax.
+LIST_OF_OBJECTS = 0
+OBJECT = 1
+LIST = 2
+INT = 3
+STR = 4
+VALUE = 5
+
+# Compiled mappers by mapping, see compile_mapping.
+MAPPER_CACHE_SIZE = 256
+_mappers = {}
+
+
+def _compile_part(part, payload_path):
+    """
+    Compile one target of a rule into (kind, prefix, name, extra), checked
+    in the same order DataMapper.form_doc_dict checks them.
+    """
+    new_path = part.split(':')
+    prefix = new_path[:-1]
+    last = new_path[-1]
+
+    if last.endswith('[{}]'):
+        return (LIST_OF_OBJECTS, prefix, last[:-4], None)
+
+    if last.startswith('{}'):
+        key = payload_path[-1] if len(last) == 2 else last[3:]
+
+        return (OBJECT, prefix, payload_path[-1], key)
+
+    if last.endswith('[]'):
+        return (LIST, prefix, last[:-2], None)
+
+    if last.endswith('<int>'):
+        return (INT, prefix, last[:-5], None)
+
+    if last.endswith('<str>'):
+        return (STR, prefix, last[:-5], None)
+
+    return (VALUE, prefix, last, None)
+
+
+def _root_keys(kind, prefix, name):
+    """Top level keys of the mapped document a compiled part writes to."""
+    if prefix:
+        return {prefix[0]}
+
+    if kind == LIST_OF_OBJECTS:
+        return set()
+
+    return {name}
+
+
+def _linear_lists(rules):
+    """
+    Top level lists built by [{}] rules that can be filled through a cursor.
+
+    DataMapper fills the first object of the list missing the source key,
+    scanning the list for every item. When only single key [{}] rules write
+    to a list, the objects holding a key are always the first ones, so a
+    count per key finds the same object without a scan.
+    """
+    candidates = {}
+    touched = {'ignored_parts'}
+
+    for payload_path, parts in rules:
+        for kind, prefix, name, _ in parts:
+            touched |= _root_keys(kind, prefix, name)
+
+            if kind == LIST_OF_OBJECTS:
+                single = candidates.get(name, True)
+                candidates[name] = single and len(payload_path) == 1
+
+    return {name for name, single in candidates.items() if single and name not in touched}
+
+
+class CompiledMapper(object):
+    def __init__(self, mapping_json_str):
+        """
+        DataMapper with its rules split and classified once, when compiled,
+        instead of for every document. Mapped documents are the same as the
+        ones DataMapper forms, and the mapping is left as it is.
+
+        Get one through `compile_mapping`, which keeps a mapper per mapping.
+        """
+        if isinstance(mapping_json_str, str):
+            mapping_dict = json.loads(mapping_json_str)
+        else:
+            mapping_dict = dict(mapping_json_str)
+
+        self.ignored_parts = mapping_dict.pop('ignored_parts', {})
+
+        if not all(isinstance(v, str) for v in mapping_dict.values()):
+            raise Exception("Input dictionary values should be strings.")
+
+        self.rules = []
+
+        for k, v in mapping_dict.items():
+            payload_path = k.split(':')
+            parts = [_compile_part(part, payload_path) for part in v.split('&')]
+            self.rules.append((payload_path, parts))
+
+        self.linear_lists = _linear_lists(self.rules)
+        # Rules writing inside ignored_parts get a copy of it, the mapping
+        # is never changed.
+        self.copy_ignored_parts = any(
+            prefix[:1] == ['ignored_parts']
+            for _, parts in self.rules for _, prefix, _, _ in parts
+        )
+
+    def form_doc(self, from_json_str):
+        return self.form_doc_dict(json.loads(from_json_str))
+
+    def form_docs(self, docs, chunk_size=None):
+        return form_docs(self.form_doc_dict, docs, chunk_size)
+
+    def form_doc_dict(self, from_dict):
+        ignored_parts = self.ignored_parts
+
+        if self.copy_ignored_parts:
+            ignored_parts = copy.deepcopy(ignored_parts)
+
+        data = {
+            "ignored_parts": ignored_parts
+        }
+        # Objects of every linear [{}] list holding a source key, by list
+        # and key.
+        filled = {}
+
+        for payload_path, parts in self.rules:
+            payload = from_dict
+
+            for key in payload_path:
+                payload = payload.get(key, "") if isinstance(payload, dict) else ""
+
+            if isinstance(payload, str):
+                payload = payload.strip()
+
+            for kind, prefix, name, extra in parts:
+                new_doc = set_nested(data, prefix)
+
+                if kind == VALUE:
+                    new_doc[name] = payload
+                elif kind == LIST_OF_OBJECTS:
+                    if name in self.linear_lists:
+                        self._fill_linear(data, filled, name, payload_path[0], payload)
+                    else:
+                        for item in as_list(payload):
+                            new_doc = list_of_objects(data, payload_path, name)
+                            new_doc[payload_path[0]] = item
+                elif kind == OBJECT:
+                    new_doc = set_nested(data, prefix[:-1])
+                    new_doc[name] = {extra: payload}
+                elif kind == LIST:
+                    existing_list = new_doc.get(name)
+
+                    if existing_list is None:
+                        existing_list = new_doc[name] = []
+
+                    existing_list.extend(as_list(payload))
+                elif kind == INT:
+                    new_doc[name] = int(payload)
+                else:
+                    new_doc[name] = str(payload)
+
+        return data
+
+    def _fill_linear(self, data, filled, name, key, payload):
+        items = as_list(payload)
+
+        if not items:
+            return
+
+        existing_list = data.get(name)
+
+        if existing_list is None:
+            existing_list = data[name] = []
+
+        count = filled.get((name, key), 0)
+
+        for item in items:
+            if count == len(existing_list):
+                existing_list.append({})
+
+            existing_list[count][key] = item
+            count += 1
+
+        filled[(name, key)] = count
+
+
+def compile_mapping(mapping_json_str):
+    """
+    Compiled mapper of a mapping, compiled once per mapping. Mappings given
+    as JSON strings are cached by the string, mappings given as dicts by
+    identity: they're part of the workflow config, which isn't changed
+    while a workflow runs.
+    """
+    if isinstance(mapping_json_str, str):
+        key = mapping_json_str
+    else:
+        key = id(mapping_json_str)
+
+    cached = _mappers.get(key)
+
+    if cached is not None:
+        return cached[1]
+
+    compiled = CompiledMapper(mapping_json_str)
+
+    if len(_mappers) >= MAPPER_CACHE_SIZE:
+        _mappers.clear()
+
+    # The mapping itself is held on to, so its id can't be reused while
+    # it's cached.
+    _mappers[key] = (mapping_json_str, compiled)
+
+    return compiled
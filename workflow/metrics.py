@@ -0,0 +1,233 @@
+import bisect
+import json
+import os
+import re
+import threading
+import time
+
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PROMETHEUS_PREFIX = 'workflow_'
+DEFAULT_TEXTFILE_INTERVAL = 15.0
+
+# Path segments that are ids, e.g. products/5001 or media/12, are folded so
+# every product shares one endpoint series.
+ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+def endpoint_label(path):
+    """Endpoint of a request path, without query string and ids."""
+    return ID_SEGMENT.sub('/{id}', path.split('?', 1)[0])
+
+
+class Histogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """(upper bound, observations at or below it) pairs, ending with +Inf."""
+        total = 0
+        pairs = []
+
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+
+        return pairs
+
+
+class Metrics(object):
+    def __init__(self):
+        """
+        Counters and latency histograms of a workflow run: calls, errors,
+        timings and items per unit type, and requests, errors, retries,
+        timings and bytes per connector endpoint.
+
+        Series are keyed by their name and labels. Recording one is a dict
+        lookup and an addition under a lock, cheap enough to always be on.
+        The collected metrics can be dumped as JSON, and written as a
+        Prometheus textfile while the run goes on.
+        """
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self.textfile_stop = None
+        self.textfile_thread = None
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(labels.items()))
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(labels.items()))
+
+        with self.lock:
+            histogram = self.histograms.get(key)
+
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+
+            histogram.observe(value)
+
+    def response_hook(self, connector):
+        """
+        A `requests` response hook recording every response of a connector.
+        """
+        def hook(response, *args, **kwargs):
+            self.observe_response(connector, response)
+
+        return hook
+
+    def observe_response(self, connector, response):
+        """
+        Record a `requests` response, or a read one of the async client.
+        """
+        request = response.request
+
+        if hasattr(request, 'path_url'):
+            path_url = request.path_url
+            body = request.body or b''
+        else:
+            path_url = request.url.raw_path.decode('ascii')
+            body = request.content
+
+        labels = {
+            'connector': connector,
+            'method': request.method,
+            'endpoint': endpoint_label(path_url),
+        }
+        retries = getattr(getattr(getattr(response, 'raw', None), 'retries', None), 'history', None)
+
+        self.inc('http_requests_total', **labels)
+        self.observe('http_seconds', response.elapsed.total_seconds(), **labels)
+        self.inc('http_bytes_sent_total', len(body), connector=connector)
+        self.inc('http_bytes_received_total', len(response.content), connector=connector)
+
+        if response.status_code >= 400:
+            self.inc('http_errors_total', **labels)
+
+        if retries:
+            self.inc('http_retries_total', len(retries), **labels)
+
+    def as_dict(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {
+                key: (histogram.count, histogram.sum, histogram.cumulative())
+                for key, histogram in self.histograms.items()
+            }
+
+        seconds = time.time() - self.started
+        data = {
+            'started': self.started,
+            'seconds': round(seconds, 3),
+            'counters': {},
+            'histograms': {},
+            'items_per_second': {},
+        }
+
+        for (name, labels), value in sorted(counters.items()):
+            data['counters'].setdefault(name, []).append({
+                'labels': dict(labels),
+                'value': value
+            })
+
+            if name == 'items_total' and seconds:
+                data['items_per_second'][dict(labels)['unit']] = round(value / seconds, 2)
+
+        for (name, labels), (count, total, buckets) in sorted(histograms.items()):
+            data['histograms'].setdefault(name, []).append({
+                'labels': dict(labels),
+                'count': count,
+                'sum': round(total, 6),
+                'buckets': [['+Inf' if bound == float('inf') else bound, n]
+                            for bound, n in buckets],
+            })
+
+        return data
+
+    def write_json(self, path):
+        with open(path, 'w') as json_file:
+            json.dump(self.as_dict(), json_file, indent=4)
+
+    def prometheus_text(self):
+        data = self.as_dict()
+        lines = []
+
+        for name, series in data['counters'].items():
+            lines.append('# TYPE {}{} counter'.format(PROMETHEUS_PREFIX, name))
+
+            for item in series:
+                lines.append('{}{}{} {}'.format(
+                    PROMETHEUS_PREFIX, name, _labels(item['labels']), item['value']))
+
+        for name, series in data['histograms'].items():
+            lines.append('# TYPE {}{} histogram'.format(PROMETHEUS_PREFIX, name))
+
+            for item in series:
+                for bound, count in item['buckets']:
+                    labels = dict(item['labels'], le=str(bound))
+                    lines.append('{}{}_bucket{} {}'.format(
+                        PROMETHEUS_PREFIX, name, _labels(labels), count))
+
+                lines.append('{}{}_sum{} {}'.format(
+                    PROMETHEUS_PREFIX, name, _labels(item['labels']), item['sum']))
+                lines.append('{}{}_count{} {}'.format(
+                    PROMETHEUS_PREFIX, name, _labels(item['labels']), item['count']))
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """
+        Write the Prometheus textfile. It's written next to the target and
+        moved in place, so the collector never reads a partial file.
+        """
+        tmp_path = '{}.tmp'.format(path)
+
+        with open(tmp_path, 'w') as textfile:
+            textfile.write(self.prometheus_text())
+
+        os.replace(tmp_path, path)
+
+    def start_textfile(self, path, interval=DEFAULT_TEXTFILE_INTERVAL):
+        """Rewrite the Prometheus textfile every `interval` seconds."""
+        self.textfile_stop = threading.Event()
+
+        def write_periodically():
+            while not self.textfile_stop.wait(interval):
+                self.write_prometheus(path)
+
+        self.textfile_thread = threading.Thread(
+            target=write_periodically,
+            name='metrics-textfile',
+            daemon=True
+        )
+        self.textfile_thread.start()
+
+    def stop_textfile(self):
+        if self.textfile_thread is not None:
+            self.textfile_stop.set()
+            self.textfile_thread.join()
+            self.textfile_thread = None
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for key, value in labels.items()
+    ))
@@ -0,0 +1,195 @@
+"""
+Compiled jsonpath expressions.
+
+Most expressions used by workflow configs are plain dotted paths such as
+`$.listing_id` or `$[*].woocomm_listing_id`. Those are turned into a
+sequence of dict lookups and list expansions at load time and evaluated
+lazily, so taking the first match stops at the first match. Anything
+else (filters, descendants, slices with bounds, ...) falls back to a full
+jsonpath-ng evaluation.
+"""
+from functools import lru_cache
+
+from jsonpath_ng import parse
+from jsonpath_ng.jsonpath import (
+    Child,
+    Fields,
+    Root,
+    Slice,
+    auto_id_field,
+)
+
+
+FIELD = 0
+EACH = 1
+
+_MISSING = object()
+
+
+def _simple_ops(node, is_root=True):
+    """
+    Convert a parsed jsonpath expression into a list of simple operations,
+    or return None if the expression can't be evaluated by SimplePath.
+    """
+    if isinstance(node, Root):
+        return [] if is_root else None
+
+    if isinstance(node, Child):
+        left = _simple_ops(node.left, is_root)
+        right = _simple_ops(node.right, False)
+
+        if left is None or right is None:
+            return None
+
+        return left + right
+
+    if isinstance(node, Fields):
+        if len(node.fields) != 1:
+            return None
+
+        field = node.fields[0]
+
+        if field == '*' or field == auto_id_field:
+            return None
+
+        return [(FIELD, field)]
+
+    if isinstance(node, Slice):
+        if node.start is None and node.end is None and node.step is None:
+            return [(EACH, None)]
+
+    return None
+
+
+class JsonPath(object):
+    """Full jsonpath-ng evaluation of an expression."""
+
+    def __init__(self, expression, jsonpath_expr):
+        self.expression = expression
+        self.jsonpath_expr = jsonpath_expr
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.expression)
+
+    def iter_values(self, data):
+        return (match.value for match in self.jsonpath_expr.find(data))
+
+    def values(self, data):
+        """All matched values."""
+        return list(self.iter_values(data))
+
+    def first(self, data):
+        """First matched value, raises IndexError if nothing matched."""
+        for value in self.iter_values(data):
+            return value
+
+        raise IndexError(self.expression)
+
+    def first_truthy(self, data):
+        """First truthy matched value, raises IndexError if there is none."""
+        for value in self.iter_values(data):
+            if value:
+                return value
+
+        raise IndexError(self.expression)
+
+
+class SimplePath(JsonPath):
+    """
+    Direct dict/list evaluation of root, field and `[*]` expressions,
+    mirroring the way jsonpath-ng resolves them.
+    """
+
+    def __init__(self, expression, jsonpath_expr, ops):
+        super(SimplePath, self).__init__(expression, jsonpath_expr)
+        self.ops = tuple(ops)
+        self.fields = None
+
+        # Paths made of fields only have at most one match, which is
+        # resolved without going through a generator.
+        if all(op is FIELD for op, _ in self.ops):
+            self.fields = tuple(field for _, field in self.ops)
+
+    def iter_values(self, data):
+        return self._iter(data, 0)
+
+    def _resolve(self, value):
+        for field in self.fields:
+            try:
+                value = value.get(field, _MISSING)
+            except (TypeError, AttributeError):
+                return _MISSING
+
+            if value is _MISSING:
+                return _MISSING
+
+        return value
+
+    def first(self, data):
+        if self.fields is None:
+            return super(SimplePath, self).first(data)
+
+        value = self._resolve(data)
+
+        if value is _MISSING:
+            raise IndexError(self.expression)
+
+        return value
+
+    def first_truthy(self, data):
+        if self.fields is None:
+            return super(SimplePath, self).first_truthy(data)
+
+        value = self._resolve(data)
+
+        if value is _MISSING or not value:
+            raise IndexError(self.expression)
+
+        return value
+
+    def _iter(self, value, pos):
+        ops = self.ops
+        count = len(ops)
+
+        while pos < count:
+            op, field = ops[pos]
+            pos += 1
+
+            if op is FIELD:
+                try:
+                    value = value.get(field, _MISSING)
+                except (TypeError, AttributeError):
+                    return
+
+                if value is _MISSING:
+                    return
+            else:
+                if value is None:
+                    return
+
+                # jsonpath-ng treats a dict or a constant as a
+                # single-element list.
+                if isinstance(value, (dict, int, float, str, bool)):
+                    continue
+
+                for idx in range(len(value)):
+                    yield from self._iter(value[idx], pos)
+
+                return
+
+        yield value
+
+
+@lru_cache(maxsize=None)
+def compile_path(expression):
+    """
+    Compile a jsonpath expression string. Compiled paths are immutable and
+    shared between every step using the same expression.
+    """
+    jsonpath_expr = parse(expression)
+    ops = _simple_ops(jsonpath_expr)
+
+    if ops is None:
+        return JsonPath(expression, jsonpath_expr)
+
+    return SimplePath(expression, jsonpath_expr, ops)
@@ -0,0 +1,84 @@
+from collections import namedtuple
+
+from .paths import compile_path
+
+
+# A compiled workflow unit. Everything the handler needs while running a
+# unit is resolved once here, so execution never has to look at the raw
+# workflow document again apart from reading plain config values on `data`.
+Step = namedtuple('Step', [
+    'order',
+    'type',
+    'doc',
+    'data',
+    'handler',
+    'steps',
+    'get_data_on',
+    'store_data_on',
+    'vars',
+    'path',
+    'loop_path',
+    'key',
+])
+
+
+def split_data_path(path):
+    """
+    Split a dotted data path, e.g. "entity.woocomm_save_response", into
+    a tuple of keys. Returns None when no path is set.
+    """
+    if not path:
+        return None
+
+    return tuple(path.split('.'))
+
+
+def compile_vars(var_dict):
+    """Compile the jsonpath expression of every variable."""
+    if not var_dict:
+        return ()
+
+    return tuple((k, compile_path(v)) for k, v in var_dict.items())
+
+
+def compile_step(doc, unit_handlers, key='0'):
+    """
+    Compile a single workflow unit and all of its nested steps. `key` is
+    the position of the unit in the plan, e.g. "0.1" for the second nested
+    step of the first unit.
+    """
+    doc_data = doc.get('data', {})
+
+    return Step(
+        order=doc['order'],
+        type=doc['type'],
+        doc=doc,
+        data=doc_data,
+        handler=unit_handlers.get(doc['type']),
+        steps=compile_steps(doc_data.get('steps'), unit_handlers, key),
+        get_data_on=split_data_path(doc_data.get('get_data_on')),
+        store_data_on=split_data_path(doc_data.get('store_data_on')),
+        vars=compile_vars(doc_data.get('vars')),
+        path=compile_path(doc_data.get('path', '$')),
+        loop_path=compile_path(doc_data.get('loop_path', '$')),
+        key=key,
+    )
+
+
+def compile_steps(steps, unit_handlers, parent_key=None):
+    """
+    Compile a list of workflow units into a tuple of steps sorted by their
+    order number.
+    """
+    if not steps:
+        return ()
+
+    steps = sorted(steps, key=lambda k: k['order'])
+
+    return tuple(
+        compile_step(
+            doc,
+            unit_handlers,
+            str(idx) if parent_key is None else '{}.{}'.format(parent_key, idx)
+        ) for idx, doc in enumerate(steps)
+    )
@@ -0,0 +1,220 @@
+"""
+Variation pricing: Etsy offering prices converted to another currency and
+rounded up to the cent, the way a single price is with
+
+    Decimal(converter.convert(amount, currency, 'USD')).quantize(
+        Decimal('0.01'), rounding=ROUND_UP)
+
+Prices are read from the integer `amount` and `divisor` of the offering
+when it has them, instead of parsing the formatted price, and conversions
+go through the memoized rates of the shared converter.
+
+`page_variation_prices` prices the variations of a page of listings
+together. With a converter with `rate_pair`, like the shared RateProvider,
+the page is converted and rounded up as one vectorized pass over integer
+cents, otherwise every price goes through Decimal. Both give the same
+prices to the cent.
+"""
+import decimal
+import re
+
+import numpy
+
+
+CENT = decimal.Decimal('0.01')
+NOT_AMOUNT = re.compile(r'[^\d.]')
+
+# Converted prices from this many units up, or not above zero, are rounded
+# through Decimal, below it the cents fit int64 arithmetic comfortably.
+VECTOR_LIMIT = 2.0 ** 40
+
+# Batches of fewer prices go through Decimal, setting up the arrays costs
+# more than it saves on them.
+VECTOR_MIN_SIZE = 32
+
+# Integers below this are floats exactly.
+EXACT_LIMIT = 2 ** 53
+POWERS_OF_TEN = frozenset(10 ** power for power in range(16))
+
+
+def offering_amount(price):
+    """
+    Amount of an Etsy price object as (units, divisor) when it has them,
+    otherwise parsed from `currency_formatted_raw`.
+    """
+    amount = price.get('amount')
+    divisor = price.get('divisor')
+
+    if type(amount) is int and type(divisor) is int and divisor > 0 and abs(amount) < EXACT_LIMIT:
+        return amount, divisor
+
+    return decimal.Decimal(NOT_AMOUNT.sub('', price['currency_formatted_raw'])), None
+
+
+def decimal_cents(amount):
+    """
+    A parsed amount as (units, power of ten divisor), or None when it
+    isn't a finite amount.
+    """
+    sign, digits, exponent = amount.as_tuple()
+
+    if not isinstance(exponent, int):
+        return None
+
+    units = int(''.join(map(str, digits)) or '0') * (-1 if sign else 1)
+
+    if exponent > 0:
+        return units * 10 ** exponent, 1
+
+    return units, 10 ** -exponent
+
+
+def round_up(value):
+    """Price string of a converted amount, rounded up to the cent."""
+    return str(decimal.Decimal(value).quantize(CENT, rounding=decimal.ROUND_UP))
+
+
+def variation_offering_prices(data):
+    """
+    The price objects the variations of a listing are priced from: the
+    last offering of every product with property values and offerings.
+    """
+    return [
+        product['offerings'][-1]['price'] for product in data['products']
+        if type(product) is dict and product['property_values'] and product['offerings']
+    ]
+
+
+def usd_prices(prices, converter, new_currency='USD'):
+    """
+    Price strings of Etsy price objects converted with `converter` and
+    rounded up to the cent, vectorized for batches of VECTOR_MIN_SIZE and
+    up.
+    """
+    vectorizes = hasattr(converter, 'rate_pair') and \
+        getattr(getattr(converter, 'converter', None), 'cast', None) is float
+
+    if len(prices) >= VECTOR_MIN_SIZE and vectorizes:
+        return _usd_prices_vectorized(prices, converter, new_currency)
+
+    return [_usd_price(price, converter, new_currency) for price in prices]
+
+
+def page_variation_prices(listings, converter, new_currency='USD'):
+    """
+    Variation prices of a batch of listings, a list per listing in the
+    order `WooComm._generate_variations` uses them, all priced in one
+    `usd_prices` pass.
+    """
+    counts = []
+    prices = []
+
+    for listing in listings:
+        offering_prices = variation_offering_prices(listing)
+        counts.append(len(offering_prices))
+        prices.extend(offering_prices)
+
+    rounded = usd_prices(prices, converter, new_currency)
+    by_listing = []
+    start = 0
+
+    for count in counts:
+        by_listing.append(rounded[start:start + count])
+        start += count
+
+    return by_listing
+
+
+def _usd_price(price, converter, new_currency):
+    amount, divisor = offering_amount(price)
+
+    if divisor is not None:
+        amount = decimal.Decimal(amount) / decimal.Decimal(divisor)
+
+    return round_up(converter.convert(amount, price['currency_code'], new_currency))
+
+
+def _exact_amount(price):
+    """
+    (units, divisor) of a price when units / divisor as floats is the
+    float the Decimal path converts, else None. That holds for power of
+    ten divisors, the Decimal quotient is exact then.
+    """
+    amount = price.get('amount')
+    divisor = price.get('divisor')
+
+    if type(amount) is not int or type(divisor) is not int or divisor <= 0 or abs(amount) >= EXACT_LIMIT:
+        amount = decimal_cents(offering_amount(price)[0])
+
+        if amount is None:
+            return None
+
+        amount, divisor = amount
+
+    if divisor not in POWERS_OF_TEN or abs(amount) >= EXACT_LIMIT:
+        return None
+
+    return amount, divisor
+
+
+def _usd_prices_vectorized(prices, converter, new_currency):
+    rate_pairs = {}
+    units = []
+    divisors = []
+    from_rates = []
+    to_rates = []
+    exact = []
+
+    for price in prices:
+        amount = _exact_amount(price)
+
+        if amount is None:
+            amount = (0, 1)
+            rates = (1.0, 1.0)
+            exact.append(False)
+        else:
+            currency_code = price['currency_code']
+            rates = rate_pairs.get(currency_code)
+
+            if rates is None:
+                rates = rate_pairs[currency_code] = converter.rate_pair(currency_code, new_currency)
+
+            exact.append(True)
+
+        units.append(amount[0])
+        divisors.append(amount[1])
+        from_rates.append(rates[0])
+        to_rates.append(rates[1])
+
+    # Same operations in the same order as the converter does them, so
+    # every converted value is the same float.
+    values = numpy.array(units, dtype=float) / numpy.array(divisors, dtype=float) / \
+        numpy.array(from_rates) * numpy.array(to_rates)
+    vectorized = numpy.array(exact) & (values > 0) & (values < VECTOR_LIMIT)
+    cents = _cents_rounded_up(numpy.where(vectorized, values, 1.0)).tolist()
+    rounded = []
+
+    for price, cent, in_range in zip(prices, cents, vectorized.tolist()):
+        if in_range:
+            rounded.append('%d.%02d' % divmod(cent, 100))
+        else:
+            rounded.append(_usd_price(price, converter, new_currency))
+
+    return rounded
+
+
+def _cents_rounded_up(values):
+    """
+    Exact ceiling of `values` * 100 for values in (0, VECTOR_LIMIT). Every
+    float is mantissa * 2 ** -shift with an integer mantissa below 2 ** 53,
+    so the ceiling is taken on integers instead of on a rounded product.
+    """
+    fractions, exponents = numpy.frexp(values)
+    mantissas = numpy.ldexp(fractions, 53).astype(numpy.int64) * 100
+    shifts = 53 - exponents.astype(numpy.int64)
+    # Below 2 ** -62 of a cent the answer is one cent, the clipped shift
+    # keeps the integers in range.
+    clipped = numpy.minimum(shifts, 61)
+    cents = (mantissas + (numpy.left_shift(1, clipped) - 1)) >> clipped
+
+    return numpy.where(shifts > 61, 1, cents)
@@ -0,0 +1,128 @@
+"""
+Compact records for the variations WooComm shapes out of Etsy inventories.
+
+A variation dict, its attribute list and an attribute dict per option take
+close to a kilobyte per variation, held for every variable product of a
+page until it's posted. Records keep their fields in `__slots__`, option
+records are shared by every variation with the same attribute name and
+option, and their strings are interned.
+
+Records stand in for the dicts they replace up to the HTTP boundary, where
+`to_payload` turns them back into plain dicts; `json_default` does the
+same for `json.dumps`.
+
+Only what shaping builds is held as records. The listings a page is shaped
+from, offerings included, stay the dicts they were read as, and take most
+of the memory of a page.
+"""
+import sys
+
+
+OPTION_CACHE_SIZE = 65536
+
+_options = {}
+
+
+def intern_string(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+class Record(object):
+    __slots__ = ()
+
+    def as_dict(self):
+        """The payload of the record, fields in `__slots__` order."""
+        return {field: to_payload(getattr(self, field)) for field in self.__slots__}
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return self.as_dict() == to_payload(other)
+
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(field, getattr(self, field)) for field in self.__slots__))
+
+
+class AttributeOption(Record):
+    __slots__ = ('name', 'option')
+
+    def __init__(self, name, option):
+        """
+        One option of a variation attribute. Options are shared between
+        variations, get them through `attribute_option`.
+        """
+        self.name = intern_string(name)
+        self.option = intern_string(option)
+
+
+class Variation(Record):
+    __slots__ = ('regular_price', 'purchasable', 'stock_quantity', 'attributes')
+
+    def __init__(self, regular_price, stock_quantity, attributes, purchasable=True):
+        """
+        A variation of a variable product, `attributes` a tuple of
+        AttributeOption.
+        """
+        self.regular_price = intern_string(regular_price)
+        self.purchasable = purchasable
+        self.stock_quantity = stock_quantity
+        self.attributes = attributes
+
+
+def attribute_option(name, option):
+    """The AttributeOption of an attribute name and option."""
+    key = (name, option)
+
+    try:
+        found = _options.get(key)
+    except TypeError:
+        # Options that aren't strings or numbers aren't shared.
+        return AttributeOption(name, option)
+
+    if found is None:
+        if len(_options) >= OPTION_CACHE_SIZE:
+            _options.clear()
+
+        found = _options[key] = AttributeOption(name, option)
+
+    return found
+
+
+def to_payload(value):
+    """
+    `value` with every record in it turned into a dict and tuples into
+    lists, the way they'd come back from JSON. Lists and dicts without
+    records in them are returned as they are, not copied.
+    """
+    if isinstance(value, Record):
+        return value.as_dict()
+
+    if type(value) is list or type(value) is tuple:
+        converted = [to_payload(item) for item in value]
+
+        if type(value) is list and all(new is old for new, old in zip(converted, value)):
+            return value
+
+        return converted
+
+    if type(value) is dict:
+        converted = {key: to_payload(item) for key, item in value.items()}
+
+        if all(converted[key] is item for key, item in value.items()):
+            return value
+
+        return converted
+
+    return value
+
+
+def json_default(value):
+    """`default` of `json.dumps` for payloads that may hold records."""
+    if isinstance(value, Record):
+        return value.as_dict()
+
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import sqlite3
+import threading
+
+
+class StateStore(object):
+    def __init__(self, path):
+        """
+        Key/value store on a local SQLite file, keeping workflow state
+        between runs. Keys are grouped in namespaces and values are stored
+        as JSON. A single connection is shared by all threads of a run.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+        with self.lock, self.connection:
+            # WAL with normal sync keeps frequent small commits cheap while
+            # a crash still can't corrupt the file.
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS state ('
+                'namespace TEXT NOT NULL, '
+                'key TEXT NOT NULL, '
+                'value TEXT, '
+                'PRIMARY KEY (namespace, key))'
+            )
+
+    def get(self, namespace, key, default=None):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT value FROM state WHERE namespace = ? AND key = ?',
+                (namespace, key)
+            ).fetchone()
+
+        if row is None:
+            return default
+
+        return json.loads(row[0])
+
+    def items(self, namespace, prefix=''):
+        """All (key, value) pairs of a namespace whose key starts with `prefix`."""
+        query = 'SELECT key, value FROM state WHERE namespace = ?'
+        args = [namespace]
+
+        if prefix:
+            # A range instead of LIKE, so the primary key index is used and
+            # no characters of the prefix need escaping.
+            query += ' AND key >= ? AND key < ?'
+            args += [prefix, prefix + '\uffff']
+
+        with self.lock:
+            rows = self.connection.execute(query, args).fetchall()
+
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def put(self, namespace, key, value):
+        self.put_many(namespace, {key: value})
+
+    def put_many(self, namespace, values):
+        """Store every key and value of the dict in a single transaction."""
+        if not values:
+            return
+
+        rows = [(namespace, key, json.dumps(value)) for key, value in values.items()]
+
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)',
+                rows
+            )
+
+    def delete(self, namespace, key=None):
+        """Delete a key, or the whole namespace when no key is given."""
+        with self.lock, self.connection:
+            if key is None:
+                self.connection.execute(
+                    'DELETE FROM state WHERE namespace = ?', (namespace,))
+            else:
+                self.connection.execute(
+                    'DELETE FROM state WHERE namespace = ? AND key = ?',
+                    (namespace, key))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def payload_hash(payload):
+    """Stable hash of a JSON payload, independent of key order."""
+    payload_json = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+
+    return hashlib.sha256(payload_json.encode('utf-8')).hexdigest()
+
+
+class HashIndex(object):
+    def __init__(self, store, namespace):
+        """
+        Hashes of the payloads last sent for every key of a namespace, e.g.
+        the WooCommerce products of a shop by their id. The namespace is
+        read from the store once, updates are written through.
+        """
+        self.store = store
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.hashes = dict(store.items(namespace))
+
+    def unchanged(self, key, digest):
+        return self.hashes.get(key) == digest
+
+    def update(self, key, digest):
+        with self.lock:
+            self.hashes[key] = digest
+
+        self.store.put(self.namespace, key, digest)
@@ -0,0 +1,150 @@
+import decimal
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from . import currency
+from .connectors.woocomm import WooComm
+from .utils import form_doc
+
+
+DEFAULT_CHUNKSIZE = 16
+
+# Set up once in every transform worker process by `_init_worker`.
+_worker = {}
+
+
+def transform_product(woocomm, doc_data, data, prices=None):
+    """
+    Shape a listing into the product payload of a WooCommerce post or put
+    unit: custom structure, attributes, variations, USD price and the export
+    mapper. `data` itself is updated along the way, the mapped payload is
+    returned, or False when the unit has no export mapper. `prices` are
+    the variation prices when they're priced ahead.
+    """
+    custom = doc_data.get('custom')
+    generate_attributes = doc_data.get('generate_attributes', False)
+    generate_variations = doc_data.get('generate_variations', False)
+    image_size = doc_data.get('image_size', 'url_fullxfull')
+    formatted_object = data
+    tmp_data = False
+
+    # By default all products are simple products.
+    # And attributes is a list.
+    formatted_object['type'] = 'simple'
+    formatted_object['attributes'] = []
+
+    if custom:
+        formatted_object = woocomm._generate_custom_structure(
+            formatted_object,
+            image_size=image_size
+        )
+
+    if generate_attributes:
+        formatted_object = woocomm._generate_attributes(formatted_object)
+
+    if generate_variations:
+        formatted_object = woocomm._generate_variations(formatted_object, prices)
+
+    if doc_data.get('export_mapper'):
+        mapper = doc_data.get('export_mapper')
+        _map = mapper['map']
+        cconverter = currency.get_converter()
+        amount = formatted_object['price']
+        currency_code = formatted_object['currency_code']
+        amount_in_usd = cconverter.convert(amount, currency_code, 'USD')
+        D = decimal.Decimal
+        cent = D('0.01')
+        x = D(amount_in_usd)
+        formatted_object['price'] = str(x.quantize(cent,rounding=decimal.ROUND_UP))
+        mapped_obj = form_doc(formatted_object, _map)
+
+        if 'ignored_parts' in mapped_obj:
+            ignored_parts = mapped_obj.pop('ignored_parts')
+            mapped_obj = {**mapped_obj, **ignored_parts}
+
+        tmp_data = mapped_obj
+
+    return tmp_data
+
+
+def _init_worker(doc, setup, rates_snapshot):
+    if rates_snapshot:
+        currency.configure(snapshot_path=rates_snapshot)
+
+    if setup is not None:
+        setup()
+
+    doc_data = doc['data']
+    _worker['doc_data'] = doc_data
+    _worker['woocomm'] = WooComm(
+        doc,
+        url=doc_data.get('url'),
+        consumer_key=doc_data.get('consumer_key'),
+        consumer_secret=doc_data.get('consumer_secret'),
+    )
+
+
+def _transform_in_worker(data, prices=None):
+    tmp_data = transform_product(_worker['woocomm'], _worker['doc_data'], data, prices)
+
+    # The listing goes back as well, the unit's nested steps and variables
+    # see it the way the transform left it. Pickling both in one go keeps
+    # the values they share from being sent twice.
+    return data, tmp_data
+
+
+def _transform_chunk_in_worker(chunk):
+    """Shape a chunk of (listing, variation prices) pairs."""
+    return [_transform_in_worker(data, prices) for data, prices in chunk]
+
+
+class TransformPool(object):
+    def __init__(self, doc, max_workers, setup=None):
+        """
+        Process pool running `transform_product` for a WooCommerce unit, so
+        shaping large variation matrices uses every core instead of one.
+
+        The unit doc is handed to every worker once when it starts, after
+        that only the listings and the shaped payloads cross the process
+        boundary. Workers are spawned rather than forked since the handler
+        runs threads of its own. Workers load the currency rates from the
+        snapshot the parent is configured with, if any. `setup` is called
+        in every worker before anything else and has to be a module level
+        function.
+        """
+        self.executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(doc, setup, currency.snapshot_path())
+        )
+
+    def transform(self, data):
+        """
+        Shape a single listing in a worker. Returns the updated listing and
+        the mapped payload.
+        """
+        return self.submit(data).result()
+
+    def submit(self, data):
+        """Shape a single listing in a worker, returns the future of `transform`."""
+        return self.executor.submit(_transform_in_worker, data)
+
+    def map(self, items, prices=None, chunksize=DEFAULT_CHUNKSIZE):
+        """
+        Shape a batch of listings, sending them to the workers `chunksize`
+        at a time, with their variation `prices` when they're priced ahead,
+        see `pricing.page_variation_prices`. Yields (listing, payload) pairs
+        in order.
+        """
+        items = list(items)
+        pairs = list(zip(items, prices if prices is not None else [None] * len(items)))
+        chunks = self.executor.map(
+            _transform_chunk_in_worker,
+            [pairs[start:start + chunksize] for start in range(0, len(pairs), chunksize)]
+        )
+
+        return (shaped for chunk in chunks for shaped in chunk)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -1,5 +1,5 @@
 import re
-from functools import reduce
+from functools import lru_cache, reduce
 
 try:
     # Python 3
@@ -12,12 +12,20 @@ from . import mapper
 
 
 def form_doc(doc, mapping_json_str):
-    new_mapper = mapper.DataMapper(mapping_json_str)
+    new_mapper = mapper.compile_mapping(mapping_json_str)
     data = new_mapper.form_doc_dict(doc)
 
     return data
 
 
+def form_docs(docs, mapping_json_str, chunk_size=None):
+    """
+    Map an iterable of documents, or NDJSON lines, lazily with one mapper,
+    see DataMapper.form_docs.
+    """
+    return mapper.compile_mapping(mapping_json_str).form_docs(docs, chunk_size)
+
+
 def grouper(iterable, n, fillvalue=None):
     args = [iter(iterable)] * n
 
@@ -27,19 +35,80 @@ def grouper(iterable, n, fillvalue=None):
 as_list = lambda x: x if isinstance(x, list) else [x]
 
 
+# Backreferences by number or name, which would point at other groups once
+# the patterns are combined into one.
+BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+
+
+@lru_cache(maxsize=128)
+def combined_pattern(regexes):
+  """
+  A single pattern matching any of `regexes`, a tuple of regex strings,
+  tried in the order given at every position. None when they can't be
+  combined, e.g. patterns with backreferences or flags of their own.
+  """
+  if any(BACKREFERENCE.search(regex) for regex in regexes):
+    return None
+
+  try:
+    return re.compile('|'.join('(?:{})'.format(regex) for regex in regexes))
+  except re.error:
+    return None
+
+
+@lru_cache(maxsize=128)
+def regex_remover(regexes, single_pass=False):
+  """The RegexRemover of `regexes`, a tuple of regex strings, built once."""
+  return RegexRemover(list(regexes), single_pass=single_pass)
+
+
 class RegexRemover:
   """
   Removes predefined regex from given string.
   """
 
-  def __init__(self, regex_list_or_str):
+  def __init__(self, regex_list_or_str, single_pass=False):
     """
     :in regex_list_or_str either single regex string or a list of regex strings.
+    :in single_pass remove all regexes in one scan of the string.
+
+    The regexes are removed one after the other, so text left over by one
+    can be matched by the next. A single scan with all of them combined
+    first tells whether there's anything to remove at all, strings without
+    a match are returned as they are after that one scan.
+
+    With `single_pass` the combined scan removes, at every position, the
+    first regex matching there, and nothing else runs. That's faster on
+    strings with matches, but what gets removed can differ from removing
+    one regex after the other. Regexes that can't be combined are always
+    removed one after the other.
     """
-    self.regexes = [re.compile(regex) for regex in as_list(regex_list_or_str)]
+    regexes = tuple(as_list(regex_list_or_str))
+    self.regexes = [re.compile(regex) for regex in regexes]
+    self.pattern = combined_pattern(regexes)
+    self.single_pass = single_pass or len(self.regexes) == 1
+
+    if self.pattern is None and len(self.regexes) == 1:
+      self.pattern = self.regexes[0]
 
   def handle(self, string):
     """
     :out string with self.regexes removed
     """
-    return reduce(lambda s, r: re.sub(r, "", s), self.regexes, string)
+    if self.pattern is not None:
+      if self.single_pass:
+        return self.pattern.sub("", string)
+
+      if not self.pattern.search(string):
+        return string
+
+    return reduce(lambda s, r: r.sub("", s), self.regexes, string)
+
+  def handle_many(self, strings):
+    """
+    :in strings an iterable of strings, e.g. the descriptions of a page of listings
+    :out list of the strings with self.regexes removed
+    """
+    handle = self.handle
+
+    return [handle(string) for string in strings]